@@ -1,6 +1,16 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.db.backends.signals import connection_created
 
 
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self) -> None:
+        from helpers.metrics import install_channel_capacity_drop_counter, install_query_tracker
+        connection_created.connect(install_query_tracker, dispatch_uid="install_query_tracker")
+        install_channel_capacity_drop_counter()
+        if getattr(settings, "SLOW_QUERY_LOG_PATH", None):
+            from helpers.slow_queries import install_slow_query_logger
+            connection_created.connect(install_slow_query_logger, dispatch_uid="install_slow_query_logger")
@@ -0,0 +1,130 @@
+import time
+from typing import Any, Callable, List, Optional
+from asgiref.sync import sync_to_async
+from django.db import models
+from django.http import HttpRequest, HttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.exceptions import APIException
+from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from helpers.metrics import current_request_metrics
+
+
+
+class AsyncListMixin:
+    """
+    Mixin for DRF list views that serves list (GET) requests natively under ASGI.
+
+    DRF views are synchronous, so under ASGI each request occupies a thread of the
+    sync-to-async pool for its whole duration, including database round trips. List requests
+    served by the view returned by `as_async_view` use the async queryset API instead,
+    so that they only cost a coroutine while waiting on the database.
+
+    Only the common case is served asynchronously: JSON requests with a valid API key and
+    without an "Authorization" header. All other requests, including writes, browsable API
+    requests and requests with invalid credentials, are delegated to the DRF view,
+    so that they are handled exactly as before.
+
+    Permissions of the view should implement `ahas_permission` if checking them requires I/O.
+    """
+    async_renderer = JSONRenderer()
+
+    @classmethod
+    def as_async_view(cls, **initkwargs: Any) -> Callable:
+        """Returns an async view that serves list requests asynchronously and delegates other requests to the DRF view"""
+        sync_view = sync_to_async(cls.as_view(**initkwargs))
+
+        async def view(request: HttpRequest, *args: Any, **kwargs: Any) -> HttpResponse:
+            if request.method == "GET" and cls.can_list_async(request):
+                self = cls(**initkwargs)
+                response = await self.alist(request, *args, **kwargs)
+                if response is not None:
+                    return response
+            return await sync_view(request, *args, **kwargs)
+
+        view.cls = cls
+        view.initkwargs = initkwargs
+        return csrf_exempt(view)
+
+
+    @classmethod
+    def can_list_async(cls, request: HttpRequest) -> bool:
+        """Whether a list request can be served asynchronously, or should be delegated to the DRF view"""
+        if "Authorization" in request.headers:
+            return False
+        if request.GET.get("format", "json") != "json":
+            return False
+        # Browsable API requests
+        return "text/html" not in request.headers.get("Accept", "")
+
+
+    async def acheck_permissions(self) -> bool:
+        for permission in self.get_permissions():
+            if hasattr(permission, "ahas_permission"):
+                allowed = await permission.ahas_permission(self.request, self)
+            else:
+                allowed = permission.has_permission(self.request, self)
+            if not allowed:
+                return False
+        return True
+
+
+    async def apaginate_queryset(self, queryset: models.QuerySet) -> Optional[List[Any]]:
+        """
+        Async version of `paginate_queryset`, for limit/offset pagination.
+
+        Returns None if the view uses another pagination class.
+        """
+        paginator = self.paginator
+        if paginator is None:
+            return [obj async for obj in queryset.aiterator()]
+        if type(paginator) is not LimitOffsetPagination:
+            return None
+
+        paginator.request = self.request
+        paginator.limit = paginator.get_limit(self.request)
+        paginator.count = await queryset.acount()
+        paginator.offset = paginator.get_offset(self.request)
+        if paginator.count == 0 or paginator.offset > paginator.count:
+            return []
+        page = queryset[paginator.offset:paginator.offset + paginator.limit]
+        return [obj async for obj in page.aiterator()]
+
+
+    async def alist(self, request: HttpRequest, *args: Any, **kwargs: Any) -> Optional[HttpResponse]:
+        """
+        Serve a list request asynchronously.
+
+        Returns None if the request should be delegated to the DRF view instead.
+        """
+        self.args = args
+        self.kwargs = kwargs
+        self.format_kwarg = None
+        # No authenticators, the request is anonymous
+        self.request = Request(request)
+        self.headers = {}
+        if not await self.acheck_permissions():
+            # Let the DRF view respond with the appropriate error
+            return None
+
+        try:
+            queryset = self.filter_queryset(self.get_queryset())
+        except APIException:
+            # Let the DRF view respond with the appropriate error, e.g. for invalid filters
+            return None
+        objs = await self.apaginate_queryset(queryset)
+        if objs is None:
+            return None
+        # Objects are fully loaded, so serialization does not access the database
+        data = self.get_serializer(objs, many=True).data
+        if self.paginator is not None:
+            data = self.paginator.get_paginated_response(data).data
+
+        start = time.perf_counter()
+        content = self.async_renderer.render(data)
+        metrics = current_request_metrics.get()
+        if metrics is not None:
+            metrics.render_duration += time.perf_counter() - start
+        return HttpResponse(content, content_type=self.async_renderer.media_type)
@@ -0,0 +1,163 @@
+import contextvars
+import hashlib
+import random
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+from django.http import HttpRequest
+
+from helpers.logging import log_exception
+from helpers.metrics import db_replica_lag_seconds
+
+
+# Database that reads of the current request are routed to. None routes reads to the primary database.
+current_read_database: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("current_read_database", default=None)
+
+# Replication lag of each replica in seconds, or None if the replica is unavailable,
+# with the time it was last checked
+_replica_lags: Dict[str, Tuple[Optional[float], float]] = {}
+_replica_lags_lock = threading.Lock()
+
+REPLICA_PIN_CACHE_KEY = "replica-pin:{client}"
+
+# Returns NULL if the lag is unknown: when the replica is not streaming from the primary, as it may then
+# be arbitrarily behind while having replayed everything it received, or when nothing was replayed yet
+POSTGRESQL_REPLICATION_LAG_SQL = """
+SELECT CASE
+    WHEN NOT pg_is_in_recovery() THEN 0
+    WHEN NOT EXISTS (SELECT 1 FROM pg_stat_wal_receiver WHERE status = 'streaming') THEN NULL
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+END
+"""
+
+# Apps whose models are always read from the primary database. API keys and auth tokens
+# authenticate requests, so a key or token that was just created, or revoked, should take effect at once.
+PRIMARY_READ_APP_LABELS = ("rest_framework_api_key", "tokens")
+
+
+def get_replica_databases() -> List[str]:
+    return list(getattr(settings, "REPLICA_DATABASES", []))
+
+
+def get_replication_lag(alias: str) -> Optional[float]:
+    """
+    Returns the replication lag of a replica database in seconds, or None if it is unavailable.
+
+    On PostgreSQL, the lag is the time since the last replayed transaction, or 0 if the replica
+    has replayed everything it received. A replica that is not streaming from the primary is unavailable.
+    Other databases are assumed to have no lag.
+    """
+    connection = connections[alias]
+    if connection.vendor != "postgresql":
+        return 0.0
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(POSTGRESQL_REPLICATION_LAG_SQL)
+            lag = cursor.fetchone()[0]
+    except Exception as exc:
+        log_exception(exc)
+        return None
+    return float(lag) if lag is not None else None
+
+
+def get_cached_replication_lag(alias: str) -> Optional[float]:
+    """Returns the replication lag of a replica, checking it at most every `REPLICA_LAG_CHECK_INTERVAL` seconds"""
+    interval = getattr(settings, "REPLICA_LAG_CHECK_INTERVAL", 1.0)
+    lag, checked_at = _replica_lags.get(alias, (None, 0.0))
+    if time.monotonic() - checked_at < interval:
+        return lag
+
+    with _replica_lags_lock:
+        lag, checked_at = _replica_lags.get(alias, (None, 0.0))
+        if time.monotonic() - checked_at < interval:
+            # Checked by another thread meanwhile
+            return lag
+        lag = get_replication_lag(alias)
+        _replica_lags[alias] = (lag, time.monotonic())
+    if lag is not None:
+        db_replica_lag_seconds.labels(alias).set(lag)
+    return lag
+
+
+def choose_replica() -> Optional[str]:
+    """Returns a random replica whose lag is within `REPLICA_MAX_LAG_SECONDS`, or None if there is none"""
+    max_lag = getattr(settings, "REPLICA_MAX_LAG_SECONDS", 5.0)
+    replicas = []
+    for alias in get_replica_databases():
+        lag = get_cached_replication_lag(alias)
+        if lag is not None and lag <= max_lag:
+            replicas.append(alias)
+    return random.choice(replicas) if replicas else None
+
+
+def get_client_id(request: HttpRequest) -> str:
+    """
+    Returns an identifier of the client that made the request, for read-your-writes stickiness.
+
+    Clients are identified by the prefix of their API key, their auth token, or their IP address.
+    """
+    api_key = request.headers.get("X-API-KEY")
+    if api_key:
+        return "key:" + api_key.partition(".")[0]
+    authorization = request.headers.get("Authorization")
+    if authorization:
+        return "auth:" + hashlib.sha256(authorization.encode()).hexdigest()[:32]
+    return "ip:" + request.META.get("REMOTE_ADDR", "")
+
+
+def pin_client_to_primary(request: HttpRequest) -> None:
+    """Route the client's reads to the primary database for `REPLICA_STICKY_SECONDS`, so that it reads its own writes"""
+    timeout = getattr(settings, "REPLICA_STICKY_SECONDS", 10)
+    caches["default"].set(REPLICA_PIN_CACHE_KEY.format(client=get_client_id(request)), True, timeout=timeout)
+    return None
+
+
+def is_client_pinned_to_primary(request: HttpRequest) -> bool:
+    return caches["default"].get(REPLICA_PIN_CACHE_KEY.format(client=get_client_id(request))) is not None
+
+
+def get_read_database(request: HttpRequest) -> Optional[str]:
+    """
+    Returns the replica that reads of the request should be routed to, or None to read from the primary.
+
+    Only safe requests to the paths in `REPLICA_READ_PATHS` are routed to replicas,
+    unless the client wrote recently.
+    """
+    if request.method not in ("GET", "HEAD", "OPTIONS"):
+        return None
+    if not request.path.startswith(tuple(getattr(settings, "REPLICA_READ_PATHS", ()))):
+        return None
+    if is_client_pinned_to_primary(request):
+        return None
+    return choose_replica()
+
+
+
+class ReplicaRouter:
+    """
+    Routes reads to the replica chosen for the current request by `ReplicaRoutingMiddleware`.
+
+    Writes, reads outside of requests routed to a replica, and reads of the models
+    of `PRIMARY_READ_APP_LABELS` go to the default database.
+    """
+
+    def db_for_read(self, model: Any, **hints: Any) -> Optional[str]:
+        if model._meta.app_label in PRIMARY_READ_APP_LABELS:
+            return "default"
+        return current_read_database.get()
+
+
+    def db_for_write(self, model: Any, **hints: Any) -> Optional[str]:
+        return "default"
+
+
+    def allow_relation(self, obj1: Any, obj2: Any, **hints: Any) -> Optional[bool]:
+        # Replicas hold the same data as the primary database
+        databases = {"default", *get_replica_databases()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
@@ -0,0 +1,120 @@
+import functools
+import hashlib
+import json
+from typing import Any, Callable, Dict, Optional
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework import response, status
+from rest_framework.request import Request
+
+from helpers.metrics import idempotent_replays_total
+from .db_routers import get_client_id
+
+
+IDEMPOTENCY_KEY_HEADER = "Idempotency-Key"
+IDEMPOTENT_REPLAYED_HEADER = "Idempotent-Replayed"
+IDEMPOTENCY_CACHE_KEY = "idempotency:{client}:{method}:{path}:{key}"
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+# Seconds a key stays claimed by a request being handled, in case the process dies while handling it
+IDEMPOTENCY_CLAIM_TIMEOUT = 60
+
+
+def get_request_fingerprint(request: Request) -> str:
+    """Returns a hash of the request data, to detect reuse of an idempotency key for a different request"""
+    data = json.dumps(request.data, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def get_idempotency_cache_key(request: Request, key: str) -> str:
+    return IDEMPOTENCY_CACHE_KEY.format(
+        client=get_client_id(request),
+        method=request.method,
+        path=request.path,
+        key=hashlib.sha256(key.encode()).hexdigest(),
+    )
+
+
+def get_stored_response(view: Any, entry: Dict, fingerprint: str) -> response.Response:
+    """Returns the response to a request whose idempotency key was already used"""
+    if entry["fingerprint"] != fingerprint:
+        return response.Response(
+            data={
+                "status": "error",
+                "message": f"The {IDEMPOTENCY_KEY_HEADER} was already used for a different request!"
+            },
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY
+        )
+    if entry["status"] is None:
+        return response.Response(
+            data={
+                "status": "error",
+                "message": f"A request with the same {IDEMPOTENCY_KEY_HEADER} is still being processed!"
+            },
+            status=status.HTTP_409_CONFLICT
+        )
+
+    idempotent_replays_total.labels(type(view).__name__).inc()
+    return response.Response(
+        data=entry["data"],
+        status=entry["status"],
+        headers={IDEMPOTENT_REPLAYED_HEADER: "true"}
+    )
+
+
+def idempotent(handler: Callable) -> Callable:
+    """
+    Decorator for DRF view handlers (e.g. `post`) that supports the "Idempotency-Key" request header.
+
+    The response to the first request with a key is stored for `IDEMPOTENCY_KEY_TTL` seconds.
+    Retries of the request with the same key, by the same client, are answered with the stored
+    response instead of being handled again, with the "Idempotent-Replayed" header set.
+
+    A retry that arrives while the first request is still being handled is rejected with 409,
+    and reusing a key for a request with different data is rejected with 422. Responses with
+    a 5xx status code are not stored, so that the request can be retried.
+
+    Requests without the header are handled as usual.
+    """
+    @functools.wraps(handler)
+    def wrapper(view: Any, request: Request, *args: Any, **kwargs: Any) -> response.Response:
+        key: Optional[str] = request.headers.get(IDEMPOTENCY_KEY_HEADER)
+        if not key:
+            return handler(view, request, *args, **kwargs)
+        if len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+            return response.Response(
+                data={
+                    "status": "error",
+                    "message": f"{IDEMPOTENCY_KEY_HEADER} must be at most {IDEMPOTENCY_KEY_MAX_LENGTH} characters long!"
+                },
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        cache = caches["default"]
+        cache_key = get_idempotency_cache_key(request, key)
+        fingerprint = get_request_fingerprint(request)
+        # Claim the key, so that concurrent retries are not handled twice
+        claim = {"fingerprint": fingerprint, "status": None, "data": None}
+        if not cache.add(cache_key, claim, timeout=IDEMPOTENCY_CLAIM_TIMEOUT):
+            entry = cache.get(cache_key)
+            if entry is not None:
+                return get_stored_response(view, entry, fingerprint)
+            # Expired meanwhile
+            cache.set(cache_key, claim, timeout=IDEMPOTENCY_CLAIM_TIMEOUT)
+
+        try:
+            resp = handler(view, request, *args, **kwargs)
+        except BaseException:
+            cache.delete(cache_key)
+            raise
+        if resp.status_code >= 500:
+            cache.delete(cache_key)
+            return resp
+
+        cache.set(
+            cache_key,
+            {"fingerprint": fingerprint, "status": resp.status_code, "data": resp.data},
+            timeout=settings.IDEMPOTENCY_KEY_TTL
+        )
+        return resp
+
+    return wrapper
@@ -0,0 +1,74 @@
+import statistics
+from typing import Any, Dict, List, Tuple
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+
+from helpers.slow_queries import read_slow_query_log
+
+
+SORT_KEYS = ("total", "max", "mean", "count")
+
+
+class Command(BaseCommand):
+    help = "Summarize the slow query log, grouping queries by tag (e.g. filter signature) and SQL."
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "--path",
+            default=None,
+            help="Path to the slow query log. Defaults to `settings.SLOW_QUERY_LOG_PATH`."
+        )
+        parser.add_argument(
+            "--sort",
+            choices=SORT_KEYS,
+            default="total",
+            help="Order the worst offenders by total, max or mean duration, or by count"
+        )
+        parser.add_argument("--limit", type=int, default=10, help="Number of offenders to show")
+        parser.add_argument("--show-sql", action="store_true", help="Show the SQL of each offender")
+        parser.add_argument("--show-plan", action="store_true", help="Show the slowest captured plan of each offender")
+
+    def handle(self, *args, **options) -> None:
+        path = options["path"] or getattr(settings, "SLOW_QUERY_LOG_PATH", None)
+        if not path:
+            raise CommandError("No slow query log path provided and `SLOW_QUERY_LOG_PATH` is not set.")
+        try:
+            entries = read_slow_query_log(path)
+        except OSError as exc:
+            raise CommandError(str(exc))
+        if not entries:
+            self.stdout.write("No slow queries logged.")
+            return
+
+        groups: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+        for entry in entries:
+            groups.setdefault((entry.get("tag") or "untagged", entry["sql"]), []).append(entry)
+
+        summaries = []
+        for (tag, sql), group in groups.items():
+            durations = sorted(entry["duration_ms"] for entry in group)
+            plans = [entry for entry in group if entry.get("plan")]
+            summaries.append({
+                "tag": tag,
+                "sql": sql,
+                "count": len(durations),
+                "total": sum(durations),
+                "mean": statistics.fmean(durations),
+                "p95": durations[min(len(durations) - 1, int(len(durations) * 0.95))],
+                "max": durations[-1],
+                "plan": max(plans, key=lambda entry: entry["duration_ms"])["plan"] if plans else None,
+            })
+        summaries.sort(key=lambda summary: summary[options["sort"]], reverse=True)
+
+        self.stdout.write(f"{len(entries)} slow queries in {len(summaries)} groups. Worst offenders by {options['sort']}:\n")
+        for rank, summary in enumerate(summaries[:options["limit"]], start=1):
+            self.stdout.write(self.style.WARNING(f"{rank}. {summary['tag']}"))
+            self.stdout.write(
+                f"   count={summary['count']} total={summary['total']:.1f}ms mean={summary['mean']:.1f}ms "
+                f"p95={summary['p95']:.1f}ms max={summary['max']:.1f}ms plans={'yes' if summary['plan'] else 'no'}"
+            )
+            if options["show_sql"]:
+                self.stdout.write(f"   {summary['sql']}")
+            if options["show_plan"] and summary["plan"]:
+                for line in summary["plan"].splitlines():
+                    self.stdout.write(f"   | {line}")
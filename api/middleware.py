@@ -0,0 +1,371 @@
+import os
+import random
+import re
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+from asgiref.sync import async_to_sync, iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpRequest, HttpResponse
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+from helpers.metrics import (
+    RequestMetrics, current_request_metrics, http_requests_total, http_request_duration_seconds, 
+    http_request_db_queries, http_request_db_duration_seconds, http_request_serializer_duration_seconds, 
+    http_request_render_duration_seconds, db_reads_total
+)
+from helpers.tracing import Trace, current_trace, record_span, tracing_enabled
+from helpers.profiling import PROFILING_MODES, get_profile_name, prune_profiles, run_profiled, write_profile_metadata
+from helpers.logging import log_exception
+from .authentication import AuthTokenAuthentication
+from .db_routers import current_read_database, get_read_database, get_replica_databases, pin_client_to_primary
+
+
+TRACE_ID_HEADER = "X-Trace-Id"
+TRACE_ID_PATTERN = re.compile(r"^[A-Za-z0-9-]{1,64}$")
+
+
+def get_view_name(request: HttpRequest) -> str:
+    """Returns the name of the view that handled the request, for use as a metric label"""
+    resolver_match = getattr(request, "resolver_match", None)
+    if resolver_match is None:
+        # Limit label cardinality by grouping all unresolved requests
+        return "unresolved"
+    return resolver_match.view_name
+
+
+
+class RequestMetricsMiddleware:
+    """
+    Records per view metrics of each request: 
+    total latency, database query count and time, serializer time and render time.
+
+    Should be placed first in `settings.MIDDLEWARE` so that the latency of all other middleware is included.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response: Callable) -> None:
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        if self.async_mode:
+            return self.__acall__(request)
+        
+        metrics = RequestMetrics()
+        token = current_request_metrics.set(metrics)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_request_metrics.reset(token)
+        self.record(request, response, metrics, time.perf_counter() - start)
+        return response
+    
+
+    async def __acall__(self, request: HttpRequest) -> HttpResponse:
+        metrics = RequestMetrics()
+        token = current_request_metrics.set(metrics)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_request_metrics.reset(token)
+        self.record(request, response, metrics, time.perf_counter() - start)
+        return response
+    
+
+    def record(self, request: HttpRequest, response: HttpResponse, metrics: RequestMetrics, duration: float) -> None:
+        view = get_view_name(request)
+        method = request.method
+        http_requests_total.labels(view, method, response.status_code).inc()
+        http_request_duration_seconds.labels(view, method).observe(duration)
+        http_request_db_queries.labels(view, method).observe(metrics.db_queries)
+        http_request_db_duration_seconds.labels(view, method).observe(metrics.db_duration)
+        http_request_serializer_duration_seconds.labels(view, method).observe(metrics.serializer_duration)
+        http_request_render_duration_seconds.labels(view, method).observe(metrics.render_duration)
+        return None
+    
+
+    def process_template_response(self, request: HttpRequest, response: HttpResponse) -> HttpResponse:
+        # Template responses, like DRF responses, are rendered after this hook is called
+        metrics = current_request_metrics.get()
+        if metrics is None:
+            return response
+        
+        start = time.perf_counter()
+        def record_render_duration(response: HttpResponse) -> None:
+            metrics.render_duration += time.perf_counter() - start
+        response.add_post_render_callback(record_render_duration)
+        return response
+
+
+
+class TracingMiddleware:
+    """
+    Starts a trace for each write request (POST, PUT, PATCH and DELETE), so that the
+    time from receiving a write to delivering the resulting updates via websocket can be measured.
+
+    A trace id provided by the client in the "X-Trace-Id" header is used if valid. 
+    The trace id is returned in the same header of the response.
+
+    Should be placed early in `settings.MIDDLEWARE`, so that the time spent in other middleware is included.
+    """
+    write_methods = ("POST", "PUT", "PATCH", "DELETE")
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response: Callable) -> None:
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        if self.async_mode:
+            return self.__acall__(request)
+        if request.method not in self.write_methods or not tracing_enabled():
+            return self.get_response(request)
+        
+        trace = self.start_trace(request)
+        token = current_trace.set(trace)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_trace.reset(token)
+        self.finish_trace(trace, request, response)
+        return response
+    
+
+    async def __acall__(self, request: HttpRequest) -> HttpResponse:
+        if request.method not in self.write_methods or not tracing_enabled():
+            return await self.get_response(request)
+        
+        trace = self.start_trace(request)
+        token = current_trace.set(trace)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_trace.reset(token)
+        self.finish_trace(trace, request, response)
+        return response
+    
+
+    def start_trace(self, request: HttpRequest) -> Trace:
+        trace = Trace()
+        trace_id = request.headers.get(TRACE_ID_HEADER, "")
+        if TRACE_ID_PATTERN.match(trace_id):
+            trace.trace_id = trace_id
+        return trace
+    
+
+    def finish_trace(self, trace: Trace, request: HttpRequest, response: HttpResponse) -> None:
+        record_span(
+            trace.trace_id, 
+            "http_request", 
+            trace.received_ns, 
+            view=get_view_name(request), 
+            method=request.method, 
+            status=response.status_code
+        )
+        response[TRACE_ID_HEADER] = trace.trace_id
+        return None
+
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Chooses the database that reads of each request are routed to by `api.db_routers.ReplicaRouter`.
+
+    Safe requests to the paths in `settings.REPLICA_READ_PATHS` read from a replica whose replication
+    lag is within `settings.REPLICA_MAX_LAG_SECONDS`, or from the primary database if there is none.
+    After a successful write, the client reads from the primary database for `settings.REPLICA_STICKY_SECONDS`,
+    so that it reads its own writes.
+
+    Not used if `settings.REPLICA_DATABASES` is empty.
+    """
+    safe_methods = ("GET", "HEAD", "OPTIONS")
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response: Callable) -> None:
+        if not get_replica_databases():
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        if self.async_mode:
+            return self.__acall__(request)
+        
+        alias = self.get_read_database(request)
+        token = current_read_database.set(alias)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_read_database.reset(token)
+        if self.should_pin(request, response):
+            pin_client_to_primary(request)
+        return response
+    
+
+    async def __acall__(self, request: HttpRequest) -> HttpResponse:
+        alias = None
+        if request.method in self.safe_methods:
+            # Checking for a pin and the replication lag may require I/O
+            alias = await sync_to_async(self.get_read_database)(request)
+        token = current_read_database.set(alias)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_read_database.reset(token)
+        if self.should_pin(request, response):
+            await sync_to_async(pin_client_to_primary)(request)
+        return response
+    
+
+    def get_read_database(self, request: HttpRequest) -> Optional[str]:
+        if request.method not in self.safe_methods:
+            return None
+        alias = get_read_database(request)
+        if request.path.startswith(tuple(settings.REPLICA_READ_PATHS)):
+            db_reads_total.labels(alias or "default").inc()
+        return alias
+    
+
+    def should_pin(self, request: HttpRequest, response: HttpResponse) -> bool:
+        return request.method not in self.safe_methods and response.status_code < 400
+
+
+
+class ProfilingMiddleware:
+    """
+    Profiles views on demand and writes the profiles to `settings.PROFILING_DIR`.
+
+    A request is profiled if:
+    - It has an "X-Profile" header and is authenticated as a staff user with an auth token.
+    The header value may be "cprofile" or "sample" to choose the profiling mode.
+    - Or it is randomly sampled, at the rate set by `settings.PROFILING_SAMPLE_RATE`.
+
+    In "cprofile" mode, `pstats` files are written. In "sample" mode, the call stack
+    is sampled periodically and written as collapsed stacks, for flame graphs.
+    Each profile has a JSON file with the view name, query params and duration of the request.
+    The oldest profiles are deleted to keep within `settings.PROFILING_MAX_FILES` 
+    and `settings.PROFILING_MAX_BYTES`.
+
+    The middleware is disabled if `settings.PROFILING_DIR` is not set. When enabled, it runs
+    synchronously, so async views are run in a thread while profiled.
+    Should be placed last in `settings.MIDDLEWARE`, as it calls the view itself.
+    """
+    header = "X-Profile"
+
+    def __init__(self, get_response: Callable) -> None:
+        self.directory = getattr(settings, "PROFILING_DIR", None)
+        if not self.directory:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, "PROFILING_SAMPLE_RATE", 0.0)
+        self.default_mode = getattr(settings, "PROFILING_MODE", "cprofile")
+        self.max_files = getattr(settings, "PROFILING_MAX_FILES", 200)
+        self.max_bytes = getattr(settings, "PROFILING_MAX_BYTES", 100 * 1024 * 1024)
+        os.makedirs(self.directory, exist_ok=True)
+
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        return self.get_response(request)
+    
+
+    def get_profiling_mode(self, request: HttpRequest) -> Optional[str]:
+        """Returns the mode to profile the request in, or None if the request should not be profiled"""
+        requested_mode = request.headers.get(self.header)
+        if requested_mode is not None:
+            try:
+                result = AuthTokenAuthentication().authenticate(request)
+            except Exception:
+                return None
+            if result is None or not result[0].is_staff:
+                return None
+            return requested_mode.lower() if requested_mode.lower() in PROFILING_MODES else self.default_mode
+        
+        if self.sample_rate and random.random() < self.sample_rate:
+            return self.default_mode
+        return None
+    
+
+    def process_view(
+        self, 
+        request: HttpRequest, 
+        view_func: Callable, 
+        view_args: Tuple[Any, ...], 
+        view_kwargs: Dict[str, Any]
+    ) -> Optional[HttpResponse]:
+        mode = self.get_profiling_mode(request)
+        if mode is None:
+            return None
+        
+        if iscoroutinefunction(view_func):
+            view_func = async_to_sync(view_func)
+        view_name = get_view_name(request)
+        name = get_profile_name(view_name, request.META.get("QUERY_STRING", ""))
+        start = time.perf_counter()
+        response, path = run_profiled(mode, os.path.join(self.directory, name), view_func, request, *view_args, **view_kwargs)
+        duration = time.perf_counter() - start
+        try:
+            write_profile_metadata(path, {
+                "view": view_name,
+                "method": request.method,
+                "path": request.path,
+                "query_params": request.GET.dict(),
+                "mode": mode,
+                "status": response.status_code,
+                "duration_ms": duration * 1000,
+            })
+            prune_profiles(self.directory, self.max_files, self.max_bytes)
+        except OSError as exc:
+            log_exception(exc)
+        response["X-Profile-Id"] = name
+        return response
+
+
+
+class AsyncWhiteNoiseMiddleware(WhiteNoiseMiddleware):
+    """
+    `WhiteNoiseMiddleware` that also supports async requests.
+
+    WhiteNoise middleware is sync only, which makes Django run every request that passes
+    through it, and so the views of async requests, in a thread. In async mode, only
+    requests for static files are served in a thread.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response: Callable, settings: Any = settings) -> None:
+        super().__init__(get_response, settings=settings)
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        if self.async_mode:
+            return self.__acall__(request)
+        return super().__call__(request)
+    
+
+    async def __acall__(self, request: HttpRequest) -> HttpResponse:
+        if self.autorefresh:
+            # Looks up files on disk
+            static_file = await sync_to_async(self.find_file)(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return await sync_to_async(self.serve)(static_file, request)
+        return await self.get_response(request)
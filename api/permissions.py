@@ -1,3 +1,4 @@
+from asgiref.sync import sync_to_async
 from rest_framework_api_key.permissions import HasAPIKey as BaseHasAPIKey
 
 
@@ -6,5 +7,31 @@ class HasAPIKey(BaseHasAPIKey):
     """Permits only requests made a valid API key"""
     message = "Unauthorized request!"
 
+    def has_object_permission(self, request, view, obj) -> bool:
+        # The key was already verified by `has_permission` for this request.
+        # Verifying it again would hash the key a second time.
+        return True
+
+
+    async def ahas_permission(self, request, view) -> bool:
+        """
+        Async version of `has_permission`, for async views.
+
+        The key is looked up using the async ORM. Verifying the key hashes it, which is
+        CPU bound, so verification runs in the default executor instead of the event loop.
+        """
+        key = self.get_key(request)
+        if not key:
+            return False
+
+        prefix, _, _ = key.partition(".")
+        try:
+            api_key = await self.model.objects.get_usable_keys().aget(prefix=prefix)
+        except self.model.DoesNotExist:
+            return False
+
+        is_valid = await sync_to_async(api_key.is_valid, thread_sensitive=False)(key)
+        return is_valid and not api_key.has_expired
+
 
 
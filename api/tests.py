@@ -0,0 +1,332 @@
+import io
+import json
+import os
+import pstats
+import re
+import shutil
+import tempfile
+import threading
+import time
+from typing import Any
+from unittest import mock
+from django.contrib.auth import get_user_model
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import SimpleTestCase
+from django.test.utils import CaptureQueriesContext
+from prometheus_client import REGISTRY
+
+from api.middleware import ProfilingMiddleware
+from benchmarks.data import clear_data, seed_data
+from currency.models import Currency
+from helpers.db_pool import ConnectionPool, PoolTimeout
+from helpers.profiling import get_profile_name, prune_profiles, run_profiled
+from helpers.slow_queries import install_slow_query_logger, log_slow_query, read_slow_query_log, tag_queries
+from helpers.testing import BudgetTestCase
+
+
+CURRENCIES_URL = "/api/v1/currencies/"
+METRICS_URL = "/metrics"
+
+
+
+class RequestMetricsTests(BudgetTestCase):
+    """Per view request metrics recorded by `RequestMetricsMiddleware` and exposed by `MetricsAPIView`"""
+
+    view = "api:currencies:currency__list-create"
+
+    def setUp(self) -> None:
+        super().setUp()
+        clear_data()
+        seed_data(3, timeframes=1)
+
+
+    def get_sample(self, name: str, **labels: str) -> float:
+        return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+    def test_requests_are_counted_by_view_method_and_status(self) -> None:
+        ok = self.get_sample("http_requests_total", view=self.view, method="GET", status="200")
+        not_found = self.get_sample("http_requests_total", view="unresolved", method="GET", status="404")
+        observed = self.get_sample("http_request_duration_seconds_count", view=self.view, method="GET")
+
+        for _ in range(2):
+            self.assertEqual(self.client.get(CURRENCIES_URL).status_code, 200)
+        self.assertEqual(self.client.get("/not-a-path/").status_code, 404)
+
+        self.assertEqual(self.get_sample("http_requests_total", view=self.view, method="GET", status="200"), ok + 2)
+        self.assertEqual(self.get_sample("http_requests_total", view="unresolved", method="GET", status="404"), not_found + 1)
+        self.assertEqual(self.get_sample("http_request_duration_seconds_count", view=self.view, method="GET"), observed + 2)
+
+
+    def test_queries_and_phases_are_observed(self) -> None:
+        queries = self.get_sample("http_request_db_queries_sum", view=self.view, method="GET")
+        serializer_count = self.get_sample("http_request_serializer_duration_seconds_count", view=self.view, method="GET")
+        render_count = self.get_sample("http_request_render_duration_seconds_count", view=self.view, method="GET")
+
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(CURRENCIES_URL)
+
+        self.assertEqual(self.get_sample("http_request_db_queries_sum", view=self.view, method="GET"), queries + len(context.captured_queries))
+        self.assertEqual(self.get_sample("http_request_serializer_duration_seconds_count", view=self.view, method="GET"), serializer_count + 1)
+        self.assertEqual(self.get_sample("http_request_render_duration_seconds_count", view=self.view, method="GET"), render_count + 1)
+        self.assertGreater(self.get_sample("http_request_render_duration_seconds_sum", view=self.view, method="GET"), 0)
+
+
+    def test_metrics_endpoint(self) -> None:
+        self.client.get(CURRENCIES_URL)
+        response = self.client.get(METRICS_URL)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+        body = response.content.decode()
+        self.assertIn(f'http_requests_total{{method="GET",status="200",view="{self.view}"}}', body)
+        self.assertIn("# TYPE http_request_duration_seconds histogram", body)
+
+
+
+class ProfilingTests(BudgetTestCase):
+    """Profiling helpers and `ProfilingMiddleware`"""
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+
+    def get_profiled_response(self, headers: dict = None, **settings: Any):
+        # Middleware is loaded on the first request of the test client
+        with self.settings(PROFILING_DIR=self.directory, **settings):
+            return self.client.get(CURRENCIES_URL, headers=headers or {})
+
+
+    def test_run_profiled(self) -> None:
+        def work(duration: float) -> str:
+            time.sleep(duration)
+            return "done"
+
+        result, path = run_profiled("cprofile", os.path.join(self.directory, "profile"), work, 0.01)
+        self.assertEqual((result, path), ("done", os.path.join(self.directory, "profile.prof")))
+        stats = pstats.Stats(path)
+        self.assertTrue(any(function_name == "work" for _, _, function_name in stats.stats))
+
+        result, path = run_profiled("sample", os.path.join(self.directory, "profile"), work, 0.05)
+        self.assertEqual((result, path), ("done", os.path.join(self.directory, "profile.folded")))
+        with open(path, encoding="utf-8") as file:
+            lines = file.read().splitlines()
+        self.assertTrue(lines)
+        self.assertTrue(all(re.match(r"^\S.* \d+$", line) for line in lines))
+        self.assertTrue(any(":work:" in line for line in lines))
+
+        with self.assertRaises(ValueError):
+            run_profiled("tracemalloc", os.path.join(self.directory, "profile"), work, 0)
+
+
+    def test_profile_names(self) -> None:
+        name = get_profile_name("api:currencies:currency__list-create", "search=btc")
+        self.assertRegex(name, r"^\d{8}T\d{12}-api_currencies_currency__list-create-[0-9a-f]{8}$")
+        self.assertEqual(name[-8:], get_profile_name("other", "search=btc")[-8:])
+        self.assertNotEqual(name[-8:], get_profile_name("other", "search=eth")[-8:])
+
+
+    def test_prune_profiles(self) -> None:
+        for n in range(5):
+            path = os.path.join(self.directory, f"{n}.prof")
+            with open(path, "wb") as file:
+                file.write(b"x" * 100)
+            os.utime(path, (n, n))
+
+        prune_profiles(self.directory, max_files=3, max_bytes=10_000)
+        self.assertEqual(sorted(os.listdir(self.directory)), ["2.prof", "3.prof", "4.prof"])
+        prune_profiles(self.directory, max_files=10, max_bytes=150)
+        self.assertEqual(os.listdir(self.directory), ["4.prof"])
+
+
+    def test_staff_requests_are_profiled(self) -> None:
+        staff = get_user_model().objects.create_user(email="staff@example.com", password="password", is_staff=True)
+        self.authenticate(staff)
+        response = self.get_profiled_response({"X-Profile": "sample"})
+        self.assertEqual(response.status_code, 200)
+        name = response["X-Profile-Id"]
+        self.assertTrue(os.path.exists(os.path.join(self.directory, f"{name}.folded")))
+        with open(os.path.join(self.directory, f"{name}.json"), encoding="utf-8") as file:
+            metadata = json.load(file)
+        self.assertEqual(metadata["view"], "api:currencies:currency__list-create")
+        self.assertEqual((metadata["mode"], metadata["status"]), ("sample", 200))
+
+
+    def test_other_requests_are_not_profiled(self) -> None:
+        user = get_user_model().objects.create_user(email="user@example.com", password="password")
+        self.authenticate(user)
+        response = self.get_profiled_response({"X-Profile": "cprofile"})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("X-Profile-Id", response)
+        self.assertEqual(os.listdir(self.directory), [])
+
+
+    def test_sampled_requests_are_profiled(self) -> None:
+        response = self.get_profiled_response(PROFILING_SAMPLE_RATE=1.0, PROFILING_MODE="cprofile")
+        self.assertTrue(os.path.exists(os.path.join(self.directory, f"{response['X-Profile-Id']}.prof")))
+
+
+    def test_disabled_without_directory(self) -> None:
+        with self.settings(PROFILING_DIR=None):
+            with self.assertRaises(MiddlewareNotUsed):
+                ProfilingMiddleware(lambda request: None)
+
+
+
+class SlowQueryLogTests(BudgetTestCase):
+    """The slow query log and the `slow_queries` command"""
+
+    def setUp(self) -> None:
+        super().setUp()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.path = os.path.join(directory, "slow_queries.jsonl")
+
+
+    def test_queries_are_logged_without_literals(self) -> None:
+        install_slow_query_logger(None, connection)
+        self.addCleanup(connection.execute_wrappers.remove, log_slow_query)
+        with self.settings(SLOW_QUERY_LOG_PATH=self.path, SLOW_QUERY_THRESHOLD_MS=0, SLOW_QUERY_EXPLAIN_SAMPLE_RATE=1.0):
+            with tag_queries("search=secret"):
+                list(Currency.objects.filter(symbol__in=["SECRET1", "SECRET2"], exchange="hidden"))
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 'secret-literal', 4242")
+
+        with open(self.path, encoding="utf-8") as file:
+            content = file.read()
+        for value in ("SECRET1", "hidden", "secret-literal", "4242"):
+            self.assertNotIn(value, content)
+
+        entries = read_slow_query_log(self.path)
+        self.assertEqual(len(entries), 2)
+        select, raw = entries
+        self.assertEqual(select["tag"], "search=secret")
+        self.assertIn("IN (%s, ...)", select["sql"])
+        self.assertNotIn("params", select)
+        self.assertTrue(select["plan"])
+        self.assertEqual(raw["sql"], "SELECT ?, ?")
+
+
+    def test_command(self) -> None:
+        entries = [
+            {"tag": "a", "sql": "SELECT 1", "duration_ms": 300, "plan": None},
+            {"tag": "a", "sql": "SELECT 1", "duration_ms": 500, "plan": "SCAN currency"},
+            {"tag": None, "sql": "SELECT 2", "duration_ms": 900, "plan": None},
+        ]
+        with open(self.path, "w", encoding="utf-8") as file:
+            file.writelines(json.dumps(entry) + "\n" for entry in entries)
+            file.write("not json\n")
+
+        out = io.StringIO()
+        call_command("slow_queries", path=self.path, sort="count", show_sql=True, show_plan=True, stdout=out)
+        output = out.getvalue()
+        self.assertIn("3 slow queries in 2 groups. Worst offenders by count", output)
+        self.assertLess(output.index("1. a"), output.index("2. untagged"))
+        self.assertIn("count=2 total=800.0ms mean=400.0ms p95=500.0ms max=500.0ms plans=yes", output)
+        self.assertIn("   | SCAN currency", output)
+
+        out = io.StringIO()
+        call_command("slow_queries", path=self.path, limit=1, stdout=out)
+        self.assertIn("1. untagged", out.getvalue())
+        self.assertNotIn("2. ", out.getvalue())
+
+        with self.settings(SLOW_QUERY_LOG_PATH=None):
+            with self.assertRaises(CommandError):
+                call_command("slow_queries", stdout=io.StringIO())
+
+
+
+class BudgetCheckTests(BudgetTestCase):
+    """Query and latency budget checks of `BudgetTestCase`"""
+
+    def test_latency_budget_warns_unless_scale_is_set(self) -> None:
+        with mock.patch("helpers.testing.LATENCY_BUDGET_SCALE", None):
+            with self.assertWarns(UserWarning):
+                self.check_budget([], 20.0, 0, 10.0, "block")
+            with self.assertRaises(AssertionError):
+                self.check_budget([{"sql": "SELECT 1", "time": 0.001}], 1.0, 0, 10.0, "block")
+
+        with mock.patch("helpers.testing.LATENCY_BUDGET_SCALE", 3.0):
+            self.check_budget([], 20.0, 0, 10.0, "block")
+            with self.assertRaises(AssertionError):
+                self.check_budget([], 40.0, 0, 10.0, "block")
+
+
+
+class FakeConnection:
+    """DB-API connection stand-in for connection pool tests"""
+
+    def __init__(self) -> None:
+        self.closed = False
+
+    def close(self) -> None:
+        self.closed = True
+
+    def cursor(self) -> mock.MagicMock:
+        return mock.MagicMock()
+
+    def rollback(self) -> None:
+        pass
+
+
+
+class ConnectionPoolTests(SimpleTestCase):
+    """The in-process database connection pool of `helpers.db_pool`"""
+
+    def test_timeout(self) -> None:
+        pool = ConnectionPool("test", max_size=1, timeout=0.05)
+        connection = pool.getconn(FakeConnection)
+        start = time.monotonic()
+        with self.assertRaises(PoolTimeout):
+            pool.getconn(FakeConnection)
+        self.assertGreaterEqual(time.monotonic() - start, 0.05)
+
+        # A returned connection is handed out to a waiting thread
+        threading.Timer(0.01, pool.putconn, [connection]).start()
+        pool.timeout = 5
+        self.assertIs(pool.getconn(FakeConnection), connection)
+
+
+    def test_max_lifetime(self) -> None:
+        pool = ConnectionPool("test", max_size=2, max_lifetime=60)
+        connection = pool.getconn(FakeConnection)
+        pool.putconn(connection)
+        self.assertIs(pool.getconn(FakeConnection), connection)
+
+        # Connections older than the max lifetime are closed when returned, or before they are handed out
+        with mock.patch("helpers.db_pool.time.monotonic", return_value=time.monotonic() + 120):
+            pool.putconn(connection)
+        self.assertTrue(connection.closed)
+        self.assertEqual((pool.size, pool.idle), (0, 0))
+
+        connection = pool.getconn(FakeConnection)
+        pool.putconn(connection)
+        with mock.patch("helpers.db_pool.time.monotonic", return_value=time.monotonic() + 120):
+            new_connection = pool.getconn(FakeConnection)
+        self.assertIsNot(new_connection, connection)
+        self.assertTrue(connection.closed)
+        self.assertEqual(pool.size, 1)
+
+
+    def test_failed_connect_releases_slot(self) -> None:
+        pool = ConnectionPool("test", max_size=1, timeout=0.05)
+
+        def connect() -> FakeConnection:
+            raise ConnectionError("Database is down")
+
+        for _ in range(3):
+            with self.assertRaises(ConnectionError):
+                pool.getconn(connect)
+        self.assertEqual(pool.size, 0)
+        self.assertIsInstance(pool.getconn(FakeConnection), FakeConnection)
+
+
+    def test_discarded_connections_are_closed(self) -> None:
+        pool = ConnectionPool("test", max_size=1)
+        connection = pool.getconn(FakeConnection)
+        pool.putconn(connection, discard=True)
+        self.assertTrue(connection.closed)
+        self.assertEqual(pool.size, 0)
@@ -1,5 +1,8 @@
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse
 from django.views.decorators.csrf import csrf_exempt
+from rest_framework import views
+
+from helpers.metrics import METRICS_CONTENT_TYPE, render_metrics
 
 
 
@@ -13,3 +16,15 @@ def health_check_api_view(request, *args, **kwargs) -> JsonResponse:
         status=200
     )
 
+
+
+class MetricsAPIView(views.APIView):
+    """API view that exposes application metrics in Prometheus text format"""
+    http_method_names = ["get"]
+
+    def get(self, request, *args, **kwargs) -> HttpResponse:
+        return HttpResponse(render_metrics(), content_type=METRICS_CONTENT_TYPE)
+
+
+
+metrics_api_view = csrf_exempt(MetricsAPIView.as_view())
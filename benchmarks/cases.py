@@ -0,0 +1,219 @@
+import datetime
+import json
+import statistics
+import time
+from typing import Any, Callable, Dict, List
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.test import Client
+from django.utils.duration import duration_string
+
+from ema.ingest import apply_ema_record_batch
+from ema.models import EMARecord
+from ema.serializers import EMARecordSerializer
+from ema.signals import prepare_websocket_update, send_updates_via_websocket, send_deletes_via_websocket
+
+
+BENCHMARKS: Dict[str, Callable[["BenchmarkContext"], Dict[str, Any]]] = {}
+
+
+def benchmark(name: str) -> Callable:
+    """Register a benchmark function under the given name"""
+    def decorator(func: Callable[["BenchmarkContext"], Dict[str, Any]]) -> Callable:
+        BENCHMARKS[name] = func
+        return func
+    return decorator
+
+
+
+class BenchmarkContext:
+    """Data and settings shared by all benchmarks of a run"""
+
+    def __init__(self, client: Client, records: List[EMARecord], iterations: int, warmup: int) -> None:
+        self.client = client
+        self.records = records
+        self.iterations = iterations
+        self.warmup = warmup
+
+
+    def measure(self, func: Callable[[int], Any]) -> Dict[str, float]:
+        """
+        Call `func` with the iteration number `warmup + iterations` times and
+        return timing statistics of the last `iterations` calls, in milliseconds.
+        """
+        for iteration in range(self.warmup):
+            func(iteration)
+        durations = []
+        for iteration in range(self.warmup, self.warmup + self.iterations):
+            start = time.perf_counter()
+            func(iteration)
+            durations.append((time.perf_counter() - start) * 1000)
+        return summarize(durations)
+
+
+
+def summarize(durations: List[float]) -> Dict[str, float]:
+    """Timing statistics of a list of durations in milliseconds"""
+    durations = sorted(durations)
+    return {
+        "iterations": len(durations),
+        "mean_ms": statistics.fmean(durations),
+        "p50_ms": durations[len(durations) // 2],
+        "p95_ms": durations[min(len(durations) - 1, int(len(durations) * 0.95))],
+        "min_ms": durations[0],
+        "max_ms": durations[-1],
+    }
+
+
+def check_response(response: Any, expected_status: int = 200) -> None:
+    if response.status_code != expected_status:
+        raise RuntimeError(f"Unexpected response status {response.status_code}: {response.content[:500]!r}")
+    return None
+
+
+
+@benchmark("ema_upsert_single")
+def ema_upsert_single(context: BenchmarkContext) -> Dict[str, Any]:
+    """Update an existing EMA record through `POST /api/v1/ema-records/`, one record per request"""
+    records = context.records
+
+    def upsert(iteration: int) -> None:
+        record = records[iteration % len(records)]
+        data = EMARecordSerializer(record).data
+        data["currency_symbol"] = record.currency.symbol
+        data["close"] = record.close * 1.001
+        response = context.client.post("/api/v1/ema-records/", data=json.dumps(data), content_type="application/json")
+        check_response(response, 201)
+
+    result = context.measure(upsert)
+    result["records_per_sec"] = 1000 / result["mean_ms"]
+    return result
+
+
+@benchmark("ema_upsert_bulk")
+def ema_upsert_bulk(context: BenchmarkContext) -> Dict[str, Any]:
+    """
+    Update the EMA records of all series in a single `POST /api/v1/ema-records/candles/` request,
+    with one new candle per series
+    """
+    records = context.records
+    base_time = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+
+    def upsert(iteration: int) -> None:
+        candles = []
+        for record in records:
+            close = record.close * (1 + 0.001 * iteration)
+            candles.append({
+                "currency_symbol": record.currency.symbol,
+                "timeframe": duration_string(record.timeframe),
+                "open_time": (base_time + record.timeframe * iteration).isoformat(),
+                "open": close,
+                "high": close * 1.01,
+                "low": close * 0.99,
+                "close": close,
+            })
+        response = context.client.post("/api/v1/ema-records/candles/", data=json.dumps(candles), content_type="application/json")
+        check_response(response)
+
+    result = context.measure(upsert)
+    result["batch_size"] = len(records)
+    result["records_per_sec"] = len(records) * 1000 / result["mean_ms"]
+    return result
+
+
+SCREENER_FILTERS = {
+    "none": {},
+    "timeframe": {"timeframe": "01:00:00"},
+    "currency": {"currency": "BENCH00001"},
+    "trend": {"trend": "1"},
+    "watch": {"watch": "C"},
+    "watch_sideways": {"watch": "sideways"},
+    "category": {"category": "Crypto"},
+    "indicator": {"rsi__gt": "70"},
+    "expr": {"expr": "close > ema50 * 1.02 and ema20 > ema50"},
+}
+
+
+@benchmark("ingest_batch")
+def ingest_batch(context: BenchmarkContext) -> Dict[str, Any]:
+    """Apply batches of queued EMA records as the ingest worker does, per batch size"""
+    records = [EMARecord.objects.select_related("currency").get(pk=record.pk) for record in context.records]
+    items = []
+    for record in records:
+        data = EMARecordSerializer(record).data
+        data["currency_symbol"] = record.currency.symbol
+        items.append(data)
+
+    results: Dict[str, Any] = {}
+    for batch_size in sorted({min(size, len(items)) for size in (1, 50, 500)}):
+        def apply(iteration: int) -> None:
+            apply_ema_record_batch([
+                {**item, "close": item["close"] * (1 + 0.001 * (iteration + 1))} for item in items[:batch_size]
+            ])
+
+        result = context.measure(apply)
+        result["records_per_sec"] = batch_size * 1000 / result["mean_ms"]
+        results[str(batch_size)] = result
+    return results
+
+
+@benchmark("screener_reads")
+def screener_reads(context: BenchmarkContext) -> Dict[str, Any]:
+    """Latency of `GET /api/v1/ema-records/` per filter type, and per page depth for unfiltered requests"""
+    results: Dict[str, Any] = {"filters": {}, "page_depth": {}}
+    for name, params in SCREENER_FILTERS.items():
+        def get(iteration: int) -> None:
+            check_response(context.client.get("/api/v1/ema-records/", params))
+        results["filters"][name] = context.measure(get)
+
+    limit = 50
+    count = len(context.records)
+    for name, offset in (("first", 0), ("middle", count // 2), ("last", max(count - limit, 0))):
+        def get(iteration: int) -> None:
+            check_response(context.client.get("/api/v1/ema-records/", {"limit": limit, "offset": offset}))
+        results["page_depth"][name] = {"offset": offset, **context.measure(get)}
+    return results
+
+
+@benchmark("serializer")
+def serializer(context: BenchmarkContext) -> Dict[str, Any]:
+    """Throughput of `EMARecordSerializer` serializing all records"""
+    records = list(EMARecord.objects.select_related("currency").all())
+
+    def serialize(iteration: int) -> None:
+        EMARecordSerializer(records, many=True).data
+
+    result = context.measure(serialize)
+    result["records"] = len(records)
+    result["records_per_sec"] = len(records) * 1000 / result["mean_ms"]
+    return result
+
+
+@benchmark("signal_overhead")
+def signal_overhead(context: BenchmarkContext) -> Dict[str, Any]:
+    """Cost of the websocket notification signals of `EMARecord`, per save"""
+    records = list(EMARecord.objects.select_related("currency").all())
+
+    def save(iteration: int) -> None:
+        record = records[iteration % len(records)]
+        record.close *= 1.001
+        record.save()
+
+    with_signals = context.measure(save)
+    receivers = (
+        (pre_save, prepare_websocket_update),
+        (post_save, send_updates_via_websocket),
+        (post_delete, send_deletes_via_websocket),
+    )
+    for signal, receiver in receivers:
+        signal.disconnect(receiver, sender=EMARecord)
+    try:
+        without_signals = context.measure(save)
+    finally:
+        for signal, receiver in receivers:
+            signal.connect(receiver, sender=EMARecord)
+
+    return {
+        "with_signals": with_signals,
+        "without_signals": without_signals,
+        "overhead_per_save_ms": with_signals["mean_ms"] - without_signals["mean_ms"],
+    }
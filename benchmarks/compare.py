@@ -0,0 +1,59 @@
+"""
+Compare the results of two benchmark runs.
+
+Usage:
+```
+python -m benchmarks.compare old.json new.json
+```
+"""
+import argparse
+import json
+from typing import Any, Dict, Iterator, Tuple
+
+
+# Metrics where a lower value is better. For all other compared metrics, higher is better
+LOWER_IS_BETTER_SUFFIXES = ("_ms",)
+COMPARED_SUFFIXES = ("mean_ms", "p50_ms", "p95_ms", "per_sec")
+
+
+def flatten(results: Dict[str, Any], prefix: str = "") -> Iterator[Tuple[str, float]]:
+    """Yield the compared numeric metrics of nested results as dotted paths"""
+    for key, value in results.items():
+        path = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            yield from flatten(value, path)
+        elif isinstance(value, (int, float)) and key.endswith(COMPARED_SUFFIXES):
+            yield path, float(value)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare the results of two benchmark runs")
+    parser.add_argument("old", help="Results of the baseline run")
+    parser.add_argument("new", help="Results of the new run")
+    parser.add_argument("--threshold", type=float, default=10.0, help="Percentage change flagged as a regression")
+    args = parser.parse_args()
+
+    with open(args.old) as file:
+        old = json.load(file)
+    with open(args.new) as file:
+        new = json.load(file)
+
+    print(f"old: {old['meta'].get('commit')} ({old['meta'].get('database')})")
+    print(f"new: {new['meta'].get('commit')} ({new['meta'].get('database')})\n")
+    old_metrics = dict(flatten(old["results"]))
+    new_metrics = dict(flatten(new["results"]))
+    regressions = 0
+    for path, old_value in old_metrics.items():
+        if path not in new_metrics:
+            continue
+        new_value = new_metrics[path]
+        change = (new_value - old_value) / old_value * 100 if old_value else 0.0
+        worse = change > args.threshold if path.endswith(LOWER_IS_BETTER_SUFFIXES) else change < -args.threshold
+        regressions += worse
+        flag = "  REGRESSION" if worse else ""
+        print(f"{path:<55} {old_value:>12.3f} {new_value:>12.3f} {change:>+8.1f}%{flag}")
+    print(f"\n{regressions} regression(s) above {args.threshold}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+import datetime
+import random
+from typing import List
+
+from currency.models import Currency, Categories
+from ema.models import EMARecord, EMARecordChangeVersion
+from ema.candles import get_trend
+
+
+TIMEFRAMES = (
+    datetime.timedelta(minutes=15),
+    datetime.timedelta(hours=1),
+    datetime.timedelta(hours=4),
+    datetime.timedelta(days=1),
+    datetime.timedelta(weeks=1),
+    datetime.timedelta(minutes=5),
+    datetime.timedelta(minutes=30),
+    datetime.timedelta(hours=12),
+)
+
+# Prefix of the symbols of generated currencies, so that benchmark data can be told apart and cleared
+SYMBOL_PREFIX = "BENCH"
+
+EXCHANGES = ("BINANCE", "COINBASE", "KRAKEN", "OANDA", "NASDAQ", "NYSE")
+
+
+def make_ema_record(rng: random.Random, currency: Currency, timeframe: datetime.timedelta) -> EMARecord:
+    """Make an unsaved EMA record with random, but internally consistent, values"""
+    close = rng.uniform(1, 1000)
+    emas = {period: close * rng.uniform(0.9, 1.1) for period in (20, 50, 100, 200)}
+    monhigh = max(close, *emas.values()) * rng.uniform(1, 1.2)
+    monlow = min(close, *emas.values()) * rng.uniform(0.8, 1)
+    return EMARecord(
+        currency=currency,
+        timeframe=timeframe,
+        close=close,
+        ema20=emas[20],
+        ema50=emas[50],
+        ema100=emas[100],
+        ema200=emas[200],
+        trend=get_trend(emas),
+        monhigh=monhigh,
+        monlow=monlow,
+        monmid=(monhigh + monlow) / 2,
+        twenty_greater_than_fifty=emas[20] > emas[50],
+        fifty_greater_than_hundred=emas[50] > emas[100],
+        hundred_greater_than_twohundred=emas[100] > emas[200],
+        close_greater_than_hundred=close > emas[100],
+        indicators={
+            "rsi": rng.uniform(0, 100),
+            "macd": rng.uniform(-5, 5),
+            "macd_signal": rng.uniform(-5, 5),
+            "macd_histogram": rng.uniform(-1, 1),
+            "atr": rng.uniform(0, 20),
+            "bollinger_upper": close * 1.05,
+            "bollinger_middle": close,
+            "bollinger_lower": close * 0.95,
+        },
+    )
+
+
+def seed_data(currencies: int, timeframes: int, seed: int = 42) -> List[EMARecord]:
+    """
+    Create `currencies` currencies, each with an EMA record per timeframe, using a seeded random generator,
+    so that the same data is generated on every run.
+
+    Records are created in bulk, so no signals are sent.
+
+    :param currencies: Number of currencies to create
+    :param timeframes: Number of timeframes per currency, at most `len(TIMEFRAMES)`
+    :param seed: Seed of the random generator
+    :return: The created EMA records
+    """
+    if not 1 <= timeframes <= len(TIMEFRAMES):
+        raise ValueError(f"The number of timeframes should be between 1 and {len(TIMEFRAMES)}")
+
+    rng = random.Random(seed)
+    categories = [choice for choice, _ in Categories.choices]
+    currency_objs = Currency.objects.bulk_create([
+        Currency(
+            symbol=f"{SYMBOL_PREFIX}{index:05d}",
+            category=rng.choice(categories),
+            subcategory=f"Subcategory {rng.randint(1, 10)}",
+            exchange=rng.choice(EXCHANGES),
+        )
+        for index in range(currencies)
+    ])
+    records = [
+        make_ema_record(rng, currency, timeframe)
+        for currency in currency_objs
+        for timeframe in TIMEFRAMES[:timeframes]
+    ]
+    for record, version in zip(records, EMARecordChangeVersion.allocate(len(records))):
+        record.version = version
+    return EMARecord.objects.bulk_create(records)
+
+
+def clear_data() -> None:
+    """Delete all benchmark data"""
+    EMARecord.objects.filter(currency__symbol__startswith=SYMBOL_PREFIX)._raw_delete(EMARecord.objects.db)
+    Currency.objects.filter(symbol__startswith=SYMBOL_PREFIX).delete()
+    return None
@@ -0,0 +1,113 @@
+"""
+Run the benchmark suite and write the results as JSON.
+
+Usage:
+```
+python -m benchmarks.run --currencies 100 --timeframes 4 --output results.json
+BENCHMARK_DATABASE=postgres python -m benchmarks.run --output results.json
+```
+
+Compare the results of two runs with `python -m benchmarks.compare old.json new.json`.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+from pathlib import Path
+
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+
+def get_git_commit() -> str | None:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=BASE_DIR, text=True, stderr=subprocess.DEVNULL
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_args(argv: list[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Run the EMA screener benchmark suite")
+    parser.add_argument("--currencies", type=int, default=100, help="Number of currencies to generate")
+    parser.add_argument("--timeframes", type=int, default=4, help="Number of timeframes (EMA records) per currency")
+    parser.add_argument("--iterations", type=int, default=30, help="Number of measured iterations per benchmark")
+    parser.add_argument("--warmup", type=int, default=3, help="Number of unmeasured iterations per benchmark")
+    parser.add_argument("--seed", type=int, default=42, help="Seed of the synthetic data generator")
+    parser.add_argument("--database", choices=("sqlite", "postgres"), default=None, help="Overrides BENCHMARK_DATABASE")
+    parser.add_argument("--only", nargs="*", default=None, help="Names of the benchmarks to run. Runs all by default")
+    parser.add_argument("--output", default=None, help="File to write the JSON results to. Defaults to stdout")
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] | None = None) -> None:
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    sys.path.insert(0, str(BASE_DIR))
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "benchmarks.settings")
+    if args.database:
+        os.environ["BENCHMARK_DATABASE"] = args.database
+
+    import django
+    django.setup()
+
+    from django.db import connection
+    from django.test import Client
+    from django.test.utils import setup_test_environment, teardown_test_environment
+    from rest_framework_api_key.models import APIKey
+    from .cases import BENCHMARKS, BenchmarkContext
+    from .data import seed_data
+
+    names = args.only or list(BENCHMARKS)
+    unknown = set(names) - BENCHMARKS.keys()
+    if unknown:
+        raise SystemExit(f"Unknown benchmark(s): {', '.join(sorted(unknown))}. Available: {', '.join(BENCHMARKS)}")
+
+    setup_test_environment()
+    old_database_name = connection.settings_dict["NAME"]
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        records = seed_data(args.currencies, args.timeframes, seed=args.seed)
+        _, api_key = APIKey.objects.create_key(name="benchmarks")
+        context = BenchmarkContext(
+            client=Client(HTTP_X_API_KEY=api_key),
+            records=list(records),
+            iterations=args.iterations,
+            warmup=args.warmup,
+        )
+        results = {}
+        for name in names:
+            print(f"Running {name}...", file=sys.stderr)
+            results[name] = BENCHMARKS[name](context)
+    finally:
+        connection.creation.destroy_test_db(old_database_name, verbosity=0)
+        teardown_test_environment()
+
+    output = {
+        "meta": {
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "commit": get_git_commit(),
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "database": connection.vendor,
+            "currencies": args.currencies,
+            "timeframes": args.timeframes,
+            "records": len(records),
+            "iterations": args.iterations,
+            "warmup": args.warmup,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+    text = json.dumps(output, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Settings for running benchmarks.
+
+Benchmarks run against a throwaway test database, created from the default database settings.
+Set `BENCHMARK_DATABASE` to "postgres" to benchmark against PostgreSQL (using the
+`DB_*` environment variables), or leave it as "sqlite" to use an in-memory SQLite database,
+or the SQLite database file at `BENCHMARK_SQLITE_PATH` if set.
+
+The in-memory channel layer and local memory caches are used, so Redis is not required.
+Set `BENCHMARK_CHANNEL_LAYER` to "redis" to use the Redis channel layer of the main settings instead.
+"""
+import os
+
+from ema_screener.settings import *
+
+
+BENCHMARK_DATABASE = os.getenv("BENCHMARK_DATABASE", "sqlite").lower()
+
+
+
+class DisableMigrations:
+    """Creates tables directly from the current models, instead of running migrations"""
+    def __contains__(self, item: str) -> bool:
+        return True
+
+    def __getitem__(self, item: str) -> None:
+        return None
+
+
+if BENCHMARK_DATABASE == "sqlite":
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": os.getenv("BENCHMARK_SQLITE_PATH") or ":memory:",
+        }
+    }
+    # Older migrations are PostgreSQL specific
+    MIGRATION_MODULES = DisableMigrations()
+
+if os.getenv("BENCHMARK_CHANNEL_LAYER", "memory").lower() != "redis":
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "helpers.metrics.MeteredInMemoryChannelLayer",
+        },
+    }
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "benchmarks-shared",
+    },
+    "local": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "benchmarks-local",
+    },
+}
+
+# API keys are verified with the password hasher on every request. The default PBKDF2 hasher
+# adds a constant few hundred milliseconds per request, which would mask everything else measured
+PASSWORD_HASHERS = ["django.contrib.auth.hashers.MD5PasswordHasher"]
+
+DEBUG = False
+
+ALLOWED_HOSTS = ["*"]
+
+TRACING_EXPORTER = None
+
+PROFILING_DIR = None
+
+SLOW_QUERY_LOG_PATH = None
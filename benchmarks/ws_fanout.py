@@ -0,0 +1,378 @@
+"""
+Websocket fan-out load harness.
+
+Starts a Daphne server, opens many concurrent websocket clients on `ws/ema-records/`,
+then drives a feed of EMA record updates through `POST /api/v1/ema-records/` at increasing rates.
+For each rate, it reports the delivery latency percentiles, message loss and server CPU time
+per message, and flags the first rate at which the backlog starts growing. The server memory
+used per connection is reported after the clients connect.
+
+Usage:
+```
+pip install -r benchmarks/requirements.txt
+python -m benchmarks.ws_fanout --clients 5000 --rates 10 20 50 100 --output fanout.json
+BENCHMARK_CHANNEL_LAYER=redis python -m benchmarks.ws_fanout --clients 10000
+python -m benchmarks.ws_fanout --clients 10000 --channel-layer pubsub
+```
+
+Each update sets the `close` of a record to a unique value, so that clients can match
+the messages they receive to the time the update was posted.
+
+By default, the server uses a temporary SQLite database and the in-memory channel layer.
+With `--database postgres`, benchmark currencies are created in (and removed from) the
+database of the `DB_*` settings, so point those at a scratch database.
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import resource
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import psutil
+import websockets
+
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+# Offset of the `close` values set by the feed, so that they do not clash with seeded values
+CLOSE_OFFSET = 1_000_000
+
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Websocket fan-out load harness")
+    parser.add_argument("--clients", type=int, default=1000, help="Number of concurrent websocket clients")
+    parser.add_argument("--observers", type=int, default=50, help="Number of clients that record delivery latency")
+    parser.add_argument("--rates", type=float, nargs="+", default=[5, 10, 20, 50, 100], help="Feed rates to step through, in updates per second")
+    parser.add_argument("--step-duration", type=float, default=10.0, help="Seconds to feed updates at each rate")
+    parser.add_argument("--grace", type=float, default=3.0, help="Seconds to wait for deliveries after each step")
+    parser.add_argument("--currencies", type=int, default=50, help="Number of currencies to generate")
+    parser.add_argument("--timeframes", type=int, default=2, help="Number of timeframes per currency")
+    parser.add_argument("--feed-workers", type=int, default=8, help="Number of concurrent feed requests")
+    parser.add_argument("--connect-concurrency", type=int, default=200, help="Number of clients connecting at a time")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=0, help="Port of the server. Defaults to a free port")
+    parser.add_argument("--database", choices=("sqlite", "postgres"), default="sqlite")
+    parser.add_argument(
+        "--channel-layer", 
+        choices=("memory", "redis", "pubsub"), 
+        default=None, 
+        help="Overrides BENCHMARK_CHANNEL_LAYER. \"pubsub\" is the Redis channel layer in the pub/sub fan-out mode"
+    )
+    parser.add_argument("--no-stop-on-saturation", action="store_true", help="Keep stepping up the rate after the backlog starts growing")
+    parser.add_argument("--output", default=None, help="File to write the JSON results to. Defaults to stdout")
+    return parser.parse_args(argv)
+
+
+def percentile(values: List[float], fraction: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def get_free_port(host: str) -> int:
+    with socket.socket() as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+
+
+def raise_open_files_limit() -> int:
+    """Raise the soft limit of open files to the hard limit, as each client needs a socket"""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+
+
+def prepare_database(args: argparse.Namespace) -> Dict[str, Any]:
+    """Create the benchmark tables and data, and returns an API key and the payloads used to update each record"""
+    import django
+    django.setup()
+
+    from django.core.management import call_command
+    from django.db import connections
+    from rest_framework_api_key.models import APIKey
+    from ema.serializers import EMARecordSerializer
+    from .data import clear_data, seed_data
+
+    call_command("migrate", run_syncdb=True, verbosity=0)
+    clear_data()
+    records = seed_data(args.currencies, args.timeframes)
+    _, api_key = APIKey.objects.create_key(name="ws-fanout-benchmark")
+
+    payloads = []
+    for record in records:
+        data = EMARecordSerializer(record).data
+        for field in ("id", "currency", "indicators", "timestamp", "updated_at"):
+            data.pop(field, None)
+        data["currency_symbol"] = record.currency.symbol
+        payloads.append(data)
+    connections.close_all()
+    return {"api_key": api_key, "payloads": payloads}
+
+
+def cleanup_database() -> None:
+    from django.db import connections
+    from .data import clear_data
+    clear_data()
+    connections.close_all()
+    return None
+
+
+def start_server(args: argparse.Namespace, env: Dict[str, str]) -> subprocess.Popen:
+    server = subprocess.Popen(
+        [sys.executable, "-m", "daphne", "-b", args.host, "-p", str(args.port), "ema_screener.asgi:application"],
+        cwd=BASE_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"Server exited: {server.stderr.read().decode()[-2000:]}")
+        try:
+            with socket.create_connection((args.host, args.port), timeout=0.5):
+                return server
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError("Server did not start in time")
+
+
+
+class FanoutHarness:
+    """Websocket clients and update feed of a fan-out benchmark run"""
+
+    def __init__(self, args: argparse.Namespace, api_key: str, payloads: List[Dict], server: psutil.Process) -> None:
+        self.args = args
+        self.api_key = api_key
+        self.payloads = payloads
+        self.server = server
+        self.base_url = f"http://{args.host}:{args.port}"
+        self.ws_url = f"ws://{args.host}:{args.port}/ws/ema-records/?api_key={api_key}"
+        self.connections: List[Any] = []
+        self.tasks: List[asyncio.Task] = []
+        self.sent_at: Dict[int, float] = {}
+        self.latencies: Dict[int, List[float]] = {}
+        self.received = 0
+        self.sequence = 0
+        self.executor = ThreadPoolExecutor(max_workers=args.feed_workers)
+
+
+    async def drain(self, connection: Any, observer: bool) -> None:
+        try:
+            async for message in connection:
+                self.received += 1
+                if not observer:
+                    continue
+                received_at = time.perf_counter()
+                data = json.loads(message).get("data") or {}
+                close = data.get("close")
+                if isinstance(close, (int, float)) and close >= CLOSE_OFFSET:
+                    sequence = round(close - CLOSE_OFFSET)
+                    if sequence in self.sent_at:
+                        self.latencies.setdefault(sequence, []).append(received_at - self.sent_at[sequence])
+        except websockets.ConnectionClosed:
+            pass
+
+
+    async def connect_clients(self) -> Dict[str, Any]:
+        rss_before = self.server.memory_info().rss
+        semaphore = asyncio.Semaphore(self.args.connect_concurrency)
+        failures = 0
+
+        async def connect(index: int) -> None:
+            nonlocal failures
+            async with semaphore:
+                try:
+                    connection = await websockets.connect(self.ws_url, open_timeout=30, max_queue=None)
+                except Exception:
+                    failures += 1
+                    return
+            self.connections.append(connection)
+            self.tasks.append(asyncio.create_task(self.drain(connection, observer=index < self.args.observers)))
+
+        start = time.perf_counter()
+        await asyncio.gather(*(connect(index) for index in range(self.args.clients)))
+        connect_seconds = time.perf_counter() - start
+        # Let the server settle before measuring its memory
+        await asyncio.sleep(1)
+        rss_after = self.server.memory_info().rss
+        connected = len(self.connections)
+        return {
+            "requested": self.args.clients,
+            "connected": connected,
+            "failed": failures,
+            "connect_seconds": connect_seconds,
+            "server_rss_before_bytes": rss_before,
+            "server_rss_after_bytes": rss_after,
+            "server_bytes_per_connection": (rss_after - rss_before) / connected if connected else None,
+        }
+
+
+    def post_update(self, sequence: int) -> bool:
+        payload = dict(self.payloads[sequence % len(self.payloads)])
+        payload["close"] = CLOSE_OFFSET + sequence
+        request = urllib.request.Request(
+            f"{self.base_url}/api/v1/ema-records/",
+            data=json.dumps(payload).encode(),
+            headers={"Content-Type": "application/json", "X-API-KEY": self.api_key},
+            method="POST",
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=30) as response:
+                return response.status in (200, 201)
+        except Exception:
+            return False
+
+
+    async def run_step(self, rate: float) -> Dict[str, Any]:
+        loop = asyncio.get_running_loop()
+        cpu_before = sum(self.server.cpu_times()[:2])
+        received_before = self.received
+        step_sequences = []
+        futures = []
+        start = time.perf_counter()
+        count = int(rate * self.args.step_duration)
+        for index in range(count):
+            # Schedule updates at fixed intervals, so that slow requests do not lower the offered rate
+            delay = start + index / rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.sequence += 1
+            sequence = self.sequence
+            self.sent_at[sequence] = time.perf_counter()
+            step_sequences.append(sequence)
+            futures.append(loop.run_in_executor(self.executor, self.post_update, sequence))
+        results = await asyncio.gather(*futures)
+        feed_seconds = time.perf_counter() - start
+        await asyncio.sleep(self.args.grace)
+        cpu_seconds = sum(self.server.cpu_times()[:2]) - cpu_before
+
+        succeeded = sum(results)
+        observers = min(self.args.observers, len(self.connections))
+        latencies = [latency for sequence in step_sequences for latency in self.latencies.get(sequence, [])]
+        expected_observations = succeeded * observers
+        deliveries = self.received - received_before
+        # Compare the latency of the first and last thirds of the step, to tell if a backlog is building up
+        third = max(len(step_sequences) // 3, 1)
+        early = [latency for sequence in step_sequences[:third] for latency in self.latencies.get(sequence, [])]
+        late = [latency for sequence in step_sequences[-third:] for latency in self.latencies.get(sequence, [])]
+        early_p50, late_p50 = percentile(early, 0.5), percentile(late, 0.5)
+        loss = 1 - len(latencies) / expected_observations if expected_observations else 0.0
+        backlog_growing = loss > 0.01 or (
+            early_p50 is not None and late_p50 is not None and late_p50 > max(2 * early_p50, early_p50 + 0.05)
+        )
+        return {
+            "offered_rate": rate,
+            "achieved_rate": count / feed_seconds if feed_seconds else None,
+            "updates": count,
+            "updates_failed": count - succeeded,
+            "deliveries": deliveries,
+            "delivery_loss": loss,
+            "latency_ms": {
+                "p50": (percentile(latencies, 0.5) or 0) * 1000,
+                "p95": (percentile(latencies, 0.95) or 0) * 1000,
+                "p99": (percentile(latencies, 0.99) or 0) * 1000,
+                "max": (max(latencies) if latencies else 0) * 1000,
+                "mean": (statistics.fmean(latencies) if latencies else 0) * 1000,
+                "first_third_p50": (early_p50 or 0) * 1000,
+                "last_third_p50": (late_p50 or 0) * 1000,
+            },
+            "server_cpu_seconds": cpu_seconds,
+            "server_cpu_ms_per_update": cpu_seconds * 1000 / succeeded if succeeded else None,
+            "server_cpu_us_per_delivery": cpu_seconds * 1_000_000 / deliveries if deliveries else None,
+            "backlog_growing": backlog_growing,
+        }
+
+
+    async def close(self) -> None:
+        await asyncio.gather(*(connection.close() for connection in self.connections), return_exceptions=True)
+        for task in self.tasks:
+            task.cancel()
+        self.executor.shutdown(wait=False)
+        return None
+
+
+    async def run(self) -> Dict[str, Any]:
+        results: Dict[str, Any] = {"connections": await self.connect_clients(), "steps": [], "saturation_rate": None}
+        try:
+            for rate in self.args.rates:
+                print(f"Feeding {rate} updates/s to {len(self.connections)} clients...", file=sys.stderr)
+                step = await self.run_step(rate)
+                results["steps"].append(step)
+                if step["backlog_growing"] and results["saturation_rate"] is None:
+                    results["saturation_rate"] = rate
+                    if not self.args.no_stop_on_saturation:
+                        break
+        finally:
+            await self.close()
+        return results
+
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    sys.path.insert(0, str(BASE_DIR))
+    args.port = args.port or get_free_port(args.host)
+    open_files_limit = raise_open_files_limit()
+
+    temp_dir = tempfile.TemporaryDirectory()
+    os.environ["DJANGO_SETTINGS_MODULE"] = "benchmarks.settings"
+    os.environ["BENCHMARK_DATABASE"] = args.database
+    if args.database == "sqlite":
+        os.environ["BENCHMARK_SQLITE_PATH"] = os.path.join(temp_dir.name, "ws_fanout.sqlite3")
+    if args.channel_layer == "pubsub":
+        os.environ["BENCHMARK_CHANNEL_LAYER"] = "redis"
+        os.environ["WEBSOCKET_FANOUT"] = "pubsub"
+    elif args.channel_layer:
+        os.environ["BENCHMARK_CHANNEL_LAYER"] = args.channel_layer
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [str(BASE_DIR), os.getenv("PYTHONPATH")]))}
+
+    prepared = prepare_database(args)
+    server = start_server(args, env)
+    try:
+        harness = FanoutHarness(args, prepared["api_key"], prepared["payloads"], psutil.Process(server.pid))
+        results = asyncio.run(harness.run())
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+        if args.database == "postgres":
+            cleanup_database()
+        temp_dir.cleanup()
+
+    output = {
+        "meta": {
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "database": args.database,
+            "channel_layer": os.getenv("BENCHMARK_CHANNEL_LAYER", "memory"),
+            "websocket_fanout": os.getenv("WEBSOCKET_FANOUT", "redis"),
+            "clients": args.clients,
+            "observers": args.observers,
+            "records": len(prepared["payloads"]),
+            "step_duration": args.step_duration,
+            "open_files_limit": open_files_limit,
+        },
+        "results": results,
+    }
+    text = json.dumps(output, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+from typing import Dict
+from django.conf import settings
+from django.db import models
+
+from .models import Currency
+from helpers.caching import TwoTierCache
+
+
+currency_categories_cache = TwoTierCache("currency:categories", shared_timeout=settings.CURRENCY_CATEGORIES_CACHE_TTL)
+
+
+def compute_currency_categories() -> Dict:
+    """
+    Compute currency categories and subcategories with their symbol counts
+
+    The counts are computed in a single grouped query. Subcategory counts are keyed by category,
+    then subcategory, as the same subcategory name can be used in several categories.
+    """
+    category_counts: Dict[str, int] = {}
+    subcategory_counts: Dict[str, Dict[str, int]] = {}
+    groups = (
+        Currency.objects
+        .order_by()
+        .values("category", "subcategory")
+        .annotate(count=models.Count("id"))
+    )
+    for group in groups:
+        category_counts[group["category"]] = category_counts.get(group["category"], 0) + group["count"]
+        subcategory_counts.setdefault(group["category"], {})[group["subcategory"]] = group["count"]
+
+    return {
+        "categories": sorted(category_counts),
+        "subcategories": sorted({subcategory for counts in subcategory_counts.values() for subcategory in counts}),
+        "category_counts": category_counts,
+        "subcategory_counts": subcategory_counts,
+    }
+
+
+def get_currency_categories() -> Dict:
+    """Returns cached currency categories and subcategories with their symbol counts"""
+    return currency_categories_cache.get_or_set(compute_currency_categories)
@@ -0,0 +1,167 @@
+import csv
+import io
+import itertools
+import json
+from typing import IO, Any, Dict, Iterable, Iterator, List
+from django.db import transaction
+from rest_framework import exceptions
+
+from .models import Currency
+from .serializers import CurrencyImportSerializer
+from .search import currency_search_index
+from .categories import currency_categories_cache
+
+
+IMPORT_BATCH_SIZE = 1000
+
+SUPPORTED_FORMATS = ("csv", "json")
+
+
+class ImportFormatError(ValueError):
+    """Error raised when the import data cannot be parsed"""
+    pass
+
+
+
+def iter_csv_rows(stream: IO[str]) -> Iterator[Dict[str, Any]]:
+    """Lazily parse rows from a CSV text stream with a header row"""
+    return csv.DictReader(stream)
+
+
+def iter_json_rows(stream: IO[str], chunk_size: int = 64 * 1024) -> Iterator[Dict[str, Any]]:
+    """
+    Lazily parse rows from a JSON text stream.
+
+    The stream may contain a JSON array of objects or JSON objects separated by whitespace
+    or newlines (JSON lines). Objects are decoded one at a time as the stream is read,
+    so the whole document is never held in memory.
+
+    :param stream: The text stream
+    :param chunk_size: Number of characters read from the stream at a time
+    :raises ImportFormatError: If the stream is not valid JSON
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+    in_array = None
+    end_of_stream = False
+
+    while True:
+        # Skip whitespace and array delimiters
+        while position < len(buffer) and (buffer[position].isspace() or buffer[position] in ",]"):
+            position += 1
+        if position < len(buffer) and in_array is None:
+            in_array = buffer[position] == "["
+            if in_array:
+                position += 1
+                continue
+
+        if position < len(buffer):
+            try:
+                row, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError as exc:
+                if end_of_stream:
+                    raise ImportFormatError(f"Invalid JSON: {exc}")
+                # The object is incomplete, read more of the stream
+            else:
+                # A number may continue in the next chunk, e.g. "12" of "12345" or "6.5" of "6.5e10",
+                # so it is only complete when followed by a delimiter. Other values end with a closing character.
+                is_number = isinstance(row, (int, float))
+                if not is_number or end_of_stream or (end < len(buffer) and (buffer[end].isspace() or buffer[end] in ",]")):
+                    position = end
+                    yield row
+                    continue
+
+        if end_of_stream:
+            return
+        chunk = stream.read(chunk_size)
+        end_of_stream = not chunk
+        buffer = buffer[position:] + chunk
+        position = 0
+
+
+def iter_rows(stream: IO[bytes], format: str) -> Iterator[Dict[str, Any]]:
+    """
+    Lazily parse rows from a binary stream in the given format
+
+    :param stream: Binary stream of UTF-8 encoded data
+    :param format: The format of the data. One of "csv" or "json"
+    :raises ImportFormatError: If the format is not supported, or, while iterating, if the data
+    is not UTF-8 encoded or cannot be parsed
+    """
+    if format not in SUPPORTED_FORMATS:
+        raise ImportFormatError(f"Unsupported format '{format}'. Supported formats are: {', '.join(SUPPORTED_FORMATS)}")
+    text_stream = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    if format == "csv":
+        return _raise_format_errors(iter_csv_rows(text_stream))
+    return _raise_format_errors(iter_json_rows(text_stream))
+
+
+def _raise_format_errors(rows: Iterator[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+    """Re-raise errors decoding or parsing the rows as `ImportFormatError`"""
+    try:
+        yield from rows
+    except UnicodeDecodeError as exc:
+        raise ImportFormatError(f"The file is not UTF-8 encoded: {exc.reason} at byte {exc.start}.") from exc
+    except csv.Error as exc:
+        raise ImportFormatError(f"Invalid CSV: {exc}") from exc
+
+
+def upsert_currencies(currencies: List[Currency]) -> None:
+    """Create currencies or update existing currencies with the same symbol in a single query"""
+    Currency.objects.bulk_create(
+        currencies,
+        update_conflicts=True,
+        unique_fields=["symbol"],
+        update_fields=["category", "subcategory", "exchange", "updated_at"],
+    )
+    return None
+
+
+def import_currencies(rows: Iterable[Dict[str, Any]], batch_size: int = IMPORT_BATCH_SIZE) -> Dict[str, Any]:
+    """
+    Import currencies in batches.
+
+    Rows are validated one batch at a time and the valid rows of each batch are upserted
+    in a single query. Currencies with existing symbols are updated.
+
+    The import runs in a single transaction, so if the rows cannot be parsed part way through,
+    no currency is imported, rather than the batches before the error.
+
+    :param rows: Iterable of currency data
+    :param batch_size: Number of rows validated and upserted at a time
+    :return: The number of imported currencies and the errors of invalid rows, by row number
+    :raises ImportFormatError: If the rows cannot be parsed
+    """
+    imported = 0
+    errors = []
+    # A single serializer instance is used to validate all rows, 
+    # so that its fields are only built once
+    serializer = CurrencyImportSerializer()
+    with transaction.atomic():
+        for batch in itertools.batched(enumerate(rows, start=1), batch_size):
+            # Key by symbol, as a single upsert cannot affect the same row twice
+            currencies: Dict[str, Currency] = {}
+            for row_number, row in batch:
+                if not isinstance(row, dict):
+                    errors.append({"row": row_number, "errors": {"non_field_errors": ["Expected an object."]}})
+                    continue
+                try:
+                    validated_data = serializer.run_validation(row)
+                except exceptions.ValidationError as exc:
+                    errors.append({"row": row_number, "errors": exc.detail})
+                    continue
+                currencies[validated_data["symbol"]] = Currency(**validated_data)
+
+            if currencies:
+                upsert_currencies(list(currencies.values()))
+                imported += len(currencies)
+
+    if imported:
+        # Signals are not sent for bulk upserts
+        transaction.on_commit(currency_search_index.invalidate)
+        transaction.on_commit(currency_categories_cache.invalidate)
+    return {
+        "imported": imported,
+        "errors": errors,
+    }
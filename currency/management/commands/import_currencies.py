@@ -0,0 +1,39 @@
+import os
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+
+from currency.importers import (
+    IMPORT_BATCH_SIZE, SUPPORTED_FORMATS, ImportFormatError, import_currencies, iter_rows
+)
+
+
+class Command(BaseCommand):
+    help = "Import currencies from a CSV or JSON file. Currencies with existing symbols are updated."
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument("path", help="Path to the CSV or JSON file")
+        parser.add_argument(
+            "--format", 
+            choices=SUPPORTED_FORMATS, 
+            help="Format of the file. Defaults to the file extension."
+        )
+        parser.add_argument(
+            "--batch-size", 
+            type=int, 
+            default=IMPORT_BATCH_SIZE, 
+            help="Number of rows validated and upserted at a time"
+        )
+
+    def handle(self, *args, **options) -> None:
+        path = options["path"]
+        format = options["format"] or os.path.splitext(path)[1].lstrip(".").lower()
+        try:
+            with open(path, "rb") as file:
+                result = import_currencies(iter_rows(file, format), batch_size=options["batch_size"])
+        except (OSError, ImportFormatError) as exc:
+            raise CommandError(str(exc))
+
+        for error in result["errors"]:
+            self.stderr.write(f"Row {error['row']}: {error['errors']}")
+        self.stdout.write(self.style.SUCCESS(
+            f"{result['imported']} currencies imported, {len(result['errors'])} row(s) with errors."
+        ))
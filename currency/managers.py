@@ -1,4 +1,5 @@
 from typing import Any
+from django.db import transaction
 
 from helpers.managers import SearchableModelManager, SearchableQuerySet
 
@@ -19,6 +20,21 @@ class CurrencyQuerySet(SearchableQuerySet):
         return super().search(query, fields)
 
 
+    def delete(self) -> Any:
+        """
+        Delete the currencies in the queryset.
+
+        Their EMA records are deleted with `EMARecordQuerySet.bulk_delete` first, with a single
+        websocket notification, instead of letting the cascade collect them and notify clients once per record.
+        """
+        # Imported here, as the EMA models import the currency models
+        from ema.models import EMARecord
+
+        with transaction.atomic(using=self.db):
+            EMARecord.objects.using(self.db).filter(currency__in=self.values("pk")).bulk_delete()
+            return super().delete()
+
+
 
 class CurrencyManager(SearchableModelManager.from_queryset(CurrencyQuerySet)):
     '''Custom manager for the `Currency` model.'''
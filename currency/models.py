@@ -1,5 +1,6 @@
 import uuid
-from django.db import models
+from typing import Any
+from django.db import models, transaction
 from django.utils.translation import gettext_lazy as _
 
 from .managers import CurrencyManager
@@ -34,3 +35,11 @@ class Currency(models.Model):
     def __str__(self) -> str:
         return f"{self.symbol} ({self.exchange})"
     
+
+    def delete(self, *args: Any, **kwargs: Any) -> Any:
+        # Delete related EMA records in a single query, with a single websocket notification,
+        # instead of letting the cascade collect them and notify clients once per record
+        with transaction.atomic():
+            self.ema_records.all().bulk_delete()
+            return super().delete(*args, **kwargs)
+    
@@ -0,0 +1,181 @@
+import bisect
+import itertools
+import threading
+import time
+from typing import Dict, List, Optional, Set
+from django.conf import settings
+
+from .models import Currency
+from .serializers import CurrencySerializer
+
+
+def get_trigrams(text: str) -> Set[str]:
+    """
+    Get the trigrams of a text.
+
+    Like Postgres' `pg_trgm`, each word is padded with two spaces
+    at the beginning and one space at the end.
+    """
+    trigrams = set()
+    for word in text.lower().split():
+        padded = f"  {word} "
+        trigrams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return trigrams
+
+
+class _IndexSnapshot:
+    """Immutable snapshot of the indexed currencies"""
+
+    def __init__(self, currencies: List[Dict]) -> None:
+        self.currencies = currencies
+        self.symbols = [currency["symbol"].lower() for currency in currencies]
+        self.symbol_trigram_counts = []
+        # Sorted symbols for prefix lookups
+        self.sorted_symbols = sorted((symbol, index) for index, symbol in enumerate(self.symbols))
+        # Inverted index of symbol trigrams to currencies
+        self.postings: Dict[str, List[int]] = {}
+        for index, symbol in enumerate(self.symbols):
+            trigrams = get_trigrams(symbol)
+            self.symbol_trigram_counts.append(len(trigrams))
+            for trigram in trigrams:
+                self.postings.setdefault(trigram, []).append(index)
+
+        # Words of the other searchable fields, mapped to the currencies
+        # containing them, ordered by symbol, for word prefix lookups
+        words: Dict[str, List[int]] = {}
+        for symbol, index in self.sorted_symbols:
+            currency = currencies[index]
+            for field in ("category", "subcategory", "exchange"):
+                for word in currency[field].lower().split():
+                    if not words.get(word) or words[word][-1] != index:
+                        words.setdefault(word, []).append(index)
+        self.sorted_words = sorted(words.items())
+
+
+    def prefix_matches(self, prefix: str) -> List[int]:
+        """Indices of currencies whose symbol starts with the prefix"""
+        start = bisect.bisect_left(self.sorted_symbols, (prefix,))
+        matches = []
+        for symbol, index in self.sorted_symbols[start:]:
+            if not symbol.startswith(prefix):
+                break
+            matches.append(index)
+        return matches
+
+
+    def word_prefix_matches(self, prefix: str, limit: int) -> List[int]:
+        """Indices of currencies with a category, subcategory or exchange word starting with the prefix"""
+        start = bisect.bisect_left(self.sorted_words, (prefix,))
+        matches = []
+        for word, indices in self.sorted_words[start:]:
+            if not word.startswith(prefix):
+                break
+            matches.extend(indices[:limit])
+        return matches
+
+
+    def similar_symbols(self, query_trigrams: Set[str], min_similarity: float) -> Dict[int, float]:
+        """Trigram similarity of currency symbols sharing trigrams with the query"""
+        overlaps: Dict[int, int] = {}
+        for trigram in query_trigrams:
+            for index in self.postings.get(trigram, ()):
+                overlaps[index] = overlaps.get(index, 0) + 1
+
+        similarities = {}
+        for index, overlap in overlaps.items():
+            similarity = overlap / (len(query_trigrams) + self.symbol_trigram_counts[index] - overlap)
+            if similarity >= min_similarity:
+                similarities[index] = similarity
+        return similarities
+
+
+
+class CurrencySearchIndex:
+    """
+    In-memory prefix and trigram index of currencies for autocomplete.
+
+    The index is built lazily on the first search and rebuilt after it is invalidated,
+    which happens when a change to a currency is committed in this process. To pick up changes
+    made by other processes, the index is also rebuilt after `CURRENCY_SEARCH_INDEX_TTL` seconds.
+
+    Each invalidation starts a new generation of the index. A snapshot built from currencies
+    read before an invalidation is not installed, so that it cannot replace a fresher one.
+    """
+    min_similarity = 0.3
+    """Minimum trigram similarity of a symbol to the query for it to be considered a match"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._snapshot: Optional[_IndexSnapshot] = None
+        self._built_at = 0.0
+        # `next` on a count is atomic, so invalidation does not need to wait for a rebuild
+        self._generations = itertools.count(1)
+        self._generation = 0
+
+
+    @property
+    def ttl(self) -> float:
+        return getattr(settings, "CURRENCY_SEARCH_INDEX_TTL", 300)
+
+
+    def invalidate(self) -> None:
+        """Invalidate the index so that it is rebuilt on the next search"""
+        self._generation = next(self._generations)
+        self._snapshot = None
+        return None
+
+
+    def get_snapshot(self) -> _IndexSnapshot:
+        """Returns the current snapshot of the index, building it if necessary"""
+        snapshot = self._snapshot
+        if snapshot is not None and time.monotonic() - self._built_at < self.ttl:
+            return snapshot
+
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is None or time.monotonic() - self._built_at >= self.ttl:
+                generation = self._generation
+                currencies = CurrencySerializer(Currency.objects.all(), many=True).data
+                snapshot = _IndexSnapshot(currencies)
+                if generation == self._generation:
+                    self._snapshot = snapshot
+                    self._built_at = time.monotonic()
+            return snapshot
+
+
+    def search(self, query: str, limit: int = 10) -> List[Dict]:
+        """
+        Search the index for currencies matching the query
+
+        :param query: The search query
+        :param limit: Maximum number of results to return
+        :return: Serialized currencies ordered by relevance
+        """
+        query = " ".join(query.lower().split())
+        if not query:
+            return []
+
+        snapshot = self.get_snapshot()
+        scores: Dict[int, float] = {}
+        # Exact symbol matches rank first, followed by symbol prefix matches, shorter symbols first
+        for index in snapshot.prefix_matches(query):
+            symbol = snapshot.symbols[index]
+            scores[index] = 100.0 if symbol == query else 80.0 + 10.0 * len(query) / len(symbol)
+
+        # Symbol prefix matches always rank above other matches, so other
+        # matches are only needed when there are not enough prefix matches
+        if len(scores) < limit:
+            # Similar symbols are ranked by trigram similarity. Very similar symbols
+            # rank above currencies whose category, subcategory or exchange matches
+            similarities = snapshot.similar_symbols(get_trigrams(query), self.min_similarity)
+            for index, similarity in similarities.items():
+                scores.setdefault(index, 50.0 * similarity)
+            for index in snapshot.word_prefix_matches(query, limit):
+                scores[index] = max(scores.get(index, 0.0), 40.0)
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], snapshot.symbols[item[0]]))
+        return [snapshot.currencies[index] for index, _ in ranked[:limit]]
+
+
+
+currency_search_index = CurrencySearchIndex()
@@ -1,10 +1,11 @@
 from rest_framework import serializers
 
 from .models import Currency
+from helpers.metrics import InstrumentedSerializerMixin
 
 
 
-class CurrencySerializer(serializers.ModelSerializer):
+class CurrencySerializer(InstrumentedSerializerMixin, serializers.ModelSerializer):
     """Model serializer for `Currency` model"""
     class Meta:
         model = Currency
@@ -25,7 +26,20 @@ class CurrencySerializer(serializers.ModelSerializer):
 
 
 
-class StrippedCurrencySerializer(serializers.ModelSerializer):
+class CurrencyImportSerializer(CurrencySerializer):
+    """
+    `Currency` model serializer for bulk imports
+
+    Symbol uniqueness is not validated per row, as existing currencies are updated on import.
+    """
+    class Meta(CurrencySerializer.Meta):
+        extra_kwargs = {
+            "symbol": {"validators": []},
+        }
+
+
+
+class StrippedCurrencySerializer(InstrumentedSerializerMixin, serializers.ModelSerializer):
     """Stripped down version of the `Currency` model serializer"""
     class Meta:
         model = Currency
@@ -0,0 +1,31 @@
+from django.db import transaction
+from django.dispatch import receiver
+from django.db.models.signals import post_save, post_delete
+
+from .models import Currency
+from .search import currency_search_index
+from .categories import currency_categories_cache
+
+
+
+@receiver(post_save, sender=Currency)
+@receiver(post_delete, sender=Currency)
+def invalidate_currency_search_index(sender: type[Currency], instance: Currency, using: str, **kwargs) -> None:
+    """
+    Invalidates the currency search index when a currency is saved or deleted,
+    once the change is committed, so that the index is not rebuilt from uncommitted data
+    """
+    transaction.on_commit(currency_search_index.invalidate, using=using)
+    return
+
+
+
+@receiver(post_save, sender=Currency)
+@receiver(post_delete, sender=Currency)
+def invalidate_currency_categories_cache(sender: type[Currency], instance: Currency, using: str, **kwargs) -> None:
+    """
+    Invalidates the cached currency categories when a currency is saved or deleted, once the change
+    is committed, so that a concurrent request cannot cache the categories from before the change
+    """
+    transaction.on_commit(currency_categories_cache.invalidate, using=using)
+    return
@@ -0,0 +1,370 @@
+import csv
+import io
+import json
+from unittest import mock
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import RequestFactory, override_settings
+from rest_framework_api_key.models import APIKey
+
+from api import db_routers
+
+from benchmarks.data import clear_data, seed_data
+from currency.importers import ImportFormatError, iter_json_rows, iter_rows
+from currency.categories import compute_currency_categories, currency_categories_cache, get_currency_categories
+from currency.models import Currency
+from ema.models import EMARecord, EMARecordTombstone
+from currency import search
+from currency.search import currency_search_index
+from helpers.testing import BudgetTestCase, DATASET_SIZES
+
+
+CURRENCIES_URL = "/api/v1/currencies/"
+
+
+
+class CurrencyEndpointBudgetTests(BudgetTestCase):
+    """Query and latency budgets of `/api/v1/currencies/`, at several dataset sizes"""
+
+    @classmethod
+    def setUpTestData(cls) -> None:
+        super().setUpTestData()
+        cls.user = get_user_model().objects.create_user(email="tests@example.com", password="password")
+
+
+    def seed(self, currencies: int) -> None:
+        clear_data()
+        seed_data(currencies, timeframes=2)
+        # Currencies are created in bulk, so the signals that invalidate the caches are not sent
+        currency_search_index.invalidate()
+        currency_categories_cache.invalidate()
+        return None
+
+
+    def test_list(self) -> None:
+        for size in DATASET_SIZES:
+            self.seed(size)
+            for params in ({}, {"search": "BENCH0000"}, {"search": "Crypto"}):
+                with self.subTest(currencies=size, params=params):
+                    with self.assertWithinBudget(3, 300, f"GET {CURRENCIES_URL} ({params}, {size} currencies)"):
+                        response = self.client.get(CURRENCIES_URL, params)
+                    self.assertEqual(response.status_code, 200)
+
+
+    def test_autocomplete(self) -> None:
+        url = f"{CURRENCIES_URL}autocomplete/"
+        for size in DATASET_SIZES:
+            self.seed(size)
+            with self.subTest(currencies=size, index="cold"):
+                # The first search builds the index
+                with self.assertWithinBudget(2, 500, f"GET {url} (cold, {size} currencies)"):
+                    response = self.client.get(url, {"q": "bench00"})
+                self.assertEqual(response.status_code, 200)
+
+            for query in ("bench00", "BENCH00042", "crypto", "bnch"):
+                with self.subTest(currencies=size, index="warm", query=query):
+                    with self.assertWithinBudget(1, 100, f"GET {url} (q={query}, {size} currencies)"):
+                        response = self.client.get(url, {"q": query})
+                    self.assertEqual(response.status_code, 200)
+
+
+    def test_categories(self) -> None:
+        url = f"{CURRENCIES_URL}categories/"
+        for size in DATASET_SIZES:
+            self.seed(size)
+            with self.subTest(currencies=size, cache="cold"):
+                with self.assertWithinBudget(2, 200, f"GET {url} (cold, {size} currencies)"):
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+
+            with self.subTest(currencies=size, cache="warm"):
+                with self.assertWithinBudget(1, 100, f"GET {url} (warm, {size} currencies)"):
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+
+
+    def test_delete(self) -> None:
+        self.authenticate(self.user)
+        for size in DATASET_SIZES:
+            self.seed(size)
+            with self.subTest(currencies=size):
+                # Deleting a currency also deletes its EMA records
+                currency = Currency.objects.order_by("symbol").last()
+                url = f"{CURRENCIES_URL}{currency.id}/delete/"
+                with self.assertWithinBudget(14, 300, f"DELETE {url} ({size} currencies)"):
+                    response = self.client.delete(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertFalse(Currency.objects.filter(id=currency.id).exists())
+
+
+
+    def test_queryset_delete(self) -> None:
+        # E.g. the "delete selected" admin action
+        self.seed(DATASET_SIZES[0])
+        currencies = Currency.objects.order_by("symbol")[:3]
+        record_count = EMARecord.objects.filter(currency__in=currencies).count()
+        with mock.patch("ema.managers.notify_group_of_ema_record_update_on_commit") as notify_many:
+            with mock.patch("ema.signals.notify_group_of_ema_record_update_on_commit") as notify_one:
+                Currency.objects.filter(pk__in=[currency.pk for currency in currencies]).delete()
+        notify_many.assert_called_once()
+        self.assertEqual(len(notify_many.call_args.args[1]["data"]["ids"]), record_count)
+        notify_one.assert_not_called()
+        self.assertEqual(Currency.objects.count(), DATASET_SIZES[0] - 3)
+        self.assertEqual(EMARecordTombstone.objects.count(), record_count)
+
+
+@override_settings(REPLICA_DATABASES=["replica"])
+class ReplicaRoutingTests(BudgetTestCase):
+    """
+    Routing of reads to replicas, using a second database as replica.
+
+    The replica holds only one of the primary database's currencies, so that
+    the number of listed currencies shows which database served the request.
+    """
+    databases = {"default", "replica"}
+
+    @classmethod
+    def setUpTestData(cls) -> None:
+        super().setUpTestData()
+        cls.user = get_user_model().objects.create_user(email="tests@example.com", password="password")
+        seed_data(3, timeframes=1)
+        Currency.objects.first().save(using="replica", force_insert=True)
+        # API keys and auth tokens are not copied, as they are read from the primary database
+
+
+    def setUp(self) -> None:
+        super().setUp()
+        cache.clear()
+        db_routers._replica_lags.clear()
+
+
+    def get_currency_count(self) -> int:
+        response = self.client.get(CURRENCIES_URL)
+        self.assertEqual(response.status_code, 200)
+        return response.json()["count"]
+
+
+    def test_reads_from_replica(self) -> None:
+        self.assertEqual(self.get_currency_count(), 1)
+
+
+    async def test_reads_from_replica_async(self) -> None:
+        response = await self.async_client.get(CURRENCIES_URL, headers={"X-API-KEY": self.api_key})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["count"], 1)
+
+
+    def test_reads_own_writes(self) -> None:
+        self.authenticate(self.user)
+        response = self.client.post(
+            CURRENCIES_URL, 
+            {"symbol": "NEW", "category": "Crypto", "subcategory": "Tests", "exchange": "BINANCE"}
+        )
+        self.assertEqual(response.status_code, 201)
+        # Sticky to the primary database after the write
+        self.assertEqual(self.get_currency_count(), 4)
+
+        del self.client.defaults["HTTP_AUTHORIZATION"]
+        self.assertEqual(self.get_currency_count(), 4)
+        cache.clear()
+        self.assertEqual(self.get_currency_count(), 1)
+
+
+    def test_credentials_are_read_from_primary(self) -> None:
+        # Created after the replica was seeded
+        self.authenticate(self.user)
+        _, self.client.defaults["HTTP_X_API_KEY"] = APIKey.objects.create_key(name="new")
+        self.assertEqual(self.get_currency_count(), 1)
+
+
+    def test_replication_lag(self) -> None:
+        replica = db_routers.connections["replica"]
+        for result, lag in ((None, None), (0, 0.0), (2.5, 2.5)):
+            with self.subTest(result=result):
+                cursor = mock.MagicMock()
+                cursor.__enter__.return_value.fetchone.return_value = (result,)
+                with mock.patch.object(replica, "vendor", "postgresql"), mock.patch.object(replica, "cursor", return_value=cursor):
+                    self.assertEqual(db_routers.get_replication_lag("replica"), lag)
+                cursor.__enter__.return_value.execute.assert_called_once_with(db_routers.POSTGRESQL_REPLICATION_LAG_SQL)
+
+
+    def test_falls_back_to_primary(self) -> None:
+        for lag in (60.0, None):
+            with self.subTest(lag=lag):
+                db_routers._replica_lags.clear()
+                with mock.patch.object(db_routers, "get_replication_lag", return_value=lag):
+                    self.assertEqual(self.get_currency_count(), 3)
+
+
+    def test_only_safe_requests_to_read_paths_use_replicas(self) -> None:
+        factory = RequestFactory()
+        self.assertEqual(db_routers.get_read_database(factory.get(CURRENCIES_URL)), "replica")
+        self.assertIsNone(db_routers.get_read_database(factory.post(CURRENCIES_URL)))
+        self.assertIsNone(db_routers.get_read_database(factory.get("/api/v1/accounts/")))
+
+
+
+class CurrencySearchIndexTests(BudgetTestCase):
+    """The in-memory currency autocomplete index"""
+
+    def setUp(self) -> None:
+        super().setUp()
+        clear_data()
+        for symbol, category, exchange in (
+            ("BTCUSD", "Crypto", "Binance"),
+            ("BTCUSDT", "Crypto", "Binance"),
+            ("ETHBTC", "Crypto", "Kraken"),
+            ("EURUSD", "Forex", "Oanda"),
+        ):
+            Currency.objects.create(symbol=symbol, category=category, subcategory="Test", exchange=exchange)
+        currency_search_index.invalidate()
+
+
+    def search(self, query: str, limit: int = 10) -> list:
+        return [currency["symbol"] for currency in currency_search_index.search(query, limit=limit)]
+
+
+    def test_ranking(self) -> None:
+        # Exact match, then prefix matches, shorter symbols first
+        self.assertEqual(self.search("btcusd")[:2], ["BTCUSD", "BTCUSDT"])
+        # Similar symbols
+        self.assertIn("BTCUSD", self.search("btcusx"))
+        # Category and exchange words
+        self.assertEqual(self.search("forex"), ["EURUSD"])
+        self.assertEqual(self.search("krak"), ["ETHBTC"])
+        self.assertEqual(self.search("   "), [])
+
+
+    def test_limit(self) -> None:
+        self.assertEqual(len(self.search("btc", limit=1)), 1)
+        response = self.client.get(f"{CURRENCIES_URL}autocomplete/", {"q": "btc", "limit": -5})
+        self.assertEqual(len(response.json()["data"]), 1)
+
+
+    def test_invalidated_on_commit(self) -> None:
+        self.assertEqual(self.search("ltc"), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            Currency.objects.create(symbol="LTCUSD", category="Crypto", subcategory="Test", exchange="Binance")
+            # Not invalidated until the change is committed
+            self.assertEqual(self.search("ltc"), [])
+        self.assertEqual(self.search("ltc"), ["LTCUSD"])
+
+
+    def test_stale_rebuild_is_not_installed(self) -> None:
+        snapshot_class = search._IndexSnapshot
+
+        def invalidate_while_building(currencies):
+            # Simulates a currency change committed while the index is being rebuilt
+            currency_search_index.invalidate()
+            return snapshot_class(currencies)
+
+        with mock.patch.object(search, "_IndexSnapshot", side_effect=invalidate_while_building):
+            snapshot = currency_search_index.get_snapshot()
+        self.assertEqual(len(snapshot.currencies), Currency.objects.count())
+        self.assertIsNone(currency_search_index._snapshot)
+
+
+
+class CurrencyCategoriesCacheTests(BudgetTestCase):
+    """The two tier cache of currency categories"""
+
+    def setUp(self) -> None:
+        super().setUp()
+        clear_data()
+        Currency.objects.create(symbol="BTCUSD", category="Crypto", subcategory="Coins", exchange="Binance")
+        currency_categories_cache.invalidate()
+
+
+    def test_invalidated_on_commit(self) -> None:
+        self.assertEqual(get_currency_categories()["categories"], ["Crypto"])
+        with self.captureOnCommitCallbacks(execute=True):
+            Currency.objects.create(symbol="EURUSD", category="Forex", subcategory="Majors", exchange="Oanda")
+            # A request served before the commit still gets the committed categories
+            self.assertEqual(get_currency_categories()["categories"], ["Crypto"])
+        self.assertEqual(get_currency_categories()["categories"], ["Crypto", "Forex"])
+
+
+    def test_subcategory_counts_per_category(self) -> None:
+        Currency.objects.create(symbol="ETHUSD", category="Crypto", subcategory="Coins", exchange="Binance")
+        Currency.objects.create(symbol="XAUUSD", category="Commodities", subcategory="Coins", exchange="Oanda")
+        categories = compute_currency_categories()
+        self.assertEqual(categories["subcategories"], ["Coins"])
+        self.assertEqual(categories["category_counts"], {"Crypto": 2, "Commodities": 1})
+        self.assertEqual(categories["subcategory_counts"], {"Crypto": {"Coins": 2}, "Commodities": {"Coins": 1}})
+
+
+    def test_shared_tier_expires(self) -> None:
+        with mock.patch.object(cache, "set", wraps=cache.set) as shared_set:
+            get_currency_categories()
+        shared_set.assert_called_once()
+        self.assertEqual(shared_set.call_args.kwargs["timeout"], settings.CURRENCY_CATEGORIES_CACHE_TTL)
+
+
+
+class CurrencyImportTests(BudgetTestCase):
+    """Streaming import of currencies from CSV and JSON files"""
+
+    ROWS = [
+        {"symbol": "BTCUSD", "category": "Crypto", "subcategory": "Coins", "exchange": "Binance"},
+        {"symbol": "EURUSD", "category": "Forex", "subcategory": "Majors", "exchange": "Oanda"},
+    ]
+
+    def setUp(self) -> None:
+        super().setUp()
+        clear_data()
+        self.authenticate(get_user_model().objects.create_user(email="importer@example.com", password="password"))
+
+
+    def upload(self, content: bytes, name: str):
+        file = SimpleUploadedFile(name, content)
+        return self.client.post(f"{CURRENCIES_URL}import/", {"file": file}, format="multipart")
+
+
+    def test_json_rows_split_across_chunks(self) -> None:
+        documents = {
+            "array": json.dumps([*self.ROWS, 12345, 6.5e10]),
+            "lines": "\n".join(json.dumps(row) for row in [*self.ROWS, 12345, 6.5e10]),
+        }
+        for name, document in documents.items():
+            for chunk_size in (1, 2, 3, 7, 64):
+                with self.subTest(document=name, chunk_size=chunk_size):
+                    rows = list(iter_json_rows(io.StringIO(document), chunk_size=chunk_size))
+                    self.assertEqual(rows, [*self.ROWS, 12345, 6.5e10])
+
+
+    def test_invalid_json(self) -> None:
+        with self.assertRaises(ImportFormatError):
+            list(iter_json_rows(io.StringIO('[{"symbol": "BTCUSD"}, {"symbol": '), chunk_size=4))
+
+
+    def test_decoding_and_csv_errors_are_format_errors(self) -> None:
+        with self.assertRaises(ImportFormatError):
+            list(iter_rows(io.BytesIO(b"symbol,category\n\xff\xfe,Crypto\n"), "csv"))
+        with self.assertRaises(ImportFormatError):
+            list(iter_rows(io.BytesIO(b"symbol\n" + b"x" * (csv.field_size_limit() + 1)), "csv"))
+        with self.assertRaises(ImportFormatError):
+            iter_rows(io.BytesIO(b""), "xml")
+
+
+    def test_import(self) -> None:
+        content = json.dumps([*self.ROWS, {"symbol": "", "category": "Crypto"}]).encode()
+        response = self.upload(content, "currencies.json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["data"]["imported"], 2)
+        self.assertEqual(response.json()["data"]["errors"][0]["row"], 3)
+        self.assertEqual(Currency.objects.count(), 2)
+
+
+    def test_unparsable_file_imports_nothing(self) -> None:
+        content = "\n".join(json.dumps(row) for row in self.ROWS).encode() + b"\n{invalid"
+        with mock.patch("currency.importers.IMPORT_BATCH_SIZE", 1):
+            response = self.upload(content, "currencies.json")
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Currency.objects.exists())
+
+        content = b"symbol,category,subcategory,exchange\nBTCUSD,Crypto,Coins,Binance\n\xff,Forex,Majors,Oanda\n"
+        response = self.upload(content, "currencies.csv")
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Currency.objects.exists())
@@ -7,6 +7,8 @@ app_name = "currencies"
 
 urlpatterns = [
     path("", views.currency_list_create_api_view, name="currency__list-create"),
+    path("import/", views.currency_import_api_view, name="currency__import"),
+    path("autocomplete/", views.currency_autocomplete_api_view, name="currency__autocomplete"),
     path("categories/", views.currency_category_list_api_view, name="currency-category__list"),
     path("<uuid:currency_id>/delete/", views.currency_destroy_api_view, name="currency__delete"),
 ]
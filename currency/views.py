@@ -1,6 +1,7 @@
 
+import os
 from django.http import Http404
-from rest_framework import generics, response, status, views
+from rest_framework import generics, parsers, response, status, views
 from django.views.decorators.csrf import csrf_exempt
 from typing import Dict
 
@@ -8,7 +9,11 @@ from typing import Dict
 from currency.models import Currency
 from currency.managers import CurrencyQuerySet
 from currency.serializers import CurrencySerializer
+from currency.search import currency_search_index
+from currency.categories import get_currency_categories
+from currency.importers import ImportFormatError, import_currencies, iter_rows
 from api.permission_mixins import AuthenticationRequired, AuthenticationRequiredOrReadOnly
+from api.async_views import AsyncListMixin
 
 from helpers.logging import log_exception
 
@@ -17,7 +22,7 @@ currency_qs = Currency.objects.all()
 
 
 
-class CurrencyListCreateAPIView(AuthenticationRequiredOrReadOnly, generics.ListCreateAPIView):
+class CurrencyListCreateAPIView(AuthenticationRequiredOrReadOnly, AsyncListMixin, generics.ListCreateAPIView):
     """API view for listing and creating currencies"""
     model = Currency
     serializer_class = CurrencySerializer
@@ -45,26 +50,113 @@ class CurrencyListCreateAPIView(AuthenticationRequiredOrReadOnly, generics.ListC
 
 
 
+class CurrencyImportAPIView(AuthenticationRequired, views.APIView):
+    """API view for importing currencies in bulk from a CSV or JSON file"""
+    http_method_names = ["post"]
+    parser_classes = [parsers.MultiPartParser]
+
+    def post(self, request, *args, **kwargs) -> response.Response:
+        """
+        Import currencies from an uploaded file. Currencies with existing symbols are updated.
+
+        The file should be uploaded as multipart form data with the key "file". CSV files should
+        have a header row. JSON files should contain an array of objects or JSON lines. 
+        Each row should have "symbol", "category", "subcategory" and "exchange" values.
+        Invalid rows are reported and skipped, but if the file cannot be parsed, no currency is imported.
+
+        The following query parameters are supported:
+        - format: Format of the file, "csv" or "json". Defaults to the file extension.
+        """
+        file = request.FILES.get("file", None)
+        if file is None:
+            return response.Response(
+                data={
+                    "status": "error",
+                    "message": "No file was uploaded! Upload a CSV or JSON file with the key 'file'."
+                },
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        format = request.query_params.get("format", None) or os.path.splitext(file.name)[1].lstrip(".").lower()
+        try:
+            result = import_currencies(iter_rows(file.file, format))
+        except ImportFormatError as exc:
+            return response.Response(
+                data={
+                    "status": "error",
+                    "message": str(exc)
+                },
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        except Exception as exc:
+            log_exception(exc)
+            return response.Response(
+                data={
+                    "status": "error",
+                    "message": "An error occurred while attempting to import the currencies!"
+                },
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+        
+        return response.Response(
+            data={
+                "status": "success",
+                "message": f"{result['imported']} currencies imported successfully!",
+                "data": result
+            },
+            status=status.HTTP_200_OK
+        )
+
+
+
+
+class CurrencyAutocompleteAPIView(AuthenticationRequiredOrReadOnly, views.APIView):
+    """API view for currency autocomplete"""
+    http_method_names = ["get"]
+    url_search_param = "q"
+    default_limit = 10
+    max_limit = 50
+
+    def get(self, request, *args, **kwargs) -> response.Response:
+        """
+        Retrieve currencies matching a partial query, ordered by relevance
+
+        The following query parameters are supported:
+        - q: Partial symbol, category, subcategory or exchange
+        - limit: Maximum number of results to return. Defaults to 10, maximum 50
+        """
+        query = request.query_params.get(self.url_search_param, "")
+        try:
+            limit = max(min(int(request.query_params.get("limit", self.default_limit)), self.max_limit), 1)
+        except ValueError:
+            limit = self.default_limit
+
+        return response.Response(
+            data={
+                "status": "success",
+                "message": "Currencies retrieved successfully!",
+                "data": currency_search_index.search(query, limit=limit)
+            },
+            status=status.HTTP_200_OK
+        )
+
+
+
+
 class CurrencyCategoryListAPIView(views.APIView):
     """API view for listing currency categories and subcategories"""
-    queryset = currency_qs
     http_method_names = ["get"]
     
     def get(self, request, *args, **kwargs) -> response.Response:
         """
-        Retrieve a list of currency categories
+        Retrieve a list of currency categories and subcategories, 
+        with the number of currencies in each
         """
-        currencies = self.queryset
-        categories = currencies.values_list("category", flat=True).distinct()
-        subcategories = currencies.values_list("subcategory", flat=True).distinct()
         return response.Response(
             data={
                 "status": "success",
                 "message": "Currency categories retrieved successfully!",
-                "data": {
-                    "categories": set(categories),
-                    "subcategories": set(subcategories)
-                }
+                "data": get_currency_categories()
             },
             status=status.HTTP_200_OK
         )
@@ -112,6 +204,8 @@ class CurrencyDestroyAPIView(AuthenticationRequired, generics.DestroyAPIView):
 
         
 
-currency_list_create_api_view = csrf_exempt(CurrencyListCreateAPIView.as_view())
+currency_list_create_api_view = csrf_exempt(CurrencyListCreateAPIView.as_async_view())
+currency_import_api_view = csrf_exempt(CurrencyImportAPIView.as_view())
+currency_autocomplete_api_view = csrf_exempt(CurrencyAutocompleteAPIView.as_view())
 currency_category_list_api_view = csrf_exempt(CurrencyCategoryListAPIView.as_view())
 currency_destroy_api_view = csrf_exempt(CurrencyDestroyAPIView.as_view())
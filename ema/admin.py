@@ -1,6 +1,7 @@
 from django.contrib import admin
 
-from .models import EMARecord
+from .models import EMARecord, Candle
 
 
 admin.site.register(EMARecord)
+admin.site.register(Candle)
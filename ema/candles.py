@@ -0,0 +1,175 @@
+import datetime
+from typing import Dict, List, Mapping, Optional, Tuple
+from django.db import models, transaction
+import numpy as np
+
+from .models import EMARecord, Candle, TrendChoices
+from .indicators import INDICATORS, next_ema, to_float
+from currency.models import Currency
+
+
+EMA_PERIODS = (20, 50, 100, 200)
+
+# The window over which the `monhigh`, `monlow` and `monmid` values of
+# an EMA record are computed from candles
+MONTH = datetime.timedelta(days=30)
+
+
+def get_trend(emas: Mapping[int, float]) -> str:
+    """
+    Get the trend direction from EMA alignment.
+
+    The trend is upwards when EMA20 > EMA50 > EMA100, downwards when EMA20 < EMA50 < EMA100
+    and sideways otherwise.
+    """
+    if emas[20] > emas[50] > emas[100]:
+        return TrendChoices.UPWARDS
+    if emas[20] < emas[50] < emas[100]:
+        return TrendChoices.DOWNWORDS
+    return TrendChoices.SIDEWAYS
+
+
+def upsert_candles(currency: Currency, timeframe: datetime.timedelta, candles: List[Dict]) -> None:
+    """Create or update candles of a series in a single query"""
+    Candle.objects.bulk_create(
+        [Candle(currency=currency, timeframe=timeframe, **candle) for candle in candles],
+        update_conflicts=True,
+        unique_fields=["currency", "timeframe", "open_time"],
+        update_fields=["open", "high", "low", "close", "updated_at"],
+    )
+    return None
+
+
+def compute_indicators(checkpoint: Optional[Candle], candles: List[Candle]) -> None:
+    """
+    Compute all registered indicators for the given candles, resuming from the checkpoint.
+
+    A single new candle, which is the case for live candles, is computed incrementally.
+    Otherwise, the indicators are computed over arrays of the candle data.
+
+    :param checkpoint: The candle before the first of the given candles, if any.
+    :param candles: The candles to compute indicators for, ordered by open time.
+    """
+    previous_state = checkpoint.indicator_state if checkpoint else {}
+    for candle in candles:
+        candle.indicator_values = {}
+        candle.indicator_state = {}
+
+    if len(candles) == 1:
+        candle = candles[0]
+        for name, indicator in INDICATORS.items():
+            values, state = indicator.update(previous_state.get(name), candle.high, candle.low, candle.close)
+            candle.indicator_values.update(values)
+            candle.indicator_state[name] = state
+        return None
+
+    high = np.fromiter((candle.high for candle in candles), dtype=float, count=len(candles))
+    low = np.fromiter((candle.low for candle in candles), dtype=float, count=len(candles))
+    close = np.fromiter((candle.close for candle in candles), dtype=float, count=len(candles))
+    for name, indicator in INDICATORS.items():
+        values, states = indicator.backfill(high, low, close, previous_state.get(name))
+        for index, candle in enumerate(candles):
+            candle.indicator_values.update({output: to_float(values[output][index]) for output in indicator.outputs})
+            candle.indicator_state[name] = states[index]
+    return None
+
+
+def recompute_ema_series(
+    currency: Currency,
+    timeframe: datetime.timedelta,
+    start: datetime.datetime
+) -> List[Candle]:
+    """
+    Recompute the EMA and indicator checkpoints of all candles of a series from `start` onwards.
+
+    Only the affected suffix of the series is recomputed, resuming from the EMA
+    checkpoint stored on the last candle before `start`.
+
+    :param currency: The currency of the series.
+    :param timeframe: The timeframe of the series.
+    :param start: The open time of the earliest new or corrected candle.
+    :return: The recomputed candles, ordered by open time.
+    """
+    series = Candle.objects.filter(currency=currency, timeframe=timeframe)
+    checkpoint = series.filter(open_time__lt=start).order_by("-open_time").first()
+    suffix = list(series.filter(open_time__gte=start).order_by("open_time"))
+
+    emas = {period: getattr(checkpoint, f"ema{period}", None) for period in EMA_PERIODS}
+    for candle in suffix:
+        for period in EMA_PERIODS:
+            emas[period] = next_ema(emas[period], candle.close, 2 / (period + 1))
+            setattr(candle, f"ema{period}", emas[period])
+    compute_indicators(checkpoint, suffix)
+
+    Candle.objects.bulk_update(
+        suffix, 
+        fields=[*(f"ema{period}" for period in EMA_PERIODS), "indicator_values", "indicator_state"]
+    )
+    return suffix
+
+
+def update_ema_record_from_candle(currency: Currency, timeframe: datetime.timedelta, latest: Candle) -> EMARecord:
+    """
+    Update (or create) the EMA record of a series using its latest candle.
+
+    The record is saved once, so connected clients receive a single websocket
+    update no matter how many candles were recomputed.
+    """
+    month_range = Candle.objects.filter(
+        currency=currency,
+        timeframe=timeframe,
+        open_time__gt=latest.open_time - MONTH,
+        open_time__lte=latest.open_time,
+    ).aggregate(monhigh=models.Max("high"), monlow=models.Min("low"))
+    emas = {period: getattr(latest, f"ema{period}") for period in EMA_PERIODS}
+
+    record = EMARecord.objects.filter(currency=currency, timeframe=timeframe).first()
+    if record is None:
+        record = EMARecord(currency=currency, timeframe=timeframe)
+
+    record.close = latest.close
+    record.ema20 = emas[20]
+    record.ema50 = emas[50]
+    record.ema100 = emas[100]
+    record.ema200 = emas[200]
+    record.trend = get_trend(emas)
+    record.monhigh = month_range["monhigh"]
+    record.monlow = month_range["monlow"]
+    record.monmid = (month_range["monhigh"] + month_range["monlow"]) / 2
+    record.twenty_greater_than_fifty = emas[20] > emas[50]
+    record.fifty_greater_than_hundred = emas[50] > emas[100]
+    record.hundred_greater_than_twohundred = emas[100] > emas[200]
+    record.close_greater_than_hundred = latest.close > emas[100]
+    record.indicators = latest.indicator_values
+    record.save()
+    return record
+
+
+def ingest_candles(candles: List[Dict]) -> List[EMARecord]:
+    """
+    Ingest new, late or corrected candles.
+
+    Candles are grouped by series (currency and timeframe). For each series, the candles
+    are upserted, the EMA series is recomputed from the earliest affected candle and
+    the EMA record of the series is updated. If a series has several candles with the same
+    open time, the last one is used, as an upsert cannot update a row twice in PostgreSQL.
+
+    :param candles: List of validated candle data. Each item should contain
+    `currency`, `timeframe`, `open_time`, `open`, `high`, `low` and `close`.
+    :return: The updated EMA records, one per series.
+    """
+    series: Dict[Tuple[Currency, datetime.timedelta], Dict[datetime.datetime, Dict]] = {}
+    for candle in candles:
+        candle = candle.copy()
+        key = (candle.pop("currency"), candle.pop("timeframe"))
+        series.setdefault(key, {})[candle["open_time"]] = candle
+
+    records = []
+    for (currency, timeframe), candles_by_open_time in series.items():
+        series_candles = list(candles_by_open_time.values())
+        with transaction.atomic():
+            upsert_candles(currency, timeframe, series_candles)
+            start = min(candle["open_time"] for candle in series_candles)
+            recomputed = recompute_ema_series(currency, timeframe, start)
+            records.append(update_ema_record_from_candle(currency, timeframe, recomputed[-1]))
+    return records
@@ -0,0 +1,154 @@
+import json
+import select
+import time
+from typing import Any, Dict, Iterator, List
+from django.db import close_old_connections, connections
+
+from helpers.metrics import change_feed_delay_seconds, change_feed_events_total
+from .models import EMARecord
+from .serializers import EMARecordSerializer
+from .utils import WATCH_VALUES_INTERNAL_TO_EXTERNAL_NAME_MAPPING, notify_group_of_ema_record_update_via_websocket
+
+
+# Channel the `ema_record_notify_change` trigger notifies of committed changes to EMA records.
+# See migration `0011_emarecord_change_feed_trigger`.
+CHANGE_FEED_CHANNEL = "ema_record_changes"
+
+
+def coalesce_changes(changes: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """
+    Merge the changes of each EMA record into a single change, keeping the order in which records first changed.
+
+    A record created and then updated is a "create", a record updated several times is an "update"
+    of all changed columns, and a record created and then deleted is dropped.
+
+    :param changes: Changes as notified by the trigger, in commit order. Each change has
+    an "op" ("create", "update" or "delete"), the "id" of the record and, for updates, the "changed" columns.
+    """
+    coalesced: Dict[str, Dict[str, Any]] = {}
+    for change in changes:
+        record_id = str(change["id"])
+        previous = coalesced.get(record_id)
+        if previous is None:
+            coalesced[record_id] = {**change, "changed": list(change.get("changed") or [])}
+        elif change["op"] == "delete":
+            if previous["op"] == "create":
+                del coalesced[record_id]
+            else:
+                coalesced[record_id] = {**change, "changed": []}
+        elif change["op"] == "update" and previous["op"] == "update":
+            previous["changed"] = list(dict.fromkeys([*previous["changed"], *(change.get("changed") or [])]))
+    return coalesced
+
+
+def get_changed_fields(columns: List[str]) -> List[str]:
+    """Returns the `EMARecordSerializer` field names of changed columns of the EMA record table"""
+    fields = []
+    for column in columns:
+        field = column[:-3] if column.endswith("_id") else column
+        fields.append(WATCH_VALUES_INTERNAL_TO_EXTERNAL_NAME_MAPPING.get(field, field))
+    return fields
+
+
+def build_change_events(changes: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Returns the websocket events for a batch of changes notified by the trigger.
+
+    Events use the same codes as the events sent from signals: a single change is sent as a
+    "create", "update" or "delete" event, and multiple changes of the same kind as a single
+    "create_many", "update_many" or "delete_many" event. Created and updated records are
+    loaded in one query. Records deleted since they were changed are skipped.
+    """
+    coalesced = coalesce_changes(changes)
+    records = {
+        str(record.pk): record
+        for record in EMARecord.objects.select_related("currency").filter(
+            pk__in=[record_id for record_id, change in coalesced.items() if change["op"] != "delete"]
+        )
+    }
+
+    created, updated, deleted = [], [], []
+    for record_id, change in coalesced.items():
+        if change["op"] == "delete":
+            deleted.append(record_id)
+            continue
+        record = records.get(record_id)
+        if record is None:
+            continue
+        data = EMARecordSerializer(record).data
+        if change["op"] == "create":
+            created.append(data)
+            continue
+        change_data = {field: data[field] for field in get_changed_fields(change["changed"]) if field in data}
+        if change_data:
+            change_data["id"] = record_id
+            updated.append(change_data)
+
+    events = []
+    if len(created) == 1:
+        events.append({"code": "create", "data": created[0]})
+    elif created:
+        events.append({"code": "create_many", "data": created})
+    if len(updated) == 1:
+        events.append({"code": "update", "data": updated[0]})
+    elif updated:
+        events.append({"code": "update_many", "data": updated})
+    if len(deleted) == 1:
+        events.append({"code": "delete", "data": {"id": deleted[0]}})
+    elif deleted:
+        events.append({"code": "delete_many", "data": {"ids": deleted}})
+    return events
+
+
+def publish_changes(changes: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Send the websocket events for a batch of changes notified by the trigger"""
+    now = time.time()
+    for change in changes:
+        if "ts" in change:
+            change_feed_delay_seconds.observe(max(now - change["ts"], 0.0))
+
+    events = build_change_events(changes)
+    for event in events:
+        notify_group_of_ema_record_update_via_websocket("ema_record_updates", event)
+        change_feed_events_total.labels(event["code"]).inc()
+    return events
+
+
+def listen_for_changes(alias: str = "default", batch_interval: float = 0.05, batch_size: int = 1000) -> Iterator[List[Dict[str, Any]]]:
+    """
+    Listen for changes to EMA records on a dedicated PostgreSQL connection, and yield them in batches.
+
+    After the first change of a batch, further changes are collected for up to `batch_interval`
+    seconds or until there are `batch_size` changes, so that changes committed together,
+    e.g. by a bulk write, are sent together.
+
+    Changes committed while not listening are not delivered, as notifications are not persisted.
+    """
+    from django.db.backends.postgresql.base import DatabaseWrapper as PostgreSQLDatabaseWrapper
+
+    wrapper = connections.create_connection(alias)
+    # Bypass connection pools, the connection is held for as long as it listens
+    connection = PostgreSQLDatabaseWrapper.get_new_connection(wrapper, wrapper.get_connection_params())
+    connection.autocommit = True
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f"LISTEN {CHANGE_FEED_CHANNEL}")
+
+        while True:
+            if select.select([connection], [], [], 5.0) == ([], [], []):
+                continue
+            connection.poll()
+            deadline = time.monotonic() + batch_interval
+            while len(connection.notifies) < batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                if select.select([connection], [], [], remaining) != ([], [], []):
+                    connection.poll()
+
+            notifies = connection.notifies[:]
+            del connection.notifies[:]
+            close_old_connections()
+            yield [json.loads(notify.payload) for notify in notifies]
+    finally:
+        connection.close()
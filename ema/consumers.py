@@ -1,5 +1,13 @@
+import time
+from django.conf import settings
 from channels.generic.websocket import AsyncJsonWebsocketConsumer
 
+from helpers.metrics import (
+    get_channel_queue_depth, websocket_connections, websocket_group_members,
+    websocket_messages_sent_total, websocket_messages_dropped_total, websocket_send_queue_depth
+)
+from helpers.tracing import record_span
+
 
 
 class EMARecordEventsConsumer(AsyncJsonWebsocketConsumer):
@@ -13,6 +21,9 @@ class EMARecordEventsConsumer(AsyncJsonWebsocketConsumer):
             self.channel_name
         )
         await self.accept()
+        self.connected = True
+        websocket_connections.inc()
+        websocket_group_members.labels(self.group_name).inc()
 
 
     async def disconnect(self, close_code):
@@ -20,6 +31,10 @@ class EMARecordEventsConsumer(AsyncJsonWebsocketConsumer):
             self.group_name,
             self.channel_name
         )
+        if getattr(self, "connected", False):
+            self.connected = False
+            websocket_connections.dec()
+            websocket_group_members.labels(self.group_name).dec()
 
 
     async def receive_json(self, content, **kwargs):
@@ -27,7 +42,26 @@ class EMARecordEventsConsumer(AsyncJsonWebsocketConsumer):
     
 
     async def send_ema_record_update(self, event):
-        await self.send_json(content=event['data'])
+        received_ns = time.time_ns()
+        websocket_send_queue_depth.observe(get_channel_queue_depth(self.channel_layer, self.channel_name))
+        content = event['data']
+        trace = event.get('trace')
+        if settings.WEBSOCKET_INCLUDE_SERVER_TIMESTAMP:
+            content = {**content, 'server_ts': time.time_ns() / 1_000_000}
+            if trace:
+                content['trace_id'] = trace['id']
+        try:
+            await self.send_json(content=content)
+        except Exception:
+            websocket_messages_dropped_total.labels("send_error").inc()
+            raise
+        websocket_messages_sent_total.inc()
+
+        if trace:
+            sent_ns = time.time_ns()
+            record_span(trace['id'], "channel_layer_delivery", trace['group_send_ns'], received_ns, channel=self.channel_name)
+            record_span(trace['id'], "websocket_send", received_ns, sent_ns, channel=self.channel_name)
+            record_span(trace['id'], "end_to_end", trace['received_ns'], sent_ns, channel=self.channel_name)
 
 
 
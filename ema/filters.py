@@ -1,10 +1,17 @@
+import copy
 import functools
-from typing import Any, List, Mapping, Generator
+import re
+from typing import Any, Callable, Dict, List, Mapping, Generator, Optional, Tuple
 import itertools
 from django.db import models
+from django.db.models import lookups
+from django.db.models.fields.json import KT
+from django.db.models.functions import Cast, NullIf
 from django.utils.dateparse import parse_duration
 
 from helpers.queryset_filterers import QueryDictQuerySetFilterer
+from helpers.expressions import ExpressionCompiler, ExpressionError
+from .indicators import get_indicator_outputs
 
 
 WATCH_VALUE_QUERY_FILTERS = {
@@ -96,9 +103,112 @@ def sideways_watch_filters():
 
 
 
+# EMA record fields that can be used in filter expressions
+EXPRESSION_FIELDS = (
+    "close",
+    "ema20",
+    "ema50",
+    "ema100",
+    "ema200",
+    "monhigh",
+    "monlow",
+    "monmid",
+    "twenty_greater_than_fifty",
+    "fifty_greater_than_hundred",
+    "hundred_greater_than_twohundred",
+    "close_greater_than_hundred",
+)
+
+EXPRESSION_BOOLEAN_FIELDS = (
+    "twenty_greater_than_fifty",
+    "fifty_greater_than_hundred",
+    "hundred_greater_than_twohundred",
+    "close_greater_than_hundred",
+)
+
+
+def get_indicator_value(output: str) -> models.Expression:
+    """
+    Returns the value of an indicator output as a float.
+
+    Outputs that are not computed yet, e.g. during the warm-up period of the indicator,
+    are stored as JSON null and are NULL, so they do not match any comparison.
+    """
+    # PostgreSQL extracts JSON null as NULL, SQLite as the text "null"
+    return Cast(NullIf(KT(f"indicators__{output}"), models.Value("null")), models.FloatField())
+
+
+def get_expression_names() -> Dict[str, Callable[[], models.Expression]]:
+    """Returns the names that can be used in EMA record filter expressions"""
+    names = {field: functools.partial(models.F, field) for field in EXPRESSION_FIELDS}
+    # Trend is stored as text
+    names["trend"] = lambda: Cast("trend", models.IntegerField())
+    for output in get_indicator_outputs():
+        names[output] = functools.partial(get_indicator_value, output)
+    return names
+
+
+# Cache compiled expressions by expression text, so that 
+# repeated screens are only parsed once
+@functools.lru_cache(maxsize=512)
+def compile_expression(text: str) -> models.Q:
+    """
+    Compile an EMA record filter expression into a Q object
+
+    :param text: The expression text, e.g. "close > ema50 * 1.02 and ema20 > ema50 and trend = 1"
+    :raises ExpressionError: If the expression is invalid or not allowed
+    """
+    return ExpressionCompiler(get_expression_names(), boolean_names=EXPRESSION_BOOLEAN_FIELDS).compile(text)
+
+
+
+INDICATOR_LOOKUPS = {
+    "exact": lookups.Exact,
+    "gt": lookups.GreaterThan,
+    "gte": lookups.GreaterThanOrEqual,
+    "lt": lookups.LessThan,
+    "lte": lookups.LessThanOrEqual,
+}
+
 
 class EMARecordQSFilterer(QueryDictQuerySetFilterer):
-    """Filters EmaRecord queryset by request query dict"""
+    """
+    Filters EmaRecord queryset by request query dict
+
+    Indicator values can be filtered using `<indicator_output>` or `<indicator_output>__<lookup>`
+    query parameters, where lookup is one of "gt", "gte", "lt" or "lte". For example, `rsi__gt=70`.
+    """
+    def __getattr__(self, name: str):
+        # Provides `parse_<indicator_output>__<lookup>` methods for all registered indicators
+        indicator_filter = self.get_indicator_filter(name.removeprefix("parse_")) if name.startswith("parse_") else None
+        if indicator_filter is None:
+            raise AttributeError(name)
+        return functools.partial(self.parse_indicator_value, *indicator_filter)
+
+
+    @staticmethod
+    def get_indicator_filter(key: str) -> Optional[Tuple[str, str]]:
+        """Returns the indicator output and lookup of an indicator query parameter, or None if it is not one"""
+        output, _, lookup = key.partition("__")
+        lookup = lookup or "exact"
+        if output not in get_indicator_outputs() or lookup not in INDICATOR_LOOKUPS:
+            return None
+        return output, lookup
+
+
+    @classmethod
+    def is_filter(cls, key: str) -> bool:
+        return super().is_filter(key) or cls.get_indicator_filter(key) is not None
+    
+
+    def parse_indicator_value(self, output: str, lookup: str, value: str) -> models.Q:
+        try:
+            value = float(value)
+        except ValueError:
+            raise self.ParseError([f"Invalid value '{value}' for {output} parameter"])
+        # Compared as floats, rather than as JSON, so that JSON null values do not match
+        return models.Q(INDICATOR_LOOKUPS[lookup](get_indicator_value(output), value))
+    
     def parse_ema20(self, value: str) -> models.Q:
         return models.Q(ema20=float(value))
     
@@ -138,4 +248,23 @@ class EMARecordQSFilterer(QueryDictQuerySetFilterer):
     
     def parse_subcategory(self, value: str) -> models.Q:
         return models.Q(currency__subcategory__iexact=value)
+    
+    @classmethod
+    def get_signature_part(cls, key: str, value: str) -> str:
+        if key == "watch":
+            # Each watch type filters on a different combination of fields
+            return f"watch={value.upper().strip()}"
+        if key == "expr":
+            # Numbers and whitespace in expressions do not change the shape of the query
+            expression = re.sub(r"\s*([<>=!]=?|[-+*/()])\s*", r"\1", " ".join(value.lower().split()))
+            expression = re.sub(r"(?<![\w.])\d+(\.\d*)?", "?", expression)
+            return f"expr={expression}"
+        return key
+    
+    def parse_expr(self, value: str) -> models.Q:
+        try:
+            # Copy the cached Q object so that it is not mutated when applied
+            return copy.deepcopy(compile_expression(value))
+        except ExpressionError as exc:
+            raise self.ParseError([str(exc)])
 
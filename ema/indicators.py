@@ -0,0 +1,272 @@
+import collections
+import math
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+
+
+class Indicator:
+    """
+    Base class for technical indicators computed from candles.
+
+    Each indicator must implement:
+    - `backfill` which computes the indicator over NumPy arrays of candle data in a vectorized manner.
+    - `update` which computes the indicator for a single new candle in O(1) time from the previous state.
+
+    The state of an indicator is a JSON serializable dictionary which is stored on each candle as
+    a checkpoint, so that computation can resume from any candle.
+
+    Register new indicators using the `register_indicator` decorator.
+
+    Example:
+    ```python
+    @register_indicator
+    class MyIndicator(Indicator):
+        name = "my_indicator"
+        outputs = ("my_indicator",)
+        ...
+    ```
+    """
+    name: str
+    """Unique name of the indicator"""
+    outputs: Tuple[str, ...]
+    """Names of the values computed by the indicator. These must be unique across all indicators."""
+
+    def backfill(
+        self,
+        high: np.ndarray,
+        low: np.ndarray,
+        close: np.ndarray,
+        state: Optional[Dict] = None
+    ) -> Tuple[Dict[str, np.ndarray], List[Dict]]:
+        """
+        Compute the indicator over arrays of candle data.
+
+        :param high: Array of candle highs
+        :param low: Array of candle lows
+        :param close: Array of candle closes
+        :param state: The state of the indicator before the first candle, if any.
+        :return: A tuple of the computed values (one array per output)
+        and the state of the indicator after each candle.
+        """
+        raise NotImplementedError
+
+    def update(self, state: Optional[Dict], high: float, low: float, close: float) -> Tuple[Dict[str, Optional[float]], Dict]:
+        """
+        Compute the indicator for a new candle.
+
+        :param state: The state of the indicator before the candle, if any.
+        :param high: The candle high
+        :param low: The candle low
+        :param close: The candle close
+        :return: A tuple of the computed values and the new state of the indicator.
+        """
+        raise NotImplementedError
+
+
+
+INDICATORS: Dict[str, Indicator] = {}
+
+
+def register_indicator(indicator_class: type[Indicator]) -> type[Indicator]:
+    """Class decorator that adds an instance of the indicator class to the indicator registry"""
+    INDICATORS[indicator_class.name] = indicator_class()
+    return indicator_class
+
+
+def get_indicator_outputs() -> List[str]:
+    """Returns the names of the values computed by all registered indicators"""
+    return [output for indicator in INDICATORS.values() for output in indicator.outputs]
+
+
+def to_float(value: float) -> Optional[float]:
+    """Converts NaN values to None, so they can be stored as JSON"""
+    value = float(value)
+    return None if math.isnan(value) else value
+
+
+
+def ema_array(values: np.ndarray, alpha: float, initial: Optional[float] = None, block_size: int = 64) -> np.ndarray:
+    """
+    Vectorized exponential moving average.
+
+    Within each block, the recursion `ema[t] = ema[t-1] + alpha * (x[t] - ema[t-1])` is evaluated
+    in closed form with cumulative sums. Blocks keep the decay powers within a numerically safe range.
+
+    :param values: Values to average
+    :param alpha: The smoothing factor
+    :param initial: The EMA value before the first value. If None, the EMA is seeded with the first value.
+    :param block_size: Number of values evaluated per block
+    """
+    result = np.empty(len(values), dtype=float)
+    if not len(values):
+        return result
+
+    previous = float(values[0]) if initial is None else initial
+    decay = 1 - alpha
+    for start in range(0, len(values), block_size):
+        block = values[start:start + block_size]
+        powers = decay ** np.arange(1, len(block) + 1)
+        result[start:start + len(block)] = powers * (previous + alpha * np.cumsum(block / powers))
+        previous = result[start + len(block) - 1]
+    return result
+
+
+def next_ema(previous: Optional[float], value: float, alpha: float) -> float:
+    """Compute the next value of an exponential moving average"""
+    if previous is None:
+        return value
+    return previous + alpha * (value - previous)
+
+
+
+@register_indicator
+class RSI(Indicator):
+    """Relative Strength Index using Wilder's smoothing"""
+    name = "rsi"
+    outputs = ("rsi",)
+    period = 14
+
+    @staticmethod
+    def _rsi(average_gain: np.ndarray, average_loss: np.ndarray) -> np.ndarray:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            rsi = 100 - 100 / (1 + average_gain / average_loss)
+        return np.where(average_loss == 0, 100.0, rsi)
+
+    def backfill(self, high, low, close, state = None):
+        alpha = 1 / self.period
+        if state:
+            changes = np.diff(close, prepend=state["previous_close"])
+            initial_gain, initial_loss = state["average_gain"], state["average_loss"]
+        else:
+            # The first candle has no price change
+            changes = np.diff(close, prepend=close[:1])
+            changes[0] = np.nan
+            initial_gain = initial_loss = None
+
+        average_gain = np.full(len(close), np.nan)
+        average_loss = np.full(len(close), np.nan)
+        start = 0 if state else 1
+        average_gain[start:] = ema_array(np.clip(changes[start:], 0, None), alpha, initial_gain)
+        average_loss[start:] = ema_array(np.clip(-changes[start:], 0, None), alpha, initial_loss)
+        states = [
+            {"previous_close": float(c), "average_gain": to_float(g), "average_loss": to_float(l)}
+            for c, g, l in zip(close, average_gain, average_loss)
+        ]
+        return {"rsi": self._rsi(average_gain, average_loss)}, states
+
+    def update(self, state, high, low, close):
+        if not state:
+            return {"rsi": None}, {"previous_close": close, "average_gain": None, "average_loss": None}
+
+        alpha = 1 / self.period
+        change = close - state["previous_close"]
+        average_gain = next_ema(state["average_gain"], max(change, 0), alpha)
+        average_loss = next_ema(state["average_loss"], max(-change, 0), alpha)
+        rsi = self._rsi(np.array([average_gain]), np.array([average_loss]))[0]
+        return (
+            {"rsi": to_float(rsi)},
+            {"previous_close": close, "average_gain": average_gain, "average_loss": average_loss}
+        )
+
+
+
+@register_indicator
+class MACD(Indicator):
+    """Moving Average Convergence Divergence"""
+    name = "macd"
+    outputs = ("macd", "macd_signal", "macd_histogram")
+    fast_period = 12
+    slow_period = 26
+    signal_period = 9
+
+    def backfill(self, high, low, close, state = None):
+        state = state or {}
+        fast = ema_array(close, 2 / (self.fast_period + 1), state.get("fast_ema"))
+        slow = ema_array(close, 2 / (self.slow_period + 1), state.get("slow_ema"))
+        macd = fast - slow
+        signal = ema_array(macd, 2 / (self.signal_period + 1), state.get("signal"))
+        states = [
+            {"fast_ema": float(f), "slow_ema": float(s), "signal": float(sig)}
+            for f, s, sig in zip(fast, slow, signal)
+        ]
+        return {"macd": macd, "macd_signal": signal, "macd_histogram": macd - signal}, states
+
+    def update(self, state, high, low, close):
+        state = state or {}
+        fast = next_ema(state.get("fast_ema"), close, 2 / (self.fast_period + 1))
+        slow = next_ema(state.get("slow_ema"), close, 2 / (self.slow_period + 1))
+        macd = fast - slow
+        signal = next_ema(state.get("signal"), macd, 2 / (self.signal_period + 1))
+        return (
+            {"macd": macd, "macd_signal": signal, "macd_histogram": macd - signal},
+            {"fast_ema": fast, "slow_ema": slow, "signal": signal}
+        )
+
+
+
+@register_indicator
+class ATR(Indicator):
+    """Average True Range using Wilder's smoothing"""
+    name = "atr"
+    outputs = ("atr",)
+    period = 14
+
+    def backfill(self, high, low, close, state = None):
+        previous_close = np.concatenate(([state["previous_close"] if state else np.nan], close[:-1]))
+        true_range = np.fmax(high - low, np.fmax(np.abs(high - previous_close), np.abs(low - previous_close)))
+        atr = ema_array(true_range, 1 / self.period, state["atr"] if state else None)
+        states = [{"previous_close": float(c), "atr": float(a)} for c, a in zip(close, atr)]
+        return {"atr": atr}, states
+
+    def update(self, state, high, low, close):
+        if state:
+            previous_close = state["previous_close"]
+            true_range = max(high - low, abs(high - previous_close), abs(low - previous_close))
+        else:
+            true_range = high - low
+        atr = next_ema(state["atr"] if state else None, true_range, 1 / self.period)
+        return {"atr": atr}, {"previous_close": close, "atr": atr}
+
+
+
+@register_indicator
+class BollingerBands(Indicator):
+    """Bollinger Bands over a simple moving average of closes"""
+    name = "bollinger"
+    outputs = ("bollinger_upper", "bollinger_middle", "bollinger_lower")
+    period = 20
+    deviations = 2
+
+    def _bands(self, middle, std) -> Dict:
+        return {
+            "bollinger_upper": middle + self.deviations * std,
+            "bollinger_middle": middle,
+            "bollinger_lower": middle - self.deviations * std,
+        }
+
+    def backfill(self, high, low, close, state = None):
+        window = state["window"] if state else []
+        values = np.concatenate((window, close))
+        middle = np.full(len(close), np.nan)
+        std = np.full(len(close), np.nan)
+        if len(values) >= self.period:
+            windows = np.lib.stride_tricks.sliding_window_view(values, self.period)[-len(close):]
+            offset = len(close) - len(windows)
+            middle[offset:] = windows.mean(axis=1)
+            std[offset:] = windows.std(axis=1)
+
+        states = [
+            {"window": values[max(0, i + 1 - self.period):i + 1].tolist()}
+            for i in range(len(window), len(values))
+        ]
+        return self._bands(middle, std), states
+
+    def update(self, state, high, low, close):
+        window = collections.deque(state["window"] if state else [], maxlen=self.period)
+        window.append(close)
+        if len(window) < self.period:
+            values = {output: None for output in self.outputs}
+        else:
+            array = np.fromiter(window, dtype=float)
+            values = {key: float(value) for key, value in self._bands(array.mean(), array.std()).items()}
+        return values, {"window": list(window)}
@@ -0,0 +1,159 @@
+import datetime
+from typing import Dict, List, Optional, Tuple
+from django.conf import settings
+from django.db import transaction
+from django.db.models.functions import Upper
+from django.utils import timezone
+
+from currency.models import Currency
+from helpers.metrics import ingest_entries_total
+from helpers.queues import DurableQueue, get_queue
+from .models import EMARecord, EMARecordChangeVersion
+from .serializers import EMARecordSerializer
+from .utils import (
+    EMA_RECORD_CONTENT_FIELDS, get_dict_diff, get_ema_record_content_hash, notify_group_of_ema_record_update_on_commit
+)
+
+
+INGEST_MODES = ("sync", "queue")
+
+_ingest_queues: Dict[Tuple[str, str], DurableQueue] = {}
+
+
+def get_ingest_queue() -> DurableQueue:
+    """Returns the queue EMA records are appended to in "queue" ingest mode"""
+    key = (settings.INGEST_QUEUE_URL, settings.INGEST_QUEUE_NAME)
+    if key not in _ingest_queues:
+        _ingest_queues[key] = get_queue(*key, claim_timeout=settings.INGEST_QUEUE_CLAIM_TIMEOUT)
+    return _ingest_queues[key]
+
+
+def enqueue_ema_record(data: Dict) -> str:
+    """
+    Append validated EMA record data, as validated by `EMARecordSerializer`, to the ingest queue.
+
+    :return: The id of the queue entry
+    """
+    return get_ingest_queue().append([data])[0]
+
+
+def apply_ema_record_batch(
+    items: List[Dict],
+    received_at: Optional[List[datetime.datetime]] = None
+) -> Dict[str, int]:
+    """
+    Create or update the EMA records of a batch of queued EMA record data, using set-based queries.
+
+    Items are validated again, as they may have been queued by an older version. Only the latest item
+    of each currency and timeframe is applied, and records whose content would not change are not
+    updated. Connected clients receive a single "create_many" and "update_many" websocket update
+    per batch, once the batch is committed.
+
+    The `updated_at` of applied records is the time their item was received. Items received before
+    the record was last updated are stale, e.g. items of a failed batch delivered again after newer
+    items were applied, and are skipped so that older data never overwrites newer data.
+
+    :param items: EMA record data, in the order it was queued
+    :param received_at: Time each item was received, e.g. the time it was queued. Defaults to now.
+    :return: The number of items per outcome: "created", "updated", "unchanged", "superseded"
+    (by a later item of the batch), "stale" and "rejected"
+    """
+    counts = {"created": 0, "updated": 0, "unchanged": 0, "superseded": 0, "stale": 0, "rejected": 0}
+    now = timezone.now()
+    latest: Dict[Tuple[str, datetime.timedelta], Tuple[Dict, datetime.datetime]] = {}
+    for item, item_received_at in zip(items, received_at or [now] * len(items)):
+        serializer = EMARecordSerializer(data=item)
+        if not serializer.is_valid():
+            counts["rejected"] += 1
+            continue
+        data = dict(serializer.validated_data)
+        key = (data.pop("currency_symbol").upper(), data["timeframe"])
+        if key in latest:
+            # Only the item received last is applied
+            counts["superseded"] += 1
+            if latest[key][1] > item_received_at:
+                continue
+        latest[key] = (data, item_received_at)
+
+    currencies = {
+        currency.upper_symbol: currency
+        for currency in Currency.objects.annotate(upper_symbol=Upper("symbol")).filter(
+            upper_symbol__in={symbol for symbol, _ in latest}
+        )
+    }
+    created: List[EMARecord] = []
+    updated: List[EMARecord] = []
+    updates: List[Tuple[Dict, str, datetime.datetime]] = []
+    with transaction.atomic():
+        existing = {
+            (record.currency_id, record.timeframe): record
+            for record in EMARecord.objects.select_related("currency").select_for_update().filter(
+                currency__in=currencies.values(), timeframe__in={timeframe for _, timeframe in latest}
+            )
+        }
+        for (symbol, timeframe), (data, item_received_at) in latest.items():
+            currency = currencies.get(symbol)
+            if currency is None:
+                counts["rejected"] += 1
+                continue
+
+            content_hash = get_ema_record_content_hash(data)
+            record = existing.get((currency.pk, timeframe))
+            if record is None:
+                created.append(EMARecord(currency=currency, content_hash=content_hash, updated_at=item_received_at, **data))
+                continue
+            if item_received_at < record.updated_at:
+                counts["stale"] += 1
+                continue
+            if record.content_hash == content_hash:
+                counts["unchanged"] += 1
+                continue
+
+            updated.append(record)
+            updates.append((data, content_hash, item_received_at))
+
+        # Serialized with a single serializer, as building the fields of a serializer per record
+        # would take most of the time of the transaction, during which the records are locked
+        previous_record_dicts = EMARecordSerializer(updated, many=True).data
+        for record, (data, content_hash, item_received_at) in zip(updated, updates):
+            for field, value in data.items():
+                setattr(record, field, value)
+            record.content_hash = content_hash
+            record.updated_at = item_received_at
+        changes: List[Dict] = []
+        for record, previous_record_dict, record_dict in zip(
+            updated, previous_record_dicts, EMARecordSerializer(updated, many=True).data
+        ):
+            change_data = get_dict_diff(previous_record_dict, record_dict)
+            change_data["id"] = str(record.pk)
+            changes.append(change_data)
+
+        versions = EMARecordChangeVersion.allocate(len(created) + len(updated))
+        for record, version in zip([*created, *updated], versions):
+            record.version = version
+        for change_data, record in zip(changes, updated):
+            change_data["version"] = record.version
+
+        received_at_of_created = [record.updated_at for record in created]
+        EMARecord.objects.bulk_create(created)
+        if created:
+            # `updated_at` is set to now by `bulk_create`, as it is an `auto_now` field
+            for record, record_received_at in zip(created, received_at_of_created):
+                record.updated_at = record_received_at
+            EMARecord.objects.bulk_update(created, fields=["updated_at"])
+        EMARecord.objects.bulk_update(
+            updated,
+            fields=[field for field in EMA_RECORD_CONTENT_FIELDS if field != "timeframe"] + ["content_hash", "updated_at", "version"]
+        )
+        if created:
+            notify_group_of_ema_record_update_on_commit(
+                "ema_record_updates", {"code": "create_many", "data": list(EMARecordSerializer(created, many=True).data)}
+            )
+        if changes:
+            notify_group_of_ema_record_update_on_commit("ema_record_updates", {"code": "update_many", "data": changes})
+
+    counts["created"] = len(created)
+    counts["updated"] = len(updated)
+    for outcome, count in counts.items():
+        ingest_entries_total.labels(outcome).inc(count)
+    return counts
@@ -0,0 +1,56 @@
+import time
+from django.core.management.base import BaseCommand, CommandParser
+
+from ema.change_feed import listen_for_changes, publish_changes
+from helpers.logging import log_exception
+
+
+class Command(BaseCommand):
+    help = (
+        "Send websocket events for the changes to EMA records committed to PostgreSQL, "
+        "as notified by the `ema_record_notify_change` trigger. Used with `WEBSOCKET_EVENT_SOURCE=database`. "
+        "Run a single instance, as each instance sends every event."
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "--batch-interval",
+            type=float,
+            default=0.05,
+            help="Seconds to collect further changes for after the first change of a batch"
+        )
+        parser.add_argument("--batch-size", type=int, default=1000, help="Maximum number of changes per batch")
+        parser.add_argument("--database", default="default", help="Alias of the database to listen to")
+        parser.add_argument(
+            "--metrics-port",
+            type=int,
+            default=None,
+            help="Serve the change feed's metrics on this port, unless metrics are shared via `PROMETHEUS_MULTIPROC_DIR`"
+        )
+
+    def handle(self, *args, **options) -> None:
+        if options["metrics_port"]:
+            from prometheus_client import start_http_server
+
+            start_http_server(options["metrics_port"])
+
+        self.stdout.write("Change feed started.")
+        backoff = 1.0
+        try:
+            while True:
+                try:
+                    for changes in listen_for_changes(
+                        options["database"], batch_interval=options["batch_interval"], batch_size=options["batch_size"]
+                    ):
+                        backoff = 1.0
+                        events = publish_changes(changes)
+                        if options["verbosity"] > 1:
+                            self.stdout.write(f"Sent {len(events)} events for {len(changes)} changes")
+                except Exception as exc:
+                    # Changes committed until the connection is re-established are not sent
+                    log_exception(exc)
+                    time.sleep(backoff)
+                    backoff = min(backoff * 2, 30.0)
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write("Change feed stopped.")
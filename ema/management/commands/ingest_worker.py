@@ -0,0 +1,123 @@
+import datetime
+import logging
+import os
+import socket
+import time
+from typing import Dict, List
+from django.conf import settings
+from django.db import close_old_connections
+from django.core.management.base import BaseCommand, CommandParser
+
+from ema.ingest import apply_ema_record_batch, get_ingest_queue
+from helpers.logging import log_exception
+from helpers.metrics import ingest_batch_duration_seconds, ingest_entries_total, ingest_queue_lag_seconds
+from helpers.queues import DurableQueue, QueueEntry
+
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        "Apply the EMA records queued by POST/PUT requests to /ema-records/ in the \"queue\" ingest mode, in batches. "
+        "Entries are acknowledged once their batch is committed, so entries of a batch that fails, "
+        "or of a worker that dies, are applied again (at least once). Entries delivered more than "
+        "`INGEST_QUEUE_MAX_DELIVERIES` times are moved to the dead letters of the queue."
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument("--batch-size", type=int, default=500, help="Maximum number of entries applied per batch")
+        parser.add_argument(
+            "--block",
+            type=float,
+            default=1.0,
+            help="Seconds to wait for new entries when the queue is empty"
+        )
+        parser.add_argument(
+            "--consumer",
+            default=f"{socket.gethostname()}-{os.getpid()}",
+            help="Name of the worker, unique per worker process"
+        )
+        parser.add_argument("--once", action="store_true", help="Exit once the queue is empty")
+        parser.add_argument(
+            "--metrics-port",
+            type=int,
+            default=None,
+            help="Serve the worker's metrics on this port, unless metrics are shared via `PROMETHEUS_MULTIPROC_DIR`"
+        )
+
+    def apply_entries(self, queue: DurableQueue, entries: List[QueueEntry]) -> Dict[str, int]:
+        """
+        Apply entries as one batch, and acknowledge them once the batch is committed.
+
+        :raises: The exception that failed the batch. The entries are not acknowledged,
+        and are delivered again after the claim timeout.
+        """
+        counts = apply_ema_record_batch(
+            [entry.data for entry in entries],
+            received_at=[
+                datetime.datetime.fromtimestamp(entry.enqueued_at, tz=datetime.timezone.utc) for entry in entries
+            ]
+        )
+        queue.ack([entry.id for entry in entries])
+        return counts
+
+
+    def handle(self, *args, **options) -> None:
+        if options["metrics_port"]:
+            from prometheus_client import start_http_server
+
+            start_http_server(options["metrics_port"])
+
+        queue = get_ingest_queue()
+        self.stdout.write(f"Ingest worker '{options['consumer']}' started.")
+        try:
+            while True:
+                entries = queue.read(options["consumer"], options["batch_size"], block=options["block"])
+                ingest_queue_lag_seconds.set(queue.lag())
+                if not entries:
+                    if options["once"]:
+                        break
+                    continue
+
+                dead = [entry for entry in entries if entry.deliveries > settings.INGEST_QUEUE_MAX_DELIVERIES]
+                if dead:
+                    queue.dead_letter(dead)
+                    ingest_entries_total.labels("dead_lettered").inc(len(dead))
+                    logger.warning(
+                        "Moved %s queued EMA records to the dead letters after %s deliveries",
+                        len(dead), settings.INGEST_QUEUE_MAX_DELIVERIES
+                    )
+                # Entries delivered again are applied one by one, so that an entry that
+                # cannot be applied does not fail the entries it was read with
+                fresh = [entry for entry in entries if entry.deliveries == 1]
+                batches = ([fresh] if fresh else []) + [
+                    [entry] for entry in entries if 1 < entry.deliveries <= settings.INGEST_QUEUE_MAX_DELIVERIES
+                ]
+
+                # The worker runs outside of the request cycle, so connections are not closed by Django
+                close_old_connections()
+                start = time.perf_counter()
+                counts: Dict[str, int] = {}
+                failed = False
+                for batch in batches:
+                    try:
+                        batch_counts = self.apply_entries(queue, batch)
+                    except Exception as exc:
+                        # Entries are not acknowledged, and are delivered again after the claim timeout
+                        log_exception(exc)
+                        failed = True
+                        continue
+                    for outcome, count in batch_counts.items():
+                        counts[outcome] = counts.get(outcome, 0) + count
+                if failed:
+                    time.sleep(options["block"])
+                    continue
+                duration = time.perf_counter() - start
+                ingest_batch_duration_seconds.observe(duration)
+                if options["verbosity"] > 1:
+                    summary = ", ".join(f"{count} {outcome}" for outcome, count in counts.items())
+                    self.stdout.write(f"Applied {len(entries)} entries in {duration * 1000:.1f}ms: {summary}")
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(f"Ingest worker '{options['consumer']}' stopped.")
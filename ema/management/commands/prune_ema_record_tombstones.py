@@ -0,0 +1,31 @@
+import datetime
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+from django.utils import timezone
+
+from ema.models import EMARecordTombstone
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete the tombstones of EMA records deleted more than `EMA_RECORD_TOMBSTONE_RETENTION` seconds ago. "
+        "Clients of /ema-records/changes/ that last synced before the pruned tombstones are asked to sync again."
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "--retention",
+            type=int,
+            default=None,
+            help="Seconds tombstones are kept. Defaults to `settings.EMA_RECORD_TOMBSTONE_RETENTION`."
+        )
+
+    def handle(self, *args, **options) -> None:
+        retention = options["retention"]
+        if retention is None:
+            retention = settings.EMA_RECORD_TOMBSTONE_RETENTION
+        if retention < 0:
+            raise CommandError("--retention should not be negative.")
+        before = timezone.now() - datetime.timedelta(seconds=retention)
+        count = EMARecordTombstone.prune(before)
+        self.stdout.write(f"Pruned {count} tombstones of EMA records deleted before {before.isoformat()}.")
@@ -0,0 +1,296 @@
+import datetime
+import json
+import math
+import random
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Tuple
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+from django.utils import timezone
+from django.utils.dateparse import parse_duration
+from django.utils.duration import duration_string
+
+from currency.models import Currency
+from ema.models import Candle, EMARecord
+from ema.serializers import CandleSerializer
+from ema.candles import ingest_candles
+
+
+MODES = ("http", "bulk", "inprocess")
+
+
+class RandomWalkFeed:
+    """
+    Generates candles for a set of series (currency and timeframe) as geometric random walks.
+
+    Each series resumes from its latest stored candle or EMA record, if any, so that
+    generated candles continue the existing series.
+    """
+    def __init__(
+        self,
+        currencies: List[Currency],
+        timeframes: List[datetime.timedelta],
+        volatility: float,
+        rng: random.Random
+    ) -> None:
+        self.volatility = volatility
+        self.rng = rng
+        # (currency, timeframe) -> (next open time, last close)
+        self.series: Dict[Tuple[Currency, datetime.timedelta], Tuple[datetime.datetime, float]] = {}
+        now = timezone.now().replace(second=0, microsecond=0)
+        for currency in currencies:
+            for timeframe in timeframes:
+                latest = Candle.objects.filter(currency=currency, timeframe=timeframe).order_by("-open_time").first()
+                if latest is not None:
+                    self.series[(currency, timeframe)] = (latest.open_time + timeframe, latest.close)
+                    continue
+                record = EMARecord.objects.filter(currency=currency, timeframe=timeframe).first()
+                close = record.close if record is not None else rng.uniform(10, 1000)
+                self.series[(currency, timeframe)] = (now, close)
+
+
+    def next_candle(self, currency: Currency, timeframe: datetime.timedelta) -> Dict:
+        """Generate the next candle of a series"""
+        open_time, open_ = self.series[(currency, timeframe)]
+        # Scale volatility with the square root of the timeframe, relative to an hour
+        sigma = self.volatility * math.sqrt(timeframe / datetime.timedelta(hours=1))
+        close = open_ * math.exp(self.rng.gauss(0, sigma))
+        high = max(open_, close) * (1 + abs(self.rng.gauss(0, sigma / 2)))
+        low = min(open_, close) * (1 - abs(self.rng.gauss(0, sigma / 2)))
+        self.series[(currency, timeframe)] = (open_time + timeframe, close)
+        return {
+            "currency_symbol": currency.symbol,
+            "timeframe": duration_string(timeframe),
+            "open_time": open_time.isoformat(),
+            "open": open_,
+            "high": high,
+            "low": low,
+            "close": close,
+        }
+
+
+    def __iter__(self) -> Iterator[Dict]:
+        """Cycle through the series endlessly, generating one candle of each series in turn"""
+        while True:
+            for currency, timeframe in list(self.series):
+                yield self.next_candle(currency, timeframe)
+
+
+
+class Command(BaseCommand):
+    help = (
+        "Push synthetic random walk candles through the candle ingest path at a target rate. "
+        "Reports the achieved throughput and error rate."
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "--mode",
+            choices=MODES,
+            default="inprocess",
+            help=(
+                "http: POST one candle per request, bulk: POST batches of candles, "
+                "inprocess: validate and ingest batches of candles without HTTP"
+            )
+        )
+        parser.add_argument("--symbols", nargs="*", default=None, help="Symbols of the currencies to simulate")
+        parser.add_argument("--currencies", type=int, default=10, help="Number of currencies to simulate, if no symbols are given")
+        parser.add_argument("--timeframes", nargs="+", default=["01:00:00"], help="Timeframes to simulate, e.g. 00:15:00 01:00:00")
+        parser.add_argument("--rate", type=float, default=10.0, help="Target rate in candles per second")
+        parser.add_argument("--duration", type=float, default=None, help="Seconds to run for")
+        parser.add_argument("--count", type=int, default=None, help="Number of candles to push. Defaults to 100 if no duration is given")
+        parser.add_argument("--batch-size", type=int, default=50, help="Candles per request or ingest call, in bulk and inprocess modes")
+        parser.add_argument("--jitter", type=float, default=0.0, help="Randomly vary the interval between pushes by up to this fraction, between 0 and 1")
+        parser.add_argument("--burst-size", type=int, default=None, help="Push candles in bursts of this many pushes, keeping the same average rate")
+        parser.add_argument("--volatility", type=float, default=0.01, help="Standard deviation of hourly log returns")
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=4,
+            help=(
+                "Number of concurrent requests, in http and bulk modes. At most twice as many pushes are pending, "
+                "so if the server cannot keep up, the achieved rate drops instead of requests piling up"
+            )
+        )
+        parser.add_argument("--url", default="http://127.0.0.1:8000", help="Base URL of the server, in http and bulk modes")
+        parser.add_argument("--api-key", default=None, help="API key, in http and bulk modes")
+        parser.add_argument("--seed", type=int, default=None, help="Seed of the random generator")
+
+    def handle(self, *args, **options) -> None:
+        mode = options["mode"]
+        if mode != "inprocess" and not options["api_key"]:
+            raise CommandError("An API key is required in http and bulk modes.")
+        if not 0 <= options["jitter"] < 1:
+            raise CommandError("Jitter should be between 0 and 1.")
+        if options["rate"] <= 0:
+            raise CommandError("Rate should be greater than 0.")
+        if options["workers"] < 1:
+            raise CommandError("Workers should be at least 1.")
+
+        timeframes = []
+        for value in options["timeframes"]:
+            timeframe = parse_duration(value)
+            if not timeframe:
+                raise CommandError(f"Invalid timeframe '{value}'.")
+            timeframes.append(timeframe)
+
+        if options["symbols"]:
+            currencies = list(Currency.objects.filter(symbol__in=options["symbols"]))
+            missing = set(options["symbols"]) - {currency.symbol for currency in currencies}
+            if missing:
+                raise CommandError(f"Unknown currency symbol(s): {', '.join(sorted(missing))}.")
+        else:
+            currencies = list(Currency.objects.all()[:options["currencies"]])
+        if not currencies:
+            raise CommandError("No currencies to simulate. Create or import currencies first.")
+
+        self.options = options
+        self.lock = threading.Lock()
+        self.candles_ok = 0
+        self.candles_failed = 0
+        self.errors: Dict[str, int] = {}
+        self.push_durations: List[float] = []
+
+        feed = iter(RandomWalkFeed(currencies, timeframes, options["volatility"], random.Random(options["seed"])))
+        batch_size = 1 if mode == "http" else options["batch_size"]
+        count = options["count"] or (None if options["duration"] else 100)
+        self.stdout.write(
+            f"Simulating {len(currencies)} currencies x {len(timeframes)} timeframes "
+            f"at {options['rate']} candles/s in {mode} mode..."
+        )
+        started_at = time.perf_counter()
+        self.run(feed, batch_size, count, started_at)
+        elapsed = time.perf_counter() - started_at
+        self.report(elapsed)
+
+
+    def get_push_interval(self, batch_size: int) -> float:
+        """Seconds between pushes of `batch_size` candles, at the target rate"""
+        return batch_size / self.options["rate"]
+
+
+    def run(self, feed: Iterator[Dict], batch_size: int, count: int | None, started_at: float) -> None:
+        options = self.options
+        executor = ThreadPoolExecutor(max_workers=options["workers"]) if options["mode"] != "inprocess" else None
+        # Bounds the pushes submitted to the executor but not yet done, so that pushes do not
+        # queue up without limit, and use ever more memory, when the server is slower than the target rate
+        pending_pushes = threading.BoundedSemaphore(options["workers"] * 2)
+        rng = random.Random(options["seed"])
+        interval = self.get_push_interval(batch_size)
+        burst_size = options["burst_size"] or 1
+        next_push_at = started_at
+        pushed = 0
+        pushes = 0
+        last_report = started_at
+        try:
+            while True:
+                now = time.perf_counter()
+                if options["duration"] and now - started_at >= options["duration"]:
+                    break
+                if count is not None and pushed >= count:
+                    # Wait for the end of the last interval, so that the achieved rate is comparable to the target
+                    time.sleep(max(next_push_at - now, 0))
+                    break
+                if next_push_at > now:
+                    time.sleep(next_push_at - now)
+
+                size = batch_size if count is None else min(batch_size, count - pushed)
+                candles = [next(feed) for _ in range(size)]
+                if executor is not None:
+                    pending_pushes.acquire()
+                    try:
+                        future = executor.submit(self.push_over_http, candles)
+                    except BaseException:
+                        pending_pushes.release()
+                        raise
+                    future.add_done_callback(lambda future: pending_pushes.release())
+                else:
+                    self.push_in_process(candles)
+                pushed += size
+                pushes += 1
+
+                # Bursts push `burst_size` batches back to back, then wait for the time they would have taken
+                if pushes % burst_size == 0:
+                    jitter = rng.uniform(-options["jitter"], options["jitter"])
+                    next_push_at += interval * burst_size * (1 + jitter)
+
+                if time.perf_counter() - last_report >= 5:
+                    last_report = time.perf_counter()
+                    self.stdout.write(f"  {pushed} candles pushed, {self.candles_failed} failed")
+        except KeyboardInterrupt:
+            self.stdout.write("Interrupted, waiting for pending pushes...")
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True)
+        return None
+
+
+    def record_push(self, candles: List[Dict], duration: float, error: str | None) -> None:
+        with self.lock:
+            self.push_durations.append(duration)
+            if error is None:
+                self.candles_ok += len(candles)
+            else:
+                self.candles_failed += len(candles)
+                self.errors[error] = self.errors.get(error, 0) + 1
+        return None
+
+
+    def push_over_http(self, candles: List[Dict]) -> None:
+        request = urllib.request.Request(
+            f"{self.options['url'].rstrip('/')}/api/v1/ema-records/candles/",
+            data=json.dumps(candles).encode(),
+            headers={"Content-Type": "application/json", "X-API-KEY": self.options["api_key"]},
+            method="POST",
+        )
+        start = time.perf_counter()
+        error = None
+        try:
+            with urllib.request.urlopen(request, timeout=30) as response:
+                response.read()
+        except urllib.error.HTTPError as exc:
+            error = f"HTTP {exc.code}"
+        except Exception as exc:
+            error = type(exc).__name__
+        self.record_push(candles, time.perf_counter() - start, error)
+        return None
+
+
+    def push_in_process(self, candles: List[Dict]) -> None:
+        start = time.perf_counter()
+        error = None
+        try:
+            serializer = CandleSerializer(data=candles, many=True)
+            if serializer.is_valid():
+                ingest_candles(serializer.validated_data)
+            else:
+                error = "Validation error"
+        except Exception as exc:
+            error = type(exc).__name__
+        self.record_push(candles, time.perf_counter() - start, error)
+        return None
+
+
+    def report(self, elapsed: float) -> None:
+        total = self.candles_ok + self.candles_failed
+        durations = sorted(self.push_durations)
+        self.stdout.write(self.style.SUCCESS(
+            f"{total} candles pushed in {elapsed:.1f}s: {total / elapsed:.1f} candles/s "
+            f"(target {self.options['rate']} candles/s), {self.candles_ok / elapsed:.1f} candles/s ingested."
+        ))
+        if durations:
+            self.stdout.write(
+                f"Push latency: mean {statistics.fmean(durations) * 1000:.1f}ms, "
+                f"p50 {durations[len(durations) // 2] * 1000:.1f}ms, "
+                f"p95 {durations[min(len(durations) - 1, int(len(durations) * 0.95))] * 1000:.1f}ms"
+            )
+        error_rate = self.candles_failed / total if total else 0.0
+        message = f"{self.candles_failed} candles failed ({error_rate:.1%} error rate)."
+        self.stdout.write(self.style.ERROR(message) if self.candles_failed else message)
+        for error, occurrences in sorted(self.errors.items(), key=lambda item: -item[1]):
+            self.stdout.write(f"  {error}: {occurrences} push(es)")
+        return None
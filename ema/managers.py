@@ -0,0 +1,56 @@
+from typing import List
+from django.db import connections, models, transaction
+
+from .utils import notify_group_of_ema_record_update_on_commit
+
+
+# Maximum number of records deleted per query by `EMARecordQuerySet.bulk_delete`,
+# to keep the number of query parameters within the limits of the database
+BULK_DELETE_BATCH_SIZE = 500
+
+
+class EMARecordQuerySet(models.QuerySet):
+    """Custom queryset for the `EMARecord` model."""
+
+    def bulk_delete(self) -> List[str]:
+        """
+        Delete the records in the queryset using set-based queries, of `BULK_DELETE_BATCH_SIZE` records each.
+
+        Unlike `delete`, records are not collected and no `pre_delete`/`post_delete` signals
+        are sent per record. Instead, a single "delete_many" websocket notification listing 
+        the ids of all deleted records is sent after the transaction is committed.
+        Tombstones of the deleted records are created, see `EMARecordTombstone`.
+
+        :return: The ids of the deleted records.
+        """
+        with transaction.atomic(using=self.db):
+            ids = [str(pk) for pk in self.select_for_update().values_list("pk", flat=True)]
+            if not ids:
+                return ids
+            connection = connections[self.db]
+            table = connection.ops.quote_name(self.model._meta.db_table)
+            pk_field = self.model._meta.pk
+            pk_column = connection.ops.quote_name(pk_field.column)
+            with connection.cursor() as cursor:
+                for start in range(0, len(ids), BULK_DELETE_BATCH_SIZE):
+                    batch = [pk_field.get_db_prep_value(pk, connection) for pk in ids[start:start + BULK_DELETE_BATCH_SIZE]]
+                    cursor.execute(f"DELETE FROM {table} WHERE {pk_column} IN ({', '.join(['%s'] * len(batch))})", batch)
+            # Imported here, as the models module imports this module
+            from .models import EMARecordTombstone
+
+            EMARecordTombstone.create_for(ids, using=self.db)
+
+            data = {
+                "code": "delete_many",
+                "data": {
+                    "ids": ids
+                }
+            }
+            notify_group_of_ema_record_update_on_commit("ema_record_updates", data, using=self.db)
+        return ids
+
+
+
+class EMARecordManager(models.Manager.from_queryset(EMARecordQuerySet)):
+    '''Custom manager for the `EMARecord` model.'''
+    pass
@@ -0,0 +1,44 @@
+# Generated by Django 5.0.3 on 2026-10-19 14:18
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('currency', '0004_alter_currency_category_alter_currency_symbol'),
+        ('ema', '0006_alter_emarecord_currency'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Candle',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('timeframe', models.DurationField()),
+                ('open_time', models.DateTimeField()),
+                ('open', models.FloatField()),
+                ('high', models.FloatField()),
+                ('low', models.FloatField()),
+                ('close', models.FloatField()),
+                ('ema20', models.FloatField(blank=True, null=True)),
+                ('ema50', models.FloatField(blank=True, null=True)),
+                ('ema100', models.FloatField(blank=True, null=True)),
+                ('ema200', models.FloatField(blank=True, null=True)),
+                ('added_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('currency', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='candles', to='currency.currency')),
+            ],
+            options={
+                'verbose_name': 'Candle',
+                'verbose_name_plural': 'Candles',
+                'ordering': ['open_time'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='candle',
+            constraint=models.UniqueConstraint(fields=('currency', 'timeframe', 'open_time'), name='unique_candle_per_currency_timeframe_and_open_time'),
+        ),
+    ]
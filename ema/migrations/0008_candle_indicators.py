@@ -0,0 +1,28 @@
+# Generated by Django 5.0.3 on 2026-10-19 14:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ema', '0007_candle'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='candle',
+            name='indicator_state',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='candle',
+            name='indicator_values',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='emarecord',
+            name='indicators',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
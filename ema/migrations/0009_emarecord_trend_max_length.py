@@ -0,0 +1,18 @@
+# Generated by Django 5.0.3 on 2026-10-19 14:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ema', '0008_candle_indicators'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='emarecord',
+            name='trend',
+            field=models.CharField(choices=[('1', 'Upwards'), ('-1', 'Downwards'), ('0', 'Sideways')], max_length=2),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.3 on 2026-10-19 14:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ema', '0009_emarecord_trend_max_length'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emarecord',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', editable=False, max_length=64),
+        ),
+    ]
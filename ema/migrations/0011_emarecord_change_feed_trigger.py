@@ -0,0 +1,72 @@
+from django.db import migrations
+
+
+CREATE_TRIGGER_SQL = """
+CREATE OR REPLACE FUNCTION ema_record_notify_change() RETURNS trigger AS $$
+DECLARE
+    changed text[];
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM pg_notify('ema_record_changes', json_build_object(
+            'op', 'delete', 'id', OLD.id, 'ts', extract(epoch FROM clock_timestamp())
+        )::text);
+        RETURN OLD;
+    END IF;
+
+    IF TG_OP = 'UPDATE' THEN
+        SELECT array_agg(new_values.key) INTO changed
+        FROM jsonb_each(to_jsonb(NEW)) AS new_values
+        JOIN jsonb_each(to_jsonb(OLD)) AS old_values ON old_values.key = new_values.key
+        WHERE new_values.value IS DISTINCT FROM old_values.value;
+        IF changed IS NULL THEN
+            RETURN NEW;
+        END IF;
+        PERFORM pg_notify('ema_record_changes', json_build_object(
+            'op', 'update', 'id', NEW.id, 'changed', changed, 'ts', extract(epoch FROM clock_timestamp())
+        )::text);
+        RETURN NEW;
+    END IF;
+
+    PERFORM pg_notify('ema_record_changes', json_build_object(
+        'op', 'create', 'id', NEW.id, 'ts', extract(epoch FROM clock_timestamp())
+    )::text);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS ema_record_notify_change ON {table};
+CREATE TRIGGER ema_record_notify_change
+AFTER INSERT OR UPDATE OR DELETE ON {table}
+FOR EACH ROW EXECUTE PROCEDURE ema_record_notify_change();
+"""
+
+DROP_TRIGGER_SQL = """
+DROP TRIGGER IF EXISTS ema_record_notify_change ON {table};
+DROP FUNCTION IF EXISTS ema_record_notify_change();
+"""
+
+
+def create_trigger(apps, schema_editor) -> None:
+    # Notifications are PostgreSQL specific
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    table = schema_editor.quote_name(apps.get_model("ema", "EMARecord")._meta.db_table)
+    schema_editor.execute(CREATE_TRIGGER_SQL.format(table=table))
+
+
+def drop_trigger(apps, schema_editor) -> None:
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    table = schema_editor.quote_name(apps.get_model("ema", "EMARecord")._meta.db_table)
+    schema_editor.execute(DROP_TRIGGER_SQL.format(table=table))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ema', '0010_emarecord_content_hash'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigger, drop_trigger),
+    ]
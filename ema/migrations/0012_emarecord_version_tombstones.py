@@ -0,0 +1,69 @@
+# Generated by Django 5.0.3 on 2026-10-19 15:13
+
+from django.db import migrations, models
+
+
+SET_INITIAL_VERSIONS_SQL = """
+UPDATE {table} SET version = {version}
+FROM (SELECT id, row_number() OVER (ORDER BY {timestamp}, id) AS row_number FROM {table}) AS ordered
+WHERE {table}.id = ordered.id
+"""
+
+
+def set_initial_versions(apps, schema_editor) -> None:
+    # Give existing records distinct versions, so that clients can page through them by version
+    EMARecord = apps.get_model("ema", "EMARecord")
+    EMARecordChangeVersion = apps.get_model("ema", "EMARecordChangeVersion")
+    db = schema_editor.connection.alias
+    table = schema_editor.quote_name(EMARecord._meta.db_table)
+    version = "ordered.row_number"
+    if schema_editor.connection.vendor == "postgresql":
+        # Versions are transaction ids on PostgreSQL, so existing records must be below the next transactions
+        version = "LEAST(ordered.row_number, pg_current_xact_id()::text::bigint - 1)"
+        # The versions are set by a single statement, without the `ema_record_notify_change` trigger,
+        # so that the change feed does not send an "update" event for every record
+        schema_editor.execute(f"ALTER TABLE {table} DISABLE TRIGGER ema_record_notify_change")
+    schema_editor.execute(SET_INITIAL_VERSIONS_SQL.format(
+        table=table, version=version, timestamp=schema_editor.quote_name("timestamp")
+    ))
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(f"ALTER TABLE {table} ENABLE TRIGGER ema_record_notify_change")
+    EMARecordChangeVersion.objects.using(db).create(pk=1, value=EMARecord.objects.using(db).count())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ema', '0011_emarecord_change_feed_trigger'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EMARecordChangeVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'EMA Record Change Version',
+            },
+        ),
+        migrations.CreateModel(
+            name='EMARecordTombstone',
+            fields=[
+                ('id', models.UUIDField(editable=False, primary_key=True, serialize=False)),
+                ('version', models.BigIntegerField(db_index=True)),
+                ('deleted_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'EMA Record Tombstone',
+                'verbose_name_plural': 'EMA Record Tombstones',
+            },
+        ),
+        migrations.AddField(
+            model_name='emarecord',
+            name='version',
+            field=models.BigIntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.RunPython(set_initial_versions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.3 on 2026-10-19 15:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ema', '0012_emarecord_version_tombstones'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emarecordchangeversion',
+            name='pruned_version',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
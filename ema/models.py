@@ -1,7 +1,12 @@
-from django.db import models
+import datetime
+from typing import Any, List, Optional
+from django.db import connections, models, router, transaction
+from django.db.models.functions import Greatest
 import uuid
 from django.utils.translation import gettext_lazy as _
 
+from .managers import EMARecordManager
+
 
 class TrendChoices(models.TextChoices):
     """Choices for trend direction"""
@@ -21,7 +26,7 @@ class EMARecord(models.Model):
     ema50 = models.FloatField(null=True, blank=True)
     ema100 = models.FloatField(null=True, blank=True)
     ema200 = models.FloatField(null=True, blank=True)
-    trend = models.CharField(choices=TrendChoices.choices)
+    trend = models.CharField(max_length=2, choices=TrendChoices.choices)
     monhigh = models.FloatField()
     monlow = models.FloatField()
     monmid = models.FloatField()
@@ -29,9 +34,16 @@ class EMARecord(models.Model):
     fifty_greater_than_hundred = models.BooleanField()
     hundred_greater_than_twohundred = models.BooleanField()
     close_greater_than_hundred = models.BooleanField()
+    indicators = models.JSONField(default=dict, blank=True)
+    # Hash of the fields clients can write, to detect writes that would not change the record
+    content_hash = models.CharField(max_length=64, blank=True, default="", editable=False)
+    # Change version of the record, see `EMARecordChangeVersion`
+    version = models.BigIntegerField(default=0, db_index=True, editable=False)
     timestamp = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = EMARecordManager()
+
     class Meta:
         ordering = ["-timestamp"]
         verbose_name = _("EMA Record")
@@ -40,3 +52,178 @@ class EMARecord(models.Model):
 
     def __str__(self) -> str:
         return f"{self.currency.symbol} at {self.timestamp.strftime('%H:%M:%S %d-%m-%Y (%Z)')}"
+
+
+    def save(self, *args: Any, **kwargs: Any) -> None:
+        using = kwargs.get("using") or router.db_for_write(type(self), instance=self)
+        # The version is allocated in the transaction of the save, see `EMARecordChangeVersion`
+        with transaction.atomic(using=using, savepoint=False):
+            (self.version,) = EMARecordChangeVersion.allocate(using=using)
+            if kwargs.get("update_fields") is not None:
+                kwargs["update_fields"] = {*kwargs["update_fields"], "version"}
+            super().save(*args, **kwargs)
+
+
+
+class EMARecordChangeVersion(models.Model):
+    """
+    Change versions of EMA records.
+
+    Each created, updated or deleted EMA record is given a version, so that clients can fetch
+    the changes since the last version they have seen. A change must never become visible with
+    a version lower than a version a client has already read.
+
+    On PostgreSQL, the version of a change is the id of its transaction, so writers do not wait
+    for each other. All changes of a transaction share its version, and transactions may commit
+    out of order, so changes are only served below the visibility horizon, see `get_horizon`.
+    On other databases, e.g. SQLite, versions are taken from a counter in a single row,
+    as writers are serialized by the database anyway.
+    """
+    # Last version taken from the counter, on databases other than PostgreSQL
+    value = models.BigIntegerField(default=0)
+    # Highest version of the pruned tombstones, see `EMARecordTombstone.prune`
+    pruned_version = models.BigIntegerField(default=0)
+
+    class Meta:
+        verbose_name = _("EMA Record Change Version")
+
+
+    @classmethod
+    def allocate(cls, count: int = 1, using: str = "default") -> List[int]:
+        """
+        Returns the versions of `count` changes.
+
+        Should be called in the transaction that makes the changes.
+        """
+        if count <= 0:
+            return []
+        connection = connections[using]
+        with connection.cursor() as cursor:
+            if connection.vendor == "postgresql":
+                cursor.execute("SELECT pg_current_xact_id()::text::bigint")
+                (value,) = cursor.fetchone()
+                return [value] * count
+
+            table = connection.ops.quote_name(cls._meta.db_table)
+            # A single upsert, supported by SQLite 3.35+, as it runs for every write of an EMA record
+            cursor.execute(
+                f"INSERT INTO {table} (id, value, pruned_version) VALUES (1, %s, 0) "
+                f"ON CONFLICT (id) DO UPDATE SET value = {table}.value + EXCLUDED.value RETURNING value",
+                [count]
+            )
+            (value,) = cursor.fetchone()
+        return list(range(value - count + 1, value + 1))
+
+
+    @classmethod
+    def get_horizon(cls, using: str = "default") -> Optional[int]:
+        """
+        Returns the version below which all changes are committed (or rolled back), or None if all are.
+
+        On PostgreSQL, this is the id of the oldest transaction still running: transactions with
+        a lower id have ended, and transactions that start later get a higher id. Should be called
+        before the changes are read, as changes committed after the call may be below it.
+        """
+        connection = connections[using]
+        if connection.vendor != "postgresql":
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint")
+            (horizon,) = cursor.fetchone()
+        return horizon
+
+
+
+class EMARecordTombstone(models.Model):
+    """
+    Record of a deleted EMA record, so that clients syncing changes learn of the deletion.
+
+    Tombstones are kept for `settings.EMA_RECORD_TOMBSTONE_RETENTION` seconds, see `prune`.
+    """
+    # Id of the deleted record
+    id = models.UUIDField(primary_key=True, editable=False)
+    version = models.BigIntegerField(db_index=True)
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = _("EMA Record Tombstone")
+        verbose_name_plural = _("EMA Record Tombstones")
+
+
+    @classmethod
+    def create_for(cls, ids: List[Any], using: str = "default") -> None:
+        """Create tombstones for deleted EMA records. Should be called in the transaction of the deletion"""
+        versions = EMARecordChangeVersion.allocate(len(ids), using=using)
+        cls.objects.using(using).bulk_create([cls(id=record_id, version=version) for record_id, version in zip(ids, versions)])
+        return None
+
+
+    @classmethod
+    def prune(cls, before: datetime.datetime, using: str = "default") -> int:
+        """
+        Delete the tombstones of EMA records deleted before a time.
+
+        The highest version of the pruned tombstones is kept as `EMARecordChangeVersion.pruned_version`,
+        so that clients that last synced before it can be told that they missed deletions.
+
+        :return: The number of deleted tombstones
+        """
+        with transaction.atomic(using=using):
+            pruned_version = cls.objects.using(using).filter(deleted_at__lt=before).aggregate(
+                version=models.Max("version")
+            )["version"]
+            if pruned_version is None:
+                return 0
+            EMARecordChangeVersion.objects.using(using).filter(pk=1).update(
+                pruned_version=Greatest("pruned_version", models.Value(pruned_version))
+            )
+            count, _ = cls.objects.using(using).filter(version__lte=pruned_version).delete()
+        return count
+
+
+    @classmethod
+    def get_pruned_version(cls) -> int:
+        """Returns the highest version of the pruned tombstones, or 0 if none was pruned"""
+        return EMARecordChangeVersion.objects.filter(pk=1).values_list("pruned_version", flat=True).first() or 0
+
+
+
+class Candle(models.Model):
+    """
+    Model for storing OHLC candles per currency and timeframe.
+
+    The EMA values and indicator states stored on each candle are checkpoints of the series as at
+    that candle, so that a late or corrected candle only requires recomputing the series from the
+    checkpoint just before it.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    currency = models.ForeignKey("currency.Currency", on_delete=models.CASCADE, related_name="candles")
+    timeframe = models.DurationField()
+    open_time = models.DateTimeField()
+    open = models.FloatField()
+    high = models.FloatField()
+    low = models.FloatField()
+    close = models.FloatField()
+    ema20 = models.FloatField(null=True, blank=True)
+    ema50 = models.FloatField(null=True, blank=True)
+    ema100 = models.FloatField(null=True, blank=True)
+    ema200 = models.FloatField(null=True, blank=True)
+    indicator_values = models.JSONField(default=dict, blank=True)
+    indicator_state = models.JSONField(default=dict, blank=True)
+    added_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["open_time"]
+        verbose_name = _("Candle")
+        verbose_name_plural = _("Candles")
+        constraints = [
+            models.UniqueConstraint(
+                fields=["currency", "timeframe", "open_time"], 
+                name="unique_candle_per_currency_timeframe_and_open_time"
+            ),
+        ]
+
+
+    def __str__(self) -> str:
+        return f"{self.currency_id} candle at {self.open_time.strftime('%H:%M:%S %d-%m-%Y (%Z)')}"
@@ -1,18 +1,21 @@
 from rest_framework import serializers, exceptions
-from typing import Any, Dict
+from typing import Any, Dict, List
+from django.db.models.functions import Upper
 
 
-from .models import EMARecord
+from .models import EMARecord, Candle
 from currency.serializers import StrippedCurrencySerializer
 from currency.models import Currency
 from .utils import (
     convert_watch_values_external_names_to_internal_names,
-    convert_watch_values_internal_names_to_external_names
+    convert_watch_values_internal_names_to_external_names,
+    get_ema_record_content_hash
 )
+from helpers.metrics import InstrumentedSerializerMixin, ema_record_unchanged_writes_total
 
 
 
-class EMARecordSerializer(serializers.ModelSerializer):
+class EMARecordSerializer(InstrumentedSerializerMixin, serializers.ModelSerializer):
     """Model serializer for EMA records"""
     currency = StrippedCurrencySerializer(read_only=True)
     currency_symbol = serializers.CharField(write_only=True)
@@ -37,10 +40,12 @@ class EMARecordSerializer(serializers.ModelSerializer):
             "fifty_greater_than_hundred",
             "hundred_greater_than_twohundred",
             "close_greater_than_hundred",
+            "indicators",
             "timestamp",
             "updated_at",
+            "version",
         ]
-        read_only_fields = ["timestamp", "updated_at"]
+        read_only_fields = ["indicators", "timestamp", "updated_at", "version"]
         extra_kwargs = {
             "trend": {"required": True},
             "timestamp": {"format": "%H:%M:%S %d-%m-%Y %z"},
@@ -71,6 +76,18 @@ class EMARecordSerializer(serializers.ModelSerializer):
                 "currency_symbol": ["This field is required."]
             })
         
+        existing_instance = self.Meta.model.objects.select_related("currency").filter(
+            currency__symbol__iexact=currency_symbol, timeframe=timeframe
+        ).first()
+        if existing_instance:
+            validated_data["currency"] = existing_instance.currency
+            if existing_instance.content_hash == get_ema_record_content_hash(validated_data):
+                # Nothing changed, so do not save the record or notify clients
+                ema_record_unchanged_writes_total.inc()
+                return existing_instance
+            # Update the existing instance, instead of creating a new one
+            return self.update(existing_instance, validated_data)
+
         try:
             currency = Currency.objects.get(symbol__iexact=currency_symbol)
         except Currency.DoesNotExist:
@@ -79,10 +96,51 @@ class EMARecordSerializer(serializers.ModelSerializer):
             })
         else:
             validated_data["currency"] = currency
-
-        existing_instance = self.Meta.model.objects.filter(currency=currency, timeframe=timeframe).first()
-        if existing_instance:
-            # Update the existing instance, instead of creating a new one
-            return self.update(existing_instance, validated_data)
         return super().create(validated_data)
 
+
+
+class CandleListSerializer(serializers.ListSerializer):
+    """List serializer for candles that resolves all currency symbols in a single query"""
+
+    def validate(self, attrs: List[Dict]) -> List[Dict]:
+        symbols = {item["currency_symbol"].upper() for item in attrs}
+        currencies = {
+            currency.symbol.upper(): currency
+            for currency in Currency.objects.annotate(upper_symbol=Upper("symbol")).filter(upper_symbol__in=symbols)
+        }
+        unrecognized = sorted(symbols - currencies.keys())
+        if unrecognized:
+            raise exceptions.ValidationError({
+                "currency_symbol": [f"Currency symbol(s) provided, {', '.join(unrecognized)}, not recognized."]
+            })
+        
+        for item in attrs:
+            item["currency"] = currencies[item.pop("currency_symbol").upper()]
+        return attrs
+
+
+
+class CandleSerializer(InstrumentedSerializerMixin, serializers.ModelSerializer):
+    """Model serializer for candles"""
+    currency_symbol = serializers.CharField(write_only=True)
+
+    class Meta:
+        model = Candle
+        list_serializer_class = CandleListSerializer
+        fields = [
+            "currency_symbol",
+            "timeframe",
+            "open_time",
+            "open",
+            "high",
+            "low",
+            "close",
+        ]
+
+    def validate(self, attrs: Dict) -> Dict:
+        if attrs["high"] < attrs["low"]:
+            raise exceptions.ValidationError({
+                "high": ["Candle high cannot be less than candle low."]
+            })
+        return attrs
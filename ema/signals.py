@@ -1,32 +1,50 @@
+from django.conf import settings
 from django.dispatch import receiver
-from django.db.models.signals import pre_save, post_delete
+from django.db.models.signals import pre_save, post_save, post_delete
 
-from .models import EMARecord
+from .models import EMARecord, EMARecordTombstone
 from .serializers import EMARecordSerializer
-from .utils import get_dict_diff, notify_group_of_ema_record_update_via_websocket
+from .utils import (
+    EMA_RECORD_CONTENT_FIELDS, get_dict_diff, get_ema_record_content_hash, notify_group_of_ema_record_update_on_commit
+)
 
 
 
 @receiver(pre_save, sender=EMARecord)
-def send_updates_via_websocket(sender: type[EMARecord], instance: EMARecord, **kwargs) -> None:
+def update_content_hash(sender: type[EMARecord], instance: EMARecord, **kwargs) -> None:
+    """Keeps the content hash of EMA records up to date, however they are saved"""
+    instance.content_hash = get_ema_record_content_hash({
+        field: getattr(instance, field) for field in EMA_RECORD_CONTENT_FIELDS
+    })
+    return
+
+
+
+@receiver(pre_save, sender=EMARecord)
+def prepare_websocket_update(sender: type[EMARecord], instance: EMARecord, **kwargs) -> None:
     """
-    Updates the frontend via websocket on changes to EMA records
+    Prepares the websocket update for changes to EMA records, 
+    which is sent by `send_updates_via_websocket` after the record is saved.
 
     - A "create" code is sent when a new record is created alongside the new record data.
 
     - An "update" code is sent when an existing record is updated alongside the changes made to the record.
+
+    Not prepared if websocket updates are sent by the change feed, see `ema.change_feed`.
     """
+    instance._websocket_update = None
+    if settings.WEBSOCKET_EVENT_SOURCE == "database":
+        return
     try:
         try:
             previous_record = EMARecord.objects.get(pk=instance.pk)
         except EMARecord.DoesNotExist:
             # It is a new record
             data = EMARecordSerializer(instance).data
-            data = {
+            instance._websocket_update = {
                 "code": "create",
                 "data": data
             }
-            notify_group_of_ema_record_update_via_websocket("ema_record_updates", data)
             return
         
         previous_record_dict = EMARecordSerializer(previous_record).data
@@ -36,11 +54,28 @@ def send_updates_via_websocket(sender: type[EMARecord], instance: EMARecord, **k
         if change_data:
             # Add the id of the record to the change_data
             change_data["id"] = str(instance.pk)
-            data = {
+            instance._websocket_update = {
                 "code": "update",
                 "data": change_data
             }
-            notify_group_of_ema_record_update_via_websocket("ema_record_updates", data)
+    except Exception:
+        # Ignore any errors that occur while preparing the notification
+        pass
+    return
+
+
+
+@receiver(post_save, sender=EMARecord)
+def send_updates_via_websocket(sender: type[EMARecord], instance: EMARecord, using: str, **kwargs) -> None:
+    """
+    Updates the frontend via websocket on changes to EMA records, once the changes are committed.
+    """
+    data = getattr(instance, "_websocket_update", None)
+    if data is None:
+        return
+    instance._websocket_update = None
+    try:
+        notify_group_of_ema_record_update_on_commit("ema_record_updates", data, using=using)
     except Exception:
         # Ignore any errors that occur while sending the notification
         pass
@@ -49,7 +84,7 @@ def send_updates_via_websocket(sender: type[EMARecord], instance: EMARecord, **k
 
 
 @receiver(post_delete, sender=EMARecord)
-def send_deletes_via_websocket(sender: type[EMARecord], instance: EMARecord, **kwargs) -> None:
+def send_deletes_via_websocket(sender: type[EMARecord], instance: EMARecord, using: str, **kwargs) -> None:
     """
     Notifies the frontend via websocket when an EMA record is deleted
 
@@ -62,8 +97,16 @@ def send_deletes_via_websocket(sender: type[EMARecord], instance: EMARecord, **k
                 "id": str(instance.pk)
             }
         }
-        notify_group_of_ema_record_update_via_websocket("ema_record_updates", data)
+        notify_group_of_ema_record_update_on_commit("ema_record_updates", data, using=using)
     except Exception:
         # Ignore any errors that occur while sending the notification
         pass
     return
+
+
+
+@receiver(post_delete, sender=EMARecord)
+def create_tombstone(sender: type[EMARecord], instance: EMARecord, using: str, **kwargs) -> None:
+    """Creates a tombstone for deleted EMA records, in the transaction of the deletion, for clients syncing changes"""
+    EMARecordTombstone.create_for([instance.pk], using=using)
+    return
@@ -0,0 +1,143 @@
+import asyncio
+import json
+import time
+from typing import Any, AsyncIterator, Dict, List, Mapping, Optional, Set
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from channels.layers import get_channel_layer
+
+from helpers.metrics import sse_events_sent_total, sse_streams
+from .filters import EMARecordQSFilterer
+from .models import EMARecord
+from .utils import aget_ema_record_events_since
+
+
+# Filters of the event stream. Only filters on properties of a record that do not change
+# are supported, so that whether a record matches is only checked once.
+EVENT_STREAM_RECORD_FILTERS = ("currency", "timeframe", "category")
+
+
+class EMARecordEventFilter:
+    """
+    Filters EMA record events by code, and by the currency, timeframe and category of the records.
+
+    The ids of the matching records are loaded once, and kept up to date from the events.
+    Only created records are looked up, as they may not match.
+    """
+
+    def __init__(self, params: Mapping[str, Any]) -> None:
+        """
+        :param params: Query params. "code" is a comma separated list of event codes, where
+        e.g. "update" also matches "update_many". The record filters are those of `EMARecordQSFilterer`.
+        :raises: `EMARecordQSFilterer.ParseError` if a record filter is invalid
+        """
+        codes = params.get("code")
+        self.codes: Optional[Set[str]] = {
+            code.strip().lower().removesuffix("_many") for code in codes.split(",") if code.strip()
+        } if codes else None
+
+        record_filters = {key: params[key] for key in EVENT_STREAM_RECORD_FILTERS if params.get(key)}
+        self.queryset = EMARecordQSFilterer(record_filters).apply_filters(EMARecord.objects.all()) if record_filters else None
+        self.record_ids: Set[str] = set()
+
+
+    async def aload(self) -> None:
+        """Load the ids of the records matching the record filters"""
+        if self.queryset is not None:
+            self.record_ids = {str(pk) async for pk in self.queryset.values_list("pk", flat=True)}
+        return None
+
+
+    async def afilter(self, event: Dict) -> Optional[Dict]:
+        """
+        Returns the event, with only the matching records for events of multiple records,
+        or None if no record matches.
+        """
+        code: str = event["code"]
+        if self.codes is not None and code.removesuffix("_many") not in self.codes:
+            return None
+        if self.queryset is None:
+            return event
+
+        data = event["data"]
+        if code in ("delete", "delete_many"):
+            ids = [data["id"]] if code == "delete" else data["ids"]
+            ids = [str(record_id) for record_id in ids if str(record_id) in self.record_ids]
+            self.record_ids.difference_update(ids)
+            if not ids:
+                return None
+            return event if code == "delete" else {**event, "data": {"ids": ids}}
+
+        records: List[Dict] = [data] if code in ("create", "update") else data
+        if code in ("create", "create_many"):
+            created_ids = self.queryset.filter(pk__in=[record["id"] for record in records]).values_list("pk", flat=True)
+            self.record_ids.update([str(pk) async for pk in created_ids])
+        records = [record for record in records if str(record["id"]) in self.record_ids]
+        if not records:
+            return None
+        return event if code in ("create", "update") else {**event, "data": records}
+
+
+
+def format_server_sent_event(event: Dict, event_id: Optional[int] = None) -> str:
+    """Returns an EMA record event in the `text/event-stream` format"""
+    if settings.WEBSOCKET_INCLUDE_SERVER_TIMESTAMP:
+        event = {**event, "server_ts": time.time_ns() / 1_000_000}
+    lines = [] if event_id is None else [f"id: {event_id}"]
+    lines.append(f"data: {json.dumps(event, cls=DjangoJSONEncoder)}")
+    return "\n".join(lines) + "\n\n"
+
+
+async def ema_record_event_stream(
+    event_filter: EMARecordEventFilter,
+    last_event_id: Optional[int] = None,
+    group_name: str = "ema_record_updates"
+) -> AsyncIterator[str]:
+    """
+    Stream the EMA record events sent to websocket clients, as server-sent events.
+
+    The stream joins the channel group of `EMARecordEventsConsumer`, so each open stream
+    costs a coroutine and a channel. A heartbeat comment is sent if there was no event
+    for `settings.SSE_HEARTBEAT_INTERVAL` seconds.
+
+    :param event_filter: Filter of the events to send
+    :param last_event_id: Id of the last event received by the client, from the "Last-Event-ID" header.
+    The events after it are replayed, if they are still logged. Otherwise, a "reset" event is sent first,
+    so that the client can reload the records it needs.
+    :param group_name: The channel group to receive events from
+    """
+    channel_layer = get_channel_layer("default")
+    channel = await channel_layer.new_channel()
+    # Join the group before replaying, so that no event is missed in between
+    await channel_layer.group_add(group_name, channel)
+    sse_streams.inc()
+    try:
+        await event_filter.aload()
+        replayed_ids: Set[int] = set()
+        if last_event_id is not None and settings.SSE_REPLAY_EVENTS:
+            events = await aget_ema_record_events_since(last_event_id)
+            if events is None:
+                yield format_server_sent_event({"code": "reset", "data": {}})
+            for event_id, event in events or []:
+                replayed_ids.add(event_id)
+                event = await event_filter.afilter(event)
+                if event is not None:
+                    yield format_server_sent_event(event, event_id)
+                    sse_events_sent_total.inc()
+
+        while True:
+            try:
+                message = await asyncio.wait_for(channel_layer.receive(channel), timeout=settings.SSE_HEARTBEAT_INTERVAL)
+            except asyncio.TimeoutError:
+                yield ": heartbeat\n\n"
+                continue
+            event_id = message.get("event_id")
+            if event_id in replayed_ids:
+                continue
+            event = await event_filter.afilter(message["data"])
+            if event is not None:
+                yield format_server_sent_event(event, event_id)
+                sse_events_sent_total.inc()
+    finally:
+        sse_streams.dec()
+        await channel_layer.group_discard(group_name, channel)
@@ -0,0 +1,934 @@
+import copy
+import datetime
+import io
+import json
+import logging
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+from asgiref.sync import sync_to_async
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import models
+from django.test import override_settings
+from django.utils import timezone
+from prometheus_client import REGISTRY
+
+from benchmarks.cases import SCREENER_FILTERS
+from benchmarks.data import clear_data, seed_data, SYMBOL_PREFIX
+from currency.models import Currency
+from ema.candles import ingest_candles, upsert_candles
+from ema.consumers import ema_records_events_consumer
+from ema.change_feed import build_change_events, coalesce_changes
+from ema.filters import EMARecordQSFilterer, compile_expression, sideways_watch_filters
+from ema.management.commands.simulate_feed import Command as SimulateFeedCommand
+from ema.ingest import apply_ema_record_batch, get_ingest_queue
+from ema.models import Candle, EMARecord, EMARecordChangeVersion, EMARecordTombstone
+from ema.serializers import EMARecordSerializer
+from ema.streams import EMARecordEventFilter, ema_record_event_stream
+from ema.utils import append_to_ema_record_event_log, notify_group_of_ema_record_update_via_websocket
+from helpers.expressions import ExpressionCompiler, ExpressionError
+from helpers.metrics import CHANNELS_REDIS_OVER_CAPACITY_MESSAGE, MeteredInMemoryChannelLayer
+from helpers.tracing import FileSpanExporter, InMemorySpanExporter, Span, Trace, set_span_exporter
+from helpers.testing import BudgetTestCase, DATASET_SIZES
+
+
+EMA_RECORDS_URL = "/api/v1/ema-records/"
+
+WATCH_FIELDS = ("twenty_greater_than_fifty", "fifty_greater_than_hundred", "hundred_greater_than_twohundred", "close_greater_than_hundred")
+
+# Whether a record matches each of `SCREENER_FILTERS`, checked in Python
+SCREENER_FILTER_MATCHES = {
+    "none": lambda record: True,
+    "timeframe": lambda record: record.timeframe == datetime.timedelta(hours=1),
+    "currency": lambda record: record.currency.symbol == "BENCH00001",
+    "trend": lambda record: record.trend == "1",
+    "watch": lambda record: all(getattr(record, field) for field in WATCH_FIELDS),
+    "watch_sideways": lambda record: (
+        {field: getattr(record, field) for field in WATCH_FIELDS} in list(sideways_watch_filters())
+    ),
+    "category": lambda record: record.currency.category == "Crypto",
+    "indicator": lambda record: record.indicators.get("rsi") is not None and record.indicators["rsi"] > 70,
+    "expr": lambda record: record.close > record.ema50 * 1.02 and record.ema20 > record.ema50,
+}
+
+
+
+class EMARecordEndpointBudgetTests(BudgetTestCase):
+    """Query and latency budgets of `/api/v1/ema-records/`, at several dataset sizes"""
+
+    def seed(self, currencies: int) -> None:
+        clear_data()
+        self.records = seed_data(currencies, timeframes=2)
+        return None
+
+
+    def get_record_data(self, record: EMARecord) -> dict:
+        data = EMARecordSerializer(record).data
+        data["currency_symbol"] = record.currency.symbol
+        return data
+
+
+    def assertFilteredResults(self, data: dict, filter_name: str) -> None:
+        """Check that a page of the EMA record list only has, and counts, the records matching the filter"""
+        matches = SCREENER_FILTER_MATCHES[filter_name]
+        expected_ids = {str(record.pk) for record in EMARecord.objects.select_related("currency") if matches(record)}
+        result_ids = {record["id"] for record in data["results"]}
+        self.assertEqual(data["count"], len(expected_ids))
+        self.assertEqual(len(data["results"]), min(len(expected_ids), 50))
+        self.assertLessEqual(result_ids, expected_ids)
+        return None
+
+
+    def test_list(self) -> None:
+        for size in DATASET_SIZES:
+            self.seed(size)
+            for name, params in SCREENER_FILTERS.items():
+                with self.subTest(currencies=size, filter=name):
+                    with self.assertWithinBudget(3, 300, f"GET {EMA_RECORDS_URL} ({name}, {size} currencies)"):
+                        response = self.client.get(EMA_RECORDS_URL, params)
+                    self.assertEqual(response.status_code, 200)
+                    self.assertFilteredResults(response.json(), name)
+
+
+    async def test_list_async(self) -> None:
+        # Requests made through the ASGI handler are served by the async list view
+        await sync_to_async(self.seed)(DATASET_SIZES[-1])
+        for name, params in SCREENER_FILTERS.items():
+            with self.subTest(filter=name):
+                async with self.aassertWithinBudget(3, 300, f"GET {EMA_RECORDS_URL} ({name}, async)"):
+                    response = await self.async_client.get(EMA_RECORDS_URL, params, headers={"X-API-KEY": self.api_key})
+                self.assertEqual(response.status_code, 200)
+                await sync_to_async(self.assertFilteredResults)(response.json(), name)
+
+
+    def test_list_last_page(self) -> None:
+        for size in DATASET_SIZES:
+            self.seed(size)
+            with self.subTest(currencies=size):
+                params = {"limit": 50, "offset": max(len(self.records) - 50, 0)}
+                with self.assertWithinBudget(3, 300, f"GET {EMA_RECORDS_URL} (last page, {size} currencies)"):
+                    response = self.client.get(EMA_RECORDS_URL, params)
+                self.assertEqual(response.status_code, 200)
+
+
+    def test_create(self) -> None:
+        for size in DATASET_SIZES:
+            self.seed(size)
+            with self.subTest(currencies=size):
+                currency = Currency.objects.create(symbol=f"{SYMBOL_PREFIX}NEW", category="Crypto", subcategory="New")
+                data = self.get_record_data(self.records[0])
+                data["currency_symbol"] = currency.symbol
+                with self.assertWithinBudget(6, 300, f"POST {EMA_RECORDS_URL} (create, {size} currencies)"):
+                    response = self.client.post(EMA_RECORDS_URL, data=json.dumps(data), content_type="application/json")
+                self.assertEqual(response.status_code, 201)
+
+
+    def test_update(self) -> None:
+        for size in DATASET_SIZES:
+            self.seed(size)
+            with self.subTest(currencies=size):
+                data = self.get_record_data(self.records[-1])
+                data["close"] *= 1.01
+                with self.assertWithinBudget(6, 300, f"POST {EMA_RECORDS_URL} (update, {size} currencies)"):
+                    response = self.client.post(EMA_RECORDS_URL, data=json.dumps(data), content_type="application/json")
+                self.assertEqual(response.status_code, 201)
+
+
+    def test_put(self) -> None:
+        for size in DATASET_SIZES:
+            self.seed(size)
+            with self.subTest(currencies=size):
+                data = self.get_record_data(self.records[-1])
+                data["close"] *= 1.01
+                with self.assertWithinBudget(6, 300, f"PUT {EMA_RECORDS_URL} ({size} currencies)"):
+                    response = self.client.put(EMA_RECORDS_URL, data=json.dumps(data), content_type="application/json")
+                self.assertEqual(response.status_code, 200)
+
+
+    def test_unchanged_update(self) -> None:
+        self.seed(DATASET_SIZES[0])
+        data = self.get_record_data(self.records[-1])
+        data["close"] *= 1.01
+        response = self.client.post(EMA_RECORDS_URL, data=json.dumps(data), content_type="application/json")
+        self.assertEqual(response.status_code, 201)
+        updated_at = EMARecord.objects.get(pk=self.records[-1].pk).updated_at
+
+        # The record is not saved again, so it is not updated and no websocket update is sent
+        with self.assertWithinBudget(2, 300, f"POST {EMA_RECORDS_URL} (unchanged)"):
+            response = self.client.post(EMA_RECORDS_URL, data=json.dumps(data), content_type="application/json")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(EMARecord.objects.get(pk=self.records[-1].pk).updated_at, updated_at)
+
+
+
+class IdempotencyKeyTests(BudgetTestCase):
+    """Handling of the "Idempotency-Key" header by the write endpoints of `/api/v1/ema-records/`"""
+
+    def setUp(self) -> None:
+        super().setUp()
+        cache.clear()
+        clear_data()
+        self.records = seed_data(DATASET_SIZES[0], timeframes=1)
+        self.data = EMARecordSerializer(self.records[0]).data
+        self.data["currency_symbol"] = self.records[0].currency.symbol
+        self.data["close"] *= 1.01
+
+
+    def post(self, data: dict, key: str):
+        return self.client.post(
+            EMA_RECORDS_URL, data=json.dumps(data), content_type="application/json", headers={"Idempotency-Key": key}
+        )
+
+
+    def test_retry_is_replayed(self) -> None:
+        response = self.post(self.data, "retry")
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn("Idempotent-Replayed", response.headers)
+
+        with self.assertWithinBudget(1, 300, f"POST {EMA_RECORDS_URL} (retry)"):
+            retry = self.post(self.data, "retry")
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry.headers["Idempotent-Replayed"], "true")
+        self.assertEqual(retry.json(), response.json())
+
+
+    def test_key_reused_for_different_request(self) -> None:
+        self.assertEqual(self.post(self.data, "reused").status_code, 201)
+        self.data["close"] *= 1.01
+        self.assertEqual(self.post(self.data, "reused").status_code, 422)
+        self.assertEqual(self.post(self.data, "other").status_code, 201)
+
+
+
+class IngestQueueTests(BudgetTestCase):
+    """The "queue" ingest mode of `/api/v1/ema-records/` and the `ingest_worker` command, with a SQLite queue"""
+
+    def setUp(self) -> None:
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(
+            INGEST_MODE="queue", 
+            INGEST_QUEUE_URL=f"sqlite:///{directory.name}/queue.sqlite3",
+            INGEST_QUEUE_CLAIM_TIMEOUT=60
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        clear_data()
+        self.records = seed_data(DATASET_SIZES[0], timeframes=1)
+
+
+    def get_record_data(self, record: EMARecord, close: float) -> dict:
+        data = EMARecordSerializer(record).data
+        data["currency_symbol"] = record.currency.symbol
+        data["close"] = close
+        return data
+
+
+    def test_queued_records_are_applied_by_worker(self) -> None:
+        record = self.records[0]
+        for close in (1.0, 2.0):
+            with self.assertWithinBudget(1, 300, f"POST {EMA_RECORDS_URL} (queue)"):
+                response = self.client.post(
+                    EMA_RECORDS_URL, data=json.dumps(self.get_record_data(record, close)), content_type="application/json"
+                )
+            self.assertEqual(response.status_code, 202)
+        self.assertNotEqual(EMARecord.objects.get(pk=record.pk).close, 2.0)
+
+        call_command("ingest_worker", "--once", "--block=0", stdout=io.StringIO())
+        # Only the last queued data of the record is applied
+        self.assertEqual(EMARecord.objects.get(pk=record.pk).close, 2.0)
+        self.assertEqual(get_ingest_queue().lag(), 0)
+
+
+    def test_apply_batch(self) -> None:
+        unchanged = self.records[1]
+        unchanged.save()
+        new_currency = Currency.objects.create(symbol=f"{SYMBOL_PREFIX}NEW", category="Crypto", subcategory="New")
+        new_data = self.get_record_data(self.records[0], 1.0)
+        new_data["currency_symbol"] = new_currency.symbol
+        unknown_data = {**new_data, "currency_symbol": "UNKNOWN"}
+
+        counts = apply_ema_record_batch([
+            self.get_record_data(self.records[0], 3.0),
+            self.get_record_data(unchanged, unchanged.close),
+            new_data,
+            unknown_data,
+            {"currency_symbol": "INVALID"},
+        ])
+        self.assertEqual(counts, {"created": 1, "updated": 1, "unchanged": 1, "superseded": 0, "stale": 0, "rejected": 2})
+        self.assertEqual(EMARecord.objects.get(pk=self.records[0].pk).close, 3.0)
+        self.assertTrue(EMARecord.objects.filter(currency=new_currency).exists())
+
+
+    def test_stale_items_are_skipped(self) -> None:
+        record = self.records[0]
+        received_at = timezone.now()
+        apply_ema_record_batch([self.get_record_data(record, 2.0)], received_at=[received_at])
+        self.assertEqual(EMARecord.objects.get(pk=record.pk).updated_at, received_at)
+
+        # E.g. an item of a failed batch, delivered again after the newer item was applied
+        counts = apply_ema_record_batch(
+            [self.get_record_data(record, 1.0)], received_at=[received_at - datetime.timedelta(seconds=1)]
+        )
+        self.assertEqual(counts["stale"], 1)
+        self.assertEqual(EMARecord.objects.get(pk=record.pk).close, 2.0)
+
+        # Within a batch, the item received last is applied, whatever the order of the batch
+        counts = apply_ema_record_batch(
+            [self.get_record_data(record, 4.0), self.get_record_data(record, 3.0)],
+            received_at=[received_at + datetime.timedelta(seconds=2), received_at + datetime.timedelta(seconds=1)]
+        )
+        self.assertEqual(EMARecord.objects.get(pk=record.pk).close, 4.0)
+        self.assertEqual((counts["updated"], counts["superseded"], counts["unchanged"]), (1, 1, 0))
+
+
+    def test_created_records_are_updated_at_the_time_they_were_queued(self) -> None:
+        new_currency = Currency.objects.create(symbol=f"{SYMBOL_PREFIX}NEW", category="Crypto", subcategory="New")
+        data = {**self.get_record_data(self.records[0], 1.0), "currency_symbol": new_currency.symbol}
+        received_at = timezone.now() - datetime.timedelta(minutes=1)
+        apply_ema_record_batch([data], received_at=[received_at])
+        self.assertEqual(EMARecord.objects.get(currency=new_currency).updated_at, received_at)
+
+
+    def test_entries_delivered_too_often_are_dead_lettered(self) -> None:
+        queue = get_ingest_queue()
+        queue.claim_timeout = 0
+        record = self.records[0]
+        queue.append([self.get_record_data(record, 2.0), {"currency_symbol": record.currency.symbol}])
+
+        with override_settings(INGEST_QUEUE_MAX_DELIVERIES=2):
+            with mock.patch("ema.management.commands.ingest_worker.apply_ema_record_batch", side_effect=RuntimeError) as apply:
+                with self.assertLogs(level="WARNING") as logs:
+                    call_command("ingest_worker", "--once", "--block=0", stdout=io.StringIO())
+
+        # Applied once as a batch, then a second time one by one
+        self.assertEqual([len(call.args[0]) for call in apply.call_args_list], [2, 1, 1])
+        self.assertIn("Moved 2 queued EMA records to the dead letters after 2 deliveries", logs.output[-1])
+        self.assertEqual(queue.lag(), 0)
+        self.assertEqual([entry.deliveries for entry in queue.dead_letters()], [3, 3])
+        self.assertEqual(queue.dead_letters()[0].data["close"], 2.0)
+
+
+    def test_unacknowledged_entries_are_delivered_again(self) -> None:
+        queue = get_ingest_queue()
+        queue.claim_timeout = 0
+        queue.append([{"n": 1}, {"n": 2}])
+        first = queue.read("first", 10)
+        self.assertEqual([entry.data for entry in first], [{"n": 1}, {"n": 2}])
+        # Not acknowledged by the first consumer in time
+        second = queue.read("second", 10)
+        self.assertEqual([entry.id for entry in second], [entry.id for entry in first])
+        queue.ack([entry.id for entry in second])
+        self.assertEqual(queue.read("second", 10), [])
+
+
+
+class ChangeFeedTests(BudgetTestCase):
+    """Websocket events built from the notifications of the `ema_record_notify_change` trigger"""
+
+    def setUp(self) -> None:
+        super().setUp()
+        clear_data()
+        self.records = seed_data(DATASET_SIZES[0], timeframes=1)
+
+
+    def test_changes_are_coalesced(self) -> None:
+        changes = coalesce_changes([
+            {"op": "create", "id": 1},
+            {"op": "update", "id": 1, "changed": ["close"]},
+            {"op": "update", "id": 2, "changed": ["close"]},
+            {"op": "update", "id": 2, "changed": ["ema20", "close"]},
+            {"op": "create", "id": 3},
+            {"op": "delete", "id": 3},
+            {"op": "update", "id": 4, "changed": ["close"]},
+            {"op": "delete", "id": 4},
+        ])
+        self.assertEqual({record_id: change["op"] for record_id, change in changes.items()}, {
+            "1": "create", "2": "update", "4": "delete"
+        })
+        self.assertEqual(changes["2"]["changed"], ["close", "ema20"])
+
+
+    def test_build_change_events(self) -> None:
+        created, updated, *others = self.records
+        deleted = [str(record.pk) for record in others[:2]]
+        with self.assertNumQueries(1):
+            events = build_change_events([
+                {"op": "create", "id": str(created.pk)},
+                {"op": "update", "id": str(updated.pk), "changed": ["close", "currency_id"]},
+                *({"op": "delete", "id": record_id} for record_id in deleted),
+            ])
+
+        self.assertEqual([event["code"] for event in events], ["create", "update", "delete_many"])
+        self.assertEqual(events[0]["data"], EMARecordSerializer(created).data)
+        self.assertEqual(events[1]["data"], {
+            "id": str(updated.pk), "close": updated.close, "currency": EMARecordSerializer(updated).data["currency"]
+        })
+        self.assertEqual(events[2]["data"], {"ids": deleted})
+
+
+    @override_settings(WEBSOCKET_EVENT_SOURCE="database")
+    def test_signals_do_not_send_events(self) -> None:
+        record = self.records[0]
+        record.close += 1
+        with mock.patch("ema.utils.notify_group_of_ema_record_update_via_websocket") as notify:
+            with self.captureOnCommitCallbacks(execute=True) as callbacks:
+                record.save()
+        self.assertEqual(callbacks, [])
+        notify.assert_not_called()
+
+
+
+@override_settings(SSE_HEARTBEAT_INTERVAL=0.05, SSE_REPLAY_EVENTS=10)
+class EventStreamTests(BudgetTestCase):
+    """The server-sent EMA record event stream at `/api/v1/ema-records/events/`"""
+
+    def setUp(self) -> None:
+        super().setUp()
+        cache.clear()
+        clear_data()
+        self.records = seed_data(DATASET_SIZES[0], timeframes=1)
+
+
+    def get_events(self, chunks: list) -> list:
+        return [json.loads(chunk.split("data: ", 1)[1]) for chunk in chunks if "data: " in chunk]
+
+
+    async def test_stream(self) -> None:
+        response = await self.async_client.get(f"{EMA_RECORDS_URL}events/", headers={"X-API-KEY": self.api_key})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        response = await self.async_client.get(f"{EMA_RECORDS_URL}events/")
+        self.assertEqual(response.status_code, 403)
+
+
+    async def test_events_are_filtered(self) -> None:
+        record, other = self.records[0], self.records[1]
+        currency = await Currency.objects.aget(ema_records=record)
+        stream = ema_record_event_stream(EMARecordEventFilter({"currency": currency.symbol, "code": "update,delete"}))
+        # Idle streams receive heartbeats
+        self.assertEqual(await anext(stream), ": heartbeat\n\n")
+
+        channel_layer = get_channel_layer()
+        for event in (
+            {"code": "update", "data": {"id": str(other.pk), "close": 1.0}},
+            {"code": "create", "data": {"id": str(record.pk)}},
+            {"code": "update_many", "data": [{"id": str(other.pk), "close": 1.0}, {"id": str(record.pk), "close": 2.0}]},
+            {"code": "delete_many", "data": {"ids": [str(other.pk), str(record.pk)]}},
+        ):
+            await channel_layer.group_send("ema_record_updates", {"type": "send.ema_record_update", "data": event})
+
+        self.assertEqual(self.get_events([await anext(stream), await anext(stream)]), [
+            {"code": "update_many", "data": [{"id": str(record.pk), "close": 2.0}]},
+            {"code": "delete_many", "data": {"ids": [str(record.pk)]}},
+        ])
+        await stream.aclose()
+
+
+    async def test_resume(self) -> None:
+        event_ids = [
+            await sync_to_async(append_to_ema_record_event_log)({"code": "delete", "data": {"id": str(n)}})
+            for n in range(3)
+        ]
+        stream = ema_record_event_stream(EMARecordEventFilter({}), last_event_id=event_ids[0])
+        chunks = [await anext(stream), await anext(stream)]
+        self.assertTrue(chunks[0].startswith(f"id: {event_ids[1]}\n"))
+        self.assertEqual(self.get_events(chunks), [{"code": "delete", "data": {"id": "1"}}, {"code": "delete", "data": {"id": "2"}}])
+        await stream.aclose()
+
+        # Events that are no longer logged cannot be replayed
+        stream = ema_record_event_stream(EMARecordEventFilter({}), last_event_id=event_ids[0] - 20)
+        self.assertEqual(self.get_events([await anext(stream)]), [{"code": "reset", "data": {}}])
+        await stream.aclose()
+
+
+
+class WebsocketMetricsTests(BudgetTestCase):
+    """Websocket delivery metrics"""
+
+    def get_sample(self, name: str, **labels: str) -> float:
+        return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+    async def test_messages_sent(self) -> None:
+        sent = self.get_sample("websocket_messages_sent_total")
+        communicator = WebsocketCommunicator(ema_records_events_consumer, "/ws/ema-records/")
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        self.assertEqual(self.get_sample("websocket_group_members", group="ema_record_updates"), 1)
+
+        event = {"code": "delete", "data": {"id": "1"}}
+        await get_channel_layer().group_send("ema_record_updates", {"type": "send.ema_record_update", "data": event})
+        self.assertEqual(await communicator.receive_json_from(), event)
+        self.assertEqual(self.get_sample("websocket_messages_sent_total"), sent + 1)
+        await communicator.disconnect()
+        self.assertEqual(self.get_sample("websocket_group_members", group="ema_record_updates"), 0)
+
+
+    async def test_channel_full_drops(self) -> None:
+        dropped = self.get_sample("websocket_messages_dropped_total", reason="channel_full")
+        channel_layer = MeteredInMemoryChannelLayer(capacity=1)
+        channel = await channel_layer.new_channel()
+        await channel_layer.group_add("ema_record_updates", channel)
+        for n in range(3):
+            await channel_layer.group_send("ema_record_updates", {"type": "send.ema_record_update", "data": {"n": n}})
+        self.assertEqual(self.get_sample("websocket_messages_dropped_total", reason="channel_full"), dropped + 2)
+        self.assertEqual((await channel_layer.receive(channel))["data"], {"n": 0})
+
+
+    def test_redis_channel_full_drops(self) -> None:
+        dropped = self.get_sample("websocket_messages_dropped_total", reason="channel_full")
+        # As logged by the Redis channel layer
+        logging.getLogger("channels_redis.core").info(CHANNELS_REDIS_OVER_CAPACITY_MESSAGE, 3, 5, "ema_record_updates")
+        logging.getLogger("channels_redis.core").info("Unrelated message %s", 4)
+        self.assertEqual(self.get_sample("websocket_messages_dropped_total", reason="channel_full"), dropped + 3)
+
+
+
+class TracingTests(BudgetTestCase):
+    """Traces of writes, from the request to the websocket send"""
+
+    def setUp(self) -> None:
+        super().setUp()
+        clear_data()
+        self.records = seed_data(DATASET_SIZES[0], timeframes=1)
+        self.exporter = InMemorySpanExporter()
+        set_span_exporter(self.exporter)
+
+
+    def tearDown(self) -> None:
+        set_span_exporter(None)
+        super().tearDown()
+
+
+    def test_write_is_traced(self) -> None:
+        data = EMARecordSerializer(self.records[0]).data
+        data["currency_symbol"] = self.records[0].currency.symbol
+        data["close"] *= 1.01
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                EMA_RECORDS_URL, data=json.dumps(data), content_type="application/json", headers={"X-Trace-Id": "trace-1"}
+            )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response["X-Trace-Id"], "trace-1")
+        self.assertEqual(sorted(span.name for span in self.exporter.spans), ["db_commit", "group_send", "http_request"])
+        self.assertTrue(all(span.trace_id == "trace-1" and span.end_ns >= span.start_ns for span in self.exporter.spans))
+
+        # Reads are not traced, and invalid trace ids are replaced
+        self.exporter.clear()
+        self.client.get(EMA_RECORDS_URL, headers={"X-Trace-Id": "trace-2"})
+        self.assertEqual(self.exporter.spans, [])
+        response = self.client.post(EMA_RECORDS_URL, data="{}", content_type="application/json", headers={"X-Trace-Id": "not valid!"})
+        self.assertEqual(response.status_code, 400)
+        self.assertNotEqual(response["X-Trace-Id"], "not valid!")
+        self.assertEqual([span.name for span in self.exporter.spans], ["http_request"])
+
+
+    async def test_websocket_hops_are_traced(self) -> None:
+        communicator = WebsocketCommunicator(ema_records_events_consumer, "/ws/ema-records/")
+        await communicator.connect()
+        trace = Trace(trace_id="trace-3")
+        await sync_to_async(notify_group_of_ema_record_update_via_websocket)(
+            "ema_record_updates", {"code": "delete", "data": {"id": "1"}}, trace=trace
+        )
+        await communicator.receive_json_from()
+        await communicator.disconnect()
+        spans = {span.name: span for span in self.exporter.spans}
+        self.assertEqual(sorted(spans), ["channel_layer_delivery", "end_to_end", "group_send", "websocket_send"])
+        self.assertEqual(spans["end_to_end"].start_ns, trace.received_ns)
+        self.assertEqual(spans["channel_layer_delivery"].start_ns, spans["group_send"].start_ns)
+
+
+    def test_file_exporter(self) -> None:
+        with tempfile.TemporaryDirectory() as directory:
+            exporter = FileSpanExporter(f"{directory}/spans.jsonl")
+            for n in range(3):
+                exporter.export(Span("trace-4", f"span-{n}", n, n + 1))
+            exporter.flush()
+            with open(exporter.path, encoding="utf-8") as file:
+                spans = [json.loads(line) for line in file]
+            self.assertEqual([span["name"] for span in spans], ["span-0", "span-1", "span-2"])
+
+            # Spans are dropped instead of blocking when the queue is full
+            exporter = FileSpanExporter(f"{directory}/dropped.jsonl", max_queue_size=1)
+            with mock.patch.object(exporter, "_start_writer"):
+                exporter.export(Span("trace-4", "kept", 0, 1))
+                exporter.export(Span("trace-4", "dropped", 0, 1))
+            self.assertEqual(exporter.dropped, 1)
+
+
+
+class SimulateFeedTests(BudgetTestCase):
+    """The `simulate_feed` command"""
+
+    def setUp(self) -> None:
+        super().setUp()
+        clear_data()
+        seed_data(DATASET_SIZES[0], timeframes=1)
+
+
+    def test_inprocess(self) -> None:
+        out = io.StringIO()
+        call_command(
+            "simulate_feed", count=20, rate=10_000, batch_size=5, currencies=2, seed=1, stdout=out
+        )
+        self.assertEqual(Candle.objects.count(), 20)
+        self.assertIn("20 candles pushed", out.getvalue())
+        self.assertIn("0 candles failed", out.getvalue())
+
+
+    def test_http_pushes_are_bounded(self) -> None:
+        lock = threading.Lock()
+        pending = {"current": 0, "max": 0}
+
+        def push(command, candles):
+            time.sleep(0.005)
+            command.record_push(candles, 0.005, None)
+
+        def done(future):
+            with lock:
+                pending["current"] -= 1
+
+        class TrackingExecutor(ThreadPoolExecutor):
+            def submit(self, fn, *args, **kwargs):
+                with lock:
+                    pending["current"] += 1
+                    pending["max"] = max(pending["max"], pending["current"])
+                future = super().submit(fn, *args, **kwargs)
+                future.add_done_callback(done)
+                return future
+
+        out = io.StringIO()
+        with mock.patch("ema.management.commands.simulate_feed.ThreadPoolExecutor", TrackingExecutor):
+            with mock.patch.object(SimulateFeedCommand, "push_over_http", autospec=True, side_effect=push):
+                call_command(
+                    "simulate_feed", mode="http", api_key="key", count=60, rate=100_000, workers=2, seed=1, stdout=out
+                )
+        self.assertIn("60 candles pushed", out.getvalue())
+        self.assertLessEqual(pending["max"], 4)
+
+
+
+class ChangesEndpointTests(BudgetTestCase):
+    """Incremental sync of EMA records with `/api/v1/ema-records/changes/`"""
+
+    def setUp(self) -> None:
+        super().setUp()
+        clear_data()
+        self.records = seed_data(DATASET_SIZES[0], timeframes=1)
+
+
+    def get_changes(self, since: int, limit: int = 500, max_queries: int = 4) -> dict:
+        # The API key, the records, the tombstones and the version of the pruned tombstones
+        with self.assertWithinBudget(max_queries, 300, f"GET {EMA_RECORDS_URL}changes/"):
+            response = self.client.get(f"{EMA_RECORDS_URL}changes/", {"since": since, "limit": limit})
+        self.assertEqual(response.status_code, 200)
+        return response.json()["data"]
+
+
+    def test_changes_since_version(self) -> None:
+        # Page through all records
+        since, ids = 0, []
+        while True:
+            data = self.get_changes(since, limit=4)
+            ids.extend(record["id"] for record in data["records"])
+            since = data["version"]
+            if not data["has_more"]:
+                break
+        self.assertEqual(sorted(ids), sorted(str(record.pk) for record in self.records))
+        self.assertEqual(self.get_changes(since), {"version": since, "has_more": False, "records": [], "deleted": []})
+
+        updated, deleted, bulk_deleted = self.records[0], self.records[1], self.records[2]
+        deleted_ids = [str(deleted.pk), str(bulk_deleted.pk)]
+        updated.close += 1
+        updated.save()
+        deleted.delete()
+        EMARecord.objects.filter(pk=bulk_deleted.pk).bulk_delete()
+        data = self.get_changes(since)
+        self.assertEqual([record["id"] for record in data["records"]], [str(updated.pk)])
+        self.assertEqual(data["records"][0]["close"], updated.close)
+        self.assertEqual(data["deleted"], deleted_ids)
+        self.assertEqual(data["version"], since + 3)
+
+
+    def test_bulk_delete_in_batches(self) -> None:
+        ids = sorted(str(record.pk) for record in self.records[:5])
+        with mock.patch("ema.managers.BULK_DELETE_BATCH_SIZE", 2):
+            with self.assertNumQueries(8):
+                deleted_ids = EMARecord.objects.filter(pk__in=ids).bulk_delete()
+        self.assertEqual(sorted(deleted_ids), ids)
+        self.assertFalse(EMARecord.objects.filter(pk__in=ids).exists())
+        self.assertEqual(EMARecord.objects.count(), len(self.records) - 5)
+        self.assertEqual(sorted(str(pk) for pk in EMARecordTombstone.objects.values_list("pk", flat=True)), ids)
+
+
+    def test_changes_of_a_version_are_not_split(self) -> None:
+        # On PostgreSQL, the changes of a transaction share its version
+        since = self.get_changes(0, limit=len(self.records))["version"]
+        first, second = self.records[:3], self.records[3:5]
+        EMARecord.objects.filter(pk__in=[record.pk for record in first]).update(version=since + 1)
+        EMARecord.objects.filter(pk__in=[record.pk for record in second]).update(version=since + 2)
+
+        data = self.get_changes(since, limit=4)
+        self.assertEqual(sorted(record["id"] for record in data["records"]), sorted(str(record.pk) for record in first))
+        self.assertEqual((data["version"], data["has_more"]), (since + 1, True))
+        # A version with more changes than the limit is returned whole, with two more queries
+        data = self.get_changes(since, limit=2, max_queries=6)
+        self.assertEqual(len(data["records"]), 3)
+        self.assertEqual(data["version"], since + 1)
+        data = self.get_changes(since + 1, limit=2)
+        self.assertEqual(sorted(record["id"] for record in data["records"]), sorted(str(record.pk) for record in second))
+        self.assertEqual((data["version"], data["has_more"]), (since + 2, False))
+
+
+    def test_changes_are_served_below_the_horizon(self) -> None:
+        since = self.get_changes(0, limit=len(self.records))["version"]
+        record, deleted = self.records[0], self.records[1]
+        deleted_id = str(deleted.pk)
+        record.close += 1
+        record.save()
+        deleted.delete()
+        # E.g. the transaction that deleted the record is still running on PostgreSQL
+        with mock.patch.object(EMARecordChangeVersion, "get_horizon", return_value=since + 2):
+            data = self.get_changes(since)
+        self.assertEqual(([record["id"] for record in data["records"]], data["deleted"]), ([str(record.pk)], []))
+        self.assertEqual(self.get_changes(data["version"])["deleted"], [deleted_id])
+
+
+    def test_unchanged_writes_keep_version(self) -> None:
+        record = self.records[0]
+        # Seeded records are bulk created, without a content hash
+        record.save()
+        data = EMARecordSerializer(record).data
+        data["currency_symbol"] = record.currency.symbol
+        response = self.client.post(EMA_RECORDS_URL, data=json.dumps(data), content_type="application/json")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(EMARecord.objects.get(pk=record.pk).version, record.version)
+
+
+    def test_clients_behind_pruned_tombstones_are_reset(self) -> None:
+        since = self.get_changes(0, limit=len(self.records))["version"]
+        old, recent = self.records[0], self.records[1]
+        old_id, recent_id = old.pk, recent.pk
+        old.delete()
+        EMARecordTombstone.objects.filter(pk=old_id).update(deleted_at=timezone.now() - datetime.timedelta(days=8))
+        recent.delete()
+        synced = self.get_changes(since)["version"]
+
+        out = io.StringIO()
+        with override_settings(EMA_RECORD_TOMBSTONE_RETENTION=7 * 24 * 60 * 60):
+            call_command("prune_ema_record_tombstones", stdout=out)
+        self.assertIn("Pruned 1 tombstones", out.getvalue())
+        self.assertEqual(list(EMARecordTombstone.objects.values_list("pk", flat=True)), [recent_id])
+
+        response = self.client.get(f"{EMA_RECORDS_URL}changes/", {"since": since})
+        self.assertEqual(response.status_code, 410)
+        self.assertEqual(response.json()["data"], {"reset": True})
+        # Clients that synced after the pruned deletions, or that sync from scratch, are not reset
+        self.assertEqual(self.get_changes(synced)["deleted"], [])
+        self.assertNotIn(str(old_id), [record["id"] for record in self.get_changes(0, limit=len(self.records))["records"]])
+
+
+    def test_invalid_version(self) -> None:
+        response = self.client.get(f"{EMA_RECORDS_URL}changes/", {"since": "-1"})
+        self.assertEqual(response.status_code, 400)
+
+
+
+class CandleIngestTests(BudgetTestCase):
+    """Recomputing EMA series from late and corrected candles"""
+
+    def setUp(self) -> None:
+        super().setUp()
+        clear_data()
+        self.currencies = [
+            Currency.objects.create(symbol=f"{SYMBOL_PREFIX}C{index}", category="Crypto", subcategory="Test")
+            for index in range(2)
+        ]
+        start = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+        self.candles = [
+            {
+                "timeframe": datetime.timedelta(hours=1),
+                "open_time": start + datetime.timedelta(hours=index),
+                "open": 100 + index % 7,
+                "high": 105 + index % 7,
+                "low": 95 + index % 5,
+                "close": 100 + (index * 37) % 11,
+            }
+            for index in range(60)
+        ]
+
+
+    def ingest(self, currency: Currency, candles: list) -> EMARecord:
+        return ingest_candles([{**candle, "currency": currency} for candle in candles])[-1]
+
+
+    def assertSameSeries(self, expected: EMARecord, actual: EMARecord) -> None:
+        for field in ("close", "ema20", "ema50", "ema100", "ema200", "trend", "monhigh", "monlow"):
+            self.assertAlmostEqual(getattr(actual, field), getattr(expected, field), msg=field)
+        for output, value in expected.indicators.items():
+            if value is None:
+                self.assertIsNone(actual.indicators[output], msg=output)
+            else:
+                self.assertAlmostEqual(actual.indicators[output], value, msg=output)
+
+
+    def test_duplicate_candles_in_a_request(self) -> None:
+        currency, reference = self.currencies
+        duplicate = {**self.candles[10], "close": 200.0}
+        with mock.patch("ema.candles.upsert_candles", wraps=upsert_candles) as upsert:
+            record = self.ingest(currency, [*self.candles[:20], duplicate, *self.candles[20:]])
+        # Each open time is only upserted once, with the last candle of the request
+        open_times = [candle["open_time"] for candle in upsert.call_args.args[2]]
+        self.assertEqual(len(open_times), len(set(open_times)))
+        self.assertEqual(Candle.objects.get(currency=currency, open_time=duplicate["open_time"]).close, 200.0)
+
+        expected = self.ingest(reference, [*self.candles[:10], duplicate, *self.candles[11:]])
+        self.assertSameSeries(expected, record)
+
+
+    def test_late_and_corrected_candles(self) -> None:
+        in_order, out_of_order = self.currencies
+        expected = self.ingest(in_order, self.candles)
+
+        # Candles 20 to 29 arrive late, and candle 40 is corrected
+        wrong = {**self.candles[40], "close": 500.0, "high": 510.0}
+        self.ingest(out_of_order, [*self.candles[:20], *self.candles[30:40], wrong, *self.candles[41:]])
+        self.ingest(out_of_order, self.candles[20:30])
+        actual = self.ingest(out_of_order, [self.candles[40]])
+        self.assertSameSeries(expected, actual)
+
+
+    def test_backfill_matches_incremental_indicators(self) -> None:
+        backfilled, incremental = self.currencies
+        self.ingest(backfilled, self.candles)
+        for candle in self.candles:
+            # Single new candles are computed incrementally
+            self.ingest(incremental, [candle])
+
+        for expected, actual in zip(
+            Candle.objects.filter(currency=backfilled).order_by("open_time"),
+            Candle.objects.filter(currency=incremental).order_by("open_time"),
+        ):
+            self.assertEqual(expected.indicator_values.keys(), actual.indicator_values.keys())
+            for output, value in expected.indicator_values.items():
+                with self.subTest(open_time=expected.open_time, output=output):
+                    if value is None:
+                        self.assertIsNone(actual.indicator_values[output])
+                    else:
+                        self.assertAlmostEqual(actual.indicator_values[output], value)
+
+
+    def test_indicator_filters_skip_missing_values(self) -> None:
+        record = self.ingest(self.currencies[0], self.candles)
+        warming_up = self.ingest(self.currencies[1], self.candles[:3])
+        self.assertIsNone(warming_up.indicators["bollinger_upper"])
+
+        response = self.client.get(EMA_RECORDS_URL, {"bollinger_upper__lt": 1000})
+        self.assertEqual([item["id"] for item in response.json()["results"]], [str(record.pk)])
+
+
+
+class ExpressionFilterTests(BudgetTestCase):
+    """Filter expressions of `/api/v1/ema-records/?expr=...`"""
+
+    def setUp(self) -> None:
+        super().setUp()
+        clear_data()
+        self.record = seed_data(DATASET_SIZES[0], timeframes=1)[0]
+        EMARecord.objects.filter(pk=self.record.pk).update(close=10.0, ema20=2.0, ema50=4.0, twenty_greater_than_fifty=True)
+
+
+    def matches(self, text: str) -> bool:
+        return EMARecord.objects.filter(pk=self.record.pk).filter(copy.deepcopy(compile_expression(text))).exists()
+
+
+    def test_disallowed_syntax_is_rejected(self) -> None:
+        for text in (
+            "close.real > 1",
+            "abs(close) > 1",
+            "__import__('os') > 1",
+            "close[0] > 1",
+            "unknown > 1",
+            "close > 'text'",
+            "not close",
+            "close",
+            "true + 1 > 0",
+            "twenty_greater_than_fifty * 2 > 0",
+        ):
+            with self.subTest(expr=text), self.assertRaises(ExpressionError):
+                compile_expression(text)
+
+
+    def test_query_signature(self) -> None:
+        signature = EMARecordQSFilterer.get_signature({"expr": "close > 1", "timeframe": "01:00:00", "rsi__gt": "70"})
+        # Pagination, ordering and unknown params, e.g. cache busters, are not part of the signature
+        self.assertEqual(EMARecordQSFilterer.get_signature({
+            "expr": "close >  2", "rsi__gt": "30", "timeframe": "04:00:00", "limit": "50", "offset": "100", "ordering": "-close", "_": "123"
+        }), signature)
+        self.assertEqual(signature, "expr=close>?&rsi__gt&timeframe")
+
+
+    def test_mismatched_types_are_rejected(self) -> None:
+        # PostgreSQL cannot compare booleans with numbers, nor order booleans
+        for text in (
+            "twenty_greater_than_fifty = 1",
+            "close > true",
+            "trend = false",
+            "1 != fifty_greater_than_hundred",
+            "ema20 < ema50 = true",
+            "twenty_greater_than_fifty > false",
+            "true <= fifty_greater_than_hundred",
+        ):
+            with self.subTest(expr=text), self.assertRaises(ExpressionError):
+                compile_expression(text)
+
+        compiler = ExpressionCompiler(
+            {"close": lambda: models.F("close"), "symbol": lambda: models.F("currency__symbol")}, text_names=["symbol"]
+        )
+        for text in ("symbol = 1", "symbol > close", "symbol * 2 > 1", "symbol = true"):
+            with self.subTest(expr=text), self.assertRaises(ExpressionError):
+                compiler.compile(text)
+        response = self.client.get(EMA_RECORDS_URL, {"expr": "twenty_greater_than_fifty = 1"})
+        self.assertEqual(response.status_code, 400)
+
+
+    def test_evaluation(self) -> None:
+        for text, expected in (
+            ("close = ema20 + ema50 * 2", True),
+            ("(ema20 + ema50) * 2 = 12", True),
+            ("close - ema20 - ema50 = 4", True),
+            ("ema20 = 1/2 * ema50", True),
+            ("close > 1/2 * ema50 and ema50 > ema20", True),
+            ("close > ema50 or not twenty_greater_than_fifty", True),
+            ("not (close > ema50)", False),
+            ("twenty_greater_than_fifty and -close < 0", True),
+            ("twenty_greater_than_fifty = false", False),
+            ("twenty_greater_than_fifty != false and true = twenty_greater_than_fifty", True),
+            ("ema20 < ema50 < close", True),
+            # Division by zero is NULL, which matches nothing
+            ("close / (ema20 - ema20) > 1", False),
+            ("not (close / (ema20 - ema20) > 1)", False),
+        ):
+            with self.subTest(expr=text):
+                self.assertEqual(self.matches(text), expected)
+
+
+    def test_invalid_expressions_are_rejected(self) -> None:
+        for text in ("close >", "not close", "close / (ema20 - ema20) > 1"):
+            with self.subTest(expr=text):
+                response = self.client.get(EMA_RECORDS_URL, {"expr": text})
+                self.assertEqual(response.status_code, 200 if text.startswith("close /") else 400)
+                if response.status_code == 200:
+                    self.assertEqual(response.json()["results"], [])
+
+
+    async def test_invalid_expressions_are_rejected_async(self) -> None:
+        response = await self.async_client.get(EMA_RECORDS_URL, {"expr": "close >"}, headers={"X-API-KEY": self.api_key})
+        self.assertEqual(response.status_code, 400)
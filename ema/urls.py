@@ -7,5 +7,8 @@ app_name = "ema_records"
 
 urlpatterns = [
     path("", views.ema_record_list_create_api_view, name="ema-record__list-create"),
+    path("candles/", views.candle_ingest_api_view, name="candle__ingest"),
+    path("changes/", views.ema_record_changes_api_view, name="ema-record__changes"),
+    path("events/", views.ema_record_events_stream_view, name="ema-record__events"),
 ]
 
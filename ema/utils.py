@@ -1,7 +1,18 @@
-from typing import Dict
+import datetime
+import hashlib
+import json
+import time
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
 
+from helpers.logging import log_exception
+from helpers.metrics import websocket_group_send_duration_seconds, websocket_messages_dropped_total
+from helpers.tracing import Trace, current_trace, get_or_start_trace, record_span, tracing_enabled
+
 
 
 def get_dict_diff(dict1: Dict, dict2: Dict) -> Dict:
@@ -25,6 +36,41 @@ def get_dict_diff(dict1: Dict, dict2: Dict) -> Dict:
     return diff_dict
 
 
+# Fields of an EMA record that can be written by clients, and so make up its content hash
+EMA_RECORD_CONTENT_FIELDS = (
+    "timeframe",
+    "close",
+    "ema20",
+    "ema50",
+    "ema100",
+    "ema200",
+    "trend",
+    "monhigh",
+    "monlow",
+    "monmid",
+    "twenty_greater_than_fifty",
+    "fifty_greater_than_hundred",
+    "hundred_greater_than_twohundred",
+    "close_greater_than_hundred",
+)
+
+
+def get_ema_record_content_hash(values: Mapping[str, Any]) -> str:
+    """
+    Returns a hash of the content fields of an EMA record.
+
+    :param values: Mapping of content field names to values, e.g. validated serializer data.
+    Fields missing from the mapping are hashed as None.
+    """
+    content = {}
+    for field in EMA_RECORD_CONTENT_FIELDS:
+        value = values.get(field)
+        if isinstance(value, datetime.timedelta):
+            value = value.total_seconds()
+        content[field] = value
+    return hashlib.sha256(json.dumps(content, sort_keys=True, default=str).encode()).hexdigest()
+
+
 WATCH_VALUES_INTERNAL_TO_EXTERNAL_NAME_MAPPING = {
     "twenty_greater_than_fifty": "20>50",
     "fifty_greater_than_hundred": "50>100",
@@ -64,18 +110,120 @@ def convert_watch_values_internal_names_to_external_names(data: Dict) -> Dict:
     return new_data
 
 
-def notify_group_of_ema_record_update_via_websocket(group_name: str, data: Dict) -> None:
+EMA_RECORD_EVENT_LOG_KEY_PREFIX = "ema-record-events"
+
+
+def get_ema_record_event_log_key(event_id: int) -> str:
+    return f"{EMA_RECORD_EVENT_LOG_KEY_PREFIX}:{event_id}"
+
+
+def append_to_ema_record_event_log(data: Dict) -> Optional[int]:
+    """
+    Assign the next event id to an EMA record event, and keep the event in the shared cache
+    for `settings.SSE_REPLAY_TTL` seconds, so that event stream clients can resume after reconnecting.
+
+    :param data: The event, with a "code" and "data" key
+    :return: The id of the event, or None if the event could not be logged or logging is disabled
+    """
+    if not settings.SSE_REPLAY_EVENTS:
+        return None
+    last_id_key = f"{EMA_RECORD_EVENT_LOG_KEY_PREFIX}:last-id"
+    try:
+        try:
+            event_id = cache.incr(last_id_key)
+        except ValueError:
+            cache.add(last_id_key, 0, timeout=None)
+            event_id = cache.incr(last_id_key)
+        cache.set(get_ema_record_event_log_key(event_id), data, timeout=settings.SSE_REPLAY_TTL)
+    except Exception as exc:
+        # Events are still sent, but clients cannot resume from them
+        log_exception(exc)
+        return None
+    return event_id
+
+
+async def aget_ema_record_events_since(last_event_id: int) -> Optional[List[Tuple[int, Dict]]]:
+    """
+    Returns the logged EMA record events after an event, oldest first.
+
+    Returns None if the events cannot be replayed, because the event is unknown or
+    older than the last `settings.SSE_REPLAY_EVENTS` events, or the events after it expired.
+
+    :param last_event_id: The id of the last event received by the client
+    """
+    last_id = await cache.aget(f"{EMA_RECORD_EVENT_LOG_KEY_PREFIX}:last-id")
+    if last_id is None or last_event_id > last_id or last_id - last_event_id > settings.SSE_REPLAY_EVENTS:
+        return None
+
+    event_ids = range(last_event_id + 1, last_id + 1)
+    events = await cache.aget_many([get_ema_record_event_log_key(event_id) for event_id in event_ids])
+    if event_ids and get_ema_record_event_log_key(event_ids[0]) not in events:
+        return None
+    # Newer events may be missing if they are being logged, they are received from the channel layer instead
+    return [
+        (event_id, events[get_ema_record_event_log_key(event_id)])
+        for event_id in event_ids if get_ema_record_event_log_key(event_id) in events
+    ]
+
+
+def notify_group_of_ema_record_update_via_websocket(group_name: str, data: Dict, trace: Optional[Trace] = None) -> None:
     """
     Notify the clients in the channel group of the EMA record update via websocket
 
     :param group_name: The name of the channel group to send the message to
     :param data: The data to send to the client
+    :param trace: The trace of the write that caused the update. Defaults to the current trace, if any.
     """
     channel_layer = get_channel_layer("default")
-    async_to_sync(channel_layer.group_send)(
-        group_name,
-        {
-            'type': 'send.ema_record_update',
-            'data': data
+    trace = trace or current_trace.get()
+    message = {
+        'type': 'send.ema_record_update',
+        'data': data
+    }
+    event_id = append_to_ema_record_event_log(data)
+    if event_id is not None:
+        # Used by event streams to resume, see `ema.streams`
+        message['event_id'] = event_id
+    start_ns = time.time_ns()
+    if trace is not None:
+        # Passed on to consumers, so that they can record the remaining hops of the trace
+        message['trace'] = {
+            'id': trace.trace_id,
+            'received_ns': trace.received_ns,
+            'group_send_ns': start_ns,
         }
-    )
+
+    start = time.perf_counter()
+    try:
+        async_to_sync(channel_layer.group_send)(group_name, message)
+    except Exception:
+        websocket_messages_dropped_total.labels("group_send_error").inc()
+        raise
+    websocket_group_send_duration_seconds.labels(group_name).observe(time.perf_counter() - start)
+    if trace is not None:
+        record_span(trace.trace_id, "group_send", start_ns, group=group_name, code=data.get("code"))
+    return None
+
+
+def notify_group_of_ema_record_update_on_commit(group_name: str, data: Dict, using: Optional[str] = None) -> None:
+    """
+    Notify the clients in the channel group of the EMA record update via websocket,
+    once the current transaction is committed. If there is no transaction, they are notified immediately.
+
+    :param group_name: The name of the channel group to send the message to
+    :param data: The data to send to the client
+    :param using: The database alias of the transaction
+    """
+    if settings.WEBSOCKET_EVENT_SOURCE == "database":
+        # Clients are notified by the change feed instead
+        return None
+    trace = get_or_start_trace() if tracing_enabled() else current_trace.get()
+    write_ns = time.time_ns()
+
+    def notify() -> None:
+        if trace is not None:
+            record_span(trace.trace_id, "db_commit", write_ns, code=data.get("code"))
+        notify_group_of_ema_record_update_via_websocket(group_name, data, trace=trace)
+    
+    transaction.on_commit(notify, using=using)
+    return None
@@ -1,18 +1,28 @@
+from django.conf import settings
 from django.db import models
+from django.http import HttpRequest, HttpResponse, JsonResponse, StreamingHttpResponse
 from rest_framework import generics, response, status
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET
 
 
-from .models import EMARecord
-from .serializers import EMARecordSerializer
+from .models import EMARecord, EMARecordChangeVersion, EMARecordTombstone
+from .serializers import EMARecordSerializer, CandleSerializer
+from .candles import ingest_candles
+from .ingest import enqueue_ema_record
 from .filters import EMARecordQSFilterer
+from .streams import EMARecordEventFilter, ema_record_event_stream
+from api.async_views import AsyncListMixin
+from api.idempotency import idempotent
+from api.permissions import HasAPIKey
 from helpers.logging import log_exception
+from helpers.slow_queries import tag_queries
 
 
 ema_record_qs = EMARecord.objects.select_related("currency").all()
 
 
-class EMARecordListCreateAPIView(generics.ListCreateAPIView):
+class EMARecordListCreateAPIView(AsyncListMixin, generics.ListCreateAPIView):
     """API view for retrieving, creating and updating EMA records"""
     model = EMARecord
     serializer_class = EMARecordSerializer
@@ -24,6 +34,9 @@ class EMARecordListCreateAPIView(generics.ListCreateAPIView):
         try:
             ema_qs_filterer = EMARecordQSFilterer(self.request.query_params)
             return ema_qs_filterer.apply_filters(ema_qs)
+        except EMARecordQSFilterer.ParseError:
+            # Invalid filters are reported to the client with a 400 response, instead of returning all records
+            raise
         except Exception as exc:
             # Log the exception and return the unfiltered queryset
             log_exception(exc)
@@ -43,14 +56,44 @@ class EMARecordListCreateAPIView(generics.ListCreateAPIView):
         - ema200: EMA200 value
         - trend: Trend direction (1 for upwards, -1 for downwards, 0 for sideways)
         - watch: EMA watchlist type. Can be either be type "A", "B", "C", "D", "E" or "F"
+        - <indicator>, <indicator>__gt, <indicator>__gte, <indicator>__lt, <indicator>__lte: Indicator value, 
+        e.g. "rsi__gt=70". Supported indicators are rsi, macd, macd_signal, macd_histogram, atr, 
+        bollinger_upper, bollinger_middle and bollinger_lower
+        - expr: Filter expression e.g. "close > ema50 * 1.02 and ema20 > ema50 and trend = 1". 
+        Expressions support comparisons, and/or/not, arithmetic (+, -, *, /), numbers, 
+        EMA record fields (close, ema20, ema50, ema100, ema200, monhigh, monlow, monmid, trend, 
+        and the watch value fields) and indicator values
         """
-        return super().get(request, *args, **kwargs)
+        # Tag queries with the filter signature, to identify slow filter combinations in the slow query log
+        with tag_queries(f"ema_records?{EMARecordQSFilterer.get_signature(request.query_params)}"):
+            return super().get(request, *args, **kwargs)
     
 
+    async def alist(self, request, *args, **kwargs) -> HttpResponse | None:
+        with tag_queries(f"ema_records?{EMARecordQSFilterer.get_signature(request.GET)}"):
+            return await super().alist(request, *args, **kwargs)
+    
+
+    @idempotent
+    def post(self, request, *args, **kwargs) -> response.Response:
+        """
+        Create an EMA record, or update the existing record of the currency and timeframe
+
+        Supports the "Idempotency-Key" header, so that retried requests are not applied twice.
+        In the "queue" ingest mode, the record is queued and applied by the ingest worker.
+        """
+        if settings.INGEST_MODE == "queue":
+            return self.enqueue(request)
+        return super().post(request, *args, **kwargs)
+    
+
+    @idempotent
     def put(self, request, *args, **kwargs) -> response.Response:
         """
         Update an EMA record
         """
+        if settings.INGEST_MODE == "queue":
+            return self.enqueue(request)
         # User can update existing EMA records via a POST request already
         # Just add this so users can update records using a PUT request
         response = super().post(request, *args, **kwargs)
@@ -58,8 +101,205 @@ class EMARecordListCreateAPIView(generics.ListCreateAPIView):
         if response.status_code == status.HTTP_201_CREATED:
             response.status_code = status.HTTP_200_OK
         return response
+    
+
+    def enqueue(self, request) -> response.Response:
+        """Validate the EMA record and append it to the ingest queue, without applying it"""
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            entry_id = enqueue_ema_record(serializer.validated_data)
+        except Exception as exc:
+            log_exception(exc)
+            return response.Response(
+                data={
+                    "status": "error",
+                    "message": "An error occurred while attempting to queue the EMA record!"
+                },
+                status=status.HTTP_503_SERVICE_UNAVAILABLE
+            )
+        
+        return response.Response(
+            data={
+                "status": "success",
+                "message": "EMA record queued for ingestion!",
+                "data": {
+                    "queue_id": entry_id
+                }
+            },
+            status=status.HTTP_202_ACCEPTED
+        )
+
+
+
+class EMARecordChangesAPIView(generics.GenericAPIView):
+    """API view for syncing EMA records incrementally, by change version"""
+    serializer_class = EMARecordSerializer
+    http_method_names = ["get"]
+    default_limit = 500
+    max_limit = 5000
+
+    def get(self, request, *args, **kwargs) -> response.Response:
+        """
+        Retrieve the EMA records created or updated, and the ids of the EMA records deleted,
+        since a change version, oldest change first
+
+        The following query parameters are supported:
+        - since: The version returned by the previous request. Defaults to 0, to retrieve all records
+        - limit: Maximum number of changes to return. Defaults to 500, maximum 5000
+
+        Request again with the returned version until "has_more" is false. All changes of a version
+        are returned in the same response, so a response may hold more than "limit" changes if a
+        single version has more, e.g. a batch of the ingest worker.
+
+        Responds with 410 and `{"reset": true}` if tombstones of records deleted after "since" were pruned,
+        as the client may have missed deletions. It should then discard its records and sync again from 0.
+        """
+        try:
+            since = int(request.query_params.get("since", 0))
+            if since < 0:
+                raise ValueError
+        except ValueError:
+            return response.Response(
+                data={
+                    "status": "error",
+                    "message": "'since' should be a version returned by a previous request!"
+                },
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            limit = max(min(int(request.query_params.get("limit", self.default_limit)), self.max_limit), 1)
+        except ValueError:
+            limit = self.default_limit
+
+        records_qs = ema_record_qs.filter(version__gt=since)
+        tombstones_qs = EMARecordTombstone.objects.filter(version__gt=since)
+        # Changes of transactions that may still commit are not served yet, see `EMARecordChangeVersion`
+        horizon = EMARecordChangeVersion.get_horizon(using=records_qs.db)
+        if horizon is not None:
+            records_qs = records_qs.filter(version__lt=horizon)
+            tombstones_qs = tombstones_qs.filter(version__lt=horizon)
+
+        # Both queries use the version index, and fetch one extra change to tell if there are more
+        records = list(records_qs.order_by("version")[:limit + 1])
+        tombstones = list(tombstones_qs.order_by("version").values_list("version", "id")[:limit + 1])
+        # Checked after the tombstones are read, so that tombstones pruned in between are not missed
+        if 0 < since < EMARecordTombstone.get_pruned_version():
+            return response.Response(
+                data={
+                    "status": "error",
+                    "message": "Deletions since this version are no longer kept. Discard the records and sync again from version 0!",
+                    "data": {
+                        "reset": True
+                    }
+                },
+                status=status.HTTP_410_GONE
+            )
+        changes = sorted([*((record.version, record) for record in records), *tombstones], key=lambda change: change[0])
+        has_more = len(changes) > limit
+        if has_more:
+            # The returned version is the cursor of the next request, so the changes of a version are not split
+            last_version = changes[limit][0]
+            changes = [change for change in changes[:limit] if change[0] != last_version]
+            if not changes:
+                changes = [
+                    *((record.version, record) for record in records_qs.filter(version=last_version)),
+                    *tombstones_qs.filter(version=last_version).values_list("version", "id"),
+                ]
+
+        return response.Response(
+            data={
+                "status": "success",
+                "message": "EMA record changes retrieved successfully!",
+                "data": {
+                    "version": changes[-1][0] if changes else since,
+                    "has_more": has_more,
+                    "records": self.get_serializer(
+                        [change for _, change in changes if isinstance(change, EMARecord)], many=True
+                    ).data,
+                    "deleted": [str(change) for _, change in changes if not isinstance(change, EMARecord)],
+                }
+            },
+            status=status.HTTP_200_OK
+        )
+
+
+
+class CandleIngestAPIView(generics.GenericAPIView):
+    """API view for ingesting new, late or corrected candles"""
+    serializer_class = CandleSerializer
+    http_method_names = ["post"]
+
+    @idempotent
+    def post(self, request, *args, **kwargs) -> response.Response:
+        """
+        Ingest a list of candles.
+
+        Candles may arrive out of order or correct previously ingested candles. Only the
+        affected part of each EMA series is recomputed and the EMA record of each series
+        is updated once.
+
+        Supports the "Idempotency-Key" header, so that retried batches are not ingested twice.
+        """
+        serializer = self.get_serializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        try:
+            records = ingest_candles(serializer.validated_data)
+        except Exception as exc:
+            log_exception(exc)
+            return response.Response(
+                data={
+                    "status": "error",
+                    "message": "An error occurred while attempting to ingest the candles!"
+                },
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+        
+        return response.Response(
+            data={
+                "status": "success",
+                "message": f"{len(serializer.validated_data)} candle(s) ingested successfully!",
+                "data": EMARecordSerializer(records, many=True).data
+            },
+            status=status.HTTP_200_OK
+        )
+
+
+
+
+@require_GET
+async def ema_record_events_stream_view(request: HttpRequest) -> HttpResponse:
+    """
+    Stream the EMA record events sent to websocket clients, as server-sent events (`text/event-stream`).
+
+    Each event is sent as a message whose data is the JSON event, with its id if events can be resumed.
+    The following query parameters are supported:
+    - code: Comma separated event codes to send, e.g. "create,update". "update" also sends "update_many", and so on.
+    - currency, timeframe, category: Only send events of the matching EMA records, as for the list endpoint
+
+    Send the "Last-Event-ID" header to resume from an event. An idle stream receives a heartbeat comment
+    every `settings.SSE_HEARTBEAT_INTERVAL` seconds.
+    """
+    if not await HasAPIKey().ahas_permission(request, None):
+        return JsonResponse({"detail": HasAPIKey.message}, status=status.HTTP_403_FORBIDDEN)
+    try:
+        event_filter = EMARecordEventFilter(request.GET)
+    except EMARecordQSFilterer.ParseError as exc:
+        return JsonResponse(exc.detail, status=status.HTTP_400_BAD_REQUEST)
+
+    last_event_id = request.headers.get("Last-Event-ID", "")
+    stream = StreamingHttpResponse(
+        ema_record_event_stream(event_filter, last_event_id=int(last_event_id) if last_event_id.isdigit() else None),
+        content_type="text/event-stream"
+    )
+    stream["Cache-Control"] = "no-cache"
+    # Disable response buffering by nginx
+    stream["X-Accel-Buffering"] = "no"
+    return stream
 
 
 
 
-ema_record_list_create_api_view = csrf_exempt(EMARecordListCreateAPIView.as_view())
+ema_record_list_create_api_view = csrf_exempt(EMARecordListCreateAPIView.as_async_view())
+candle_ingest_api_view = csrf_exempt(CandleIngestAPIView.as_view())
+ema_record_changes_api_view = csrf_exempt(EMARecordChangesAPIView.as_view())
@@ -2,16 +2,17 @@ import os
 from django.core.asgi import get_asgi_application
 from channels.routing import ProtocolTypeRouter
 
-from . import websocket
-
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ema_screener.settings')
 
 
+# Set up Django before importing the websocket application, 
+# which imports models, so that the app can be served by daphne directly
 django_asgi_application = get_asgi_application()
 
+from . import websocket
+
 
 application = ProtocolTypeRouter({
     "http": django_asgi_application,
     "websocket": websocket.websocket_application,
 })
-
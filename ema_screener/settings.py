@@ -1,8 +1,10 @@
 from pathlib import Path
+import copy
 import os
 from dotenv import load_dotenv, find_dotenv
 from typing import Union
 from corsheaders.defaults import default_headers
+from django.core.exceptions import ImproperlyConfigured
 
 
 load_dotenv(find_dotenv(".env", raise_error_if_not_found=True))
@@ -31,6 +33,7 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
 
     # apps
+    'api.apps.ApiConfig',
     'ema.apps.EmaConfig',
     'currency.apps.CurrencyConfig',
     'users.apps.UsersConfig',
@@ -38,8 +41,11 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.RequestMetricsMiddleware',
+    'api.middleware.TracingMiddleware',
+    'api.middleware.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
-    "whitenoise.middleware.WhiteNoiseMiddleware",
+    "api.middleware.AsyncWhiteNoiseMiddleware",
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -47,6 +53,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'api.middleware.ProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'ema_screener.urls'
@@ -71,14 +78,45 @@ WSGI_APPLICATION = 'ema_screener.wsgi.application'
 
 ASGI_APPLICATION = 'ema_screener.asgi.application'
 
+# How websocket events are fanned out to the consumers of a group:
+# - "redis": Redis copies each group message into the channel of every member, so Redis work per event grows with the number of clients.
+# - "pubsub": each process subscribes to a group once via Redis pub/sub and delivers its messages to its own consumers,
+#   so Redis work per event grows with the number of processes. Messages are delivered at most once, without capacity limits.
+# - "local": messages are delivered in-process, without Redis. Only for single process deployments that make all writes
+#   in that process, i.e. not with the ingest worker.
+WEBSOCKET_FANOUT = os.getenv("WEBSOCKET_FANOUT", "redis").lower()
+
+CHANNEL_LAYER_BACKENDS = {
+    "redis": "channels_redis.core.RedisChannelLayer",
+    "pubsub": "channels_redis.pubsub.RedisPubSubChannelLayer",
+    "local": "helpers.metrics.MeteredInMemoryChannelLayer",
+}
+if WEBSOCKET_FANOUT not in CHANNEL_LAYER_BACKENDS:
+    raise ImproperlyConfigured(f"WEBSOCKET_FANOUT should be one of {', '.join(CHANNEL_LAYER_BACKENDS)}, not '{WEBSOCKET_FANOUT}'")
+
 CHANNEL_LAYERS = {
     "default": {
-        "BACKEND": "channels_redis.core.RedisChannelLayer",
+        "BACKEND": CHANNEL_LAYER_BACKENDS[WEBSOCKET_FANOUT],
         "CONFIG": {
             "hosts": [(os.getenv("REDIS_SERVICE_HOST"), 6379)],
         },
     },
 }
+if WEBSOCKET_FANOUT == "local":
+    CHANNEL_LAYERS["default"].pop("CONFIG")
+
+CACHES = {
+    # Shared cache
+    "default": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": f"redis://{os.getenv('REDIS_SERVICE_HOST')}:6379/1",
+    },
+    # Process local cache
+    "local": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "ema-screener-local",
+    },
+}
 
 DATABASES = {
    'default': {
@@ -88,9 +126,78 @@ DATABASES = {
        'PASSWORD': os.getenv("DB_PASSWORD"),
        'HOST': os.getenv("DB_HOST"),
        'PORT': os.getenv("DB_PORT"),
+       # Seconds to keep connections open between requests, 0 closes them after each request
+       'CONN_MAX_AGE': int(os.getenv("DB_CONN_MAX_AGE", "0")),
+       # Check that persistent connections still work before reusing them in a new request
+       'CONN_HEALTH_CHECKS': os.getenv("DB_CONN_HEALTH_CHECKS", "true").lower() == "true",
    }
 }
 
+# Take connections from an in-process pool shared by all threads, instead of opening one per request.
+# Prefer this to persistent connections under ASGI, where requests do not run in long-lived threads.
+if os.getenv("DB_POOL", "false").lower() == "true":
+    DATABASES['default'].update({
+        'ENGINE': 'helpers.postgresql_pool',
+        # Connections are returned to the pool after each request
+        'CONN_MAX_AGE': 0,
+        'OPTIONS': {
+            'pool': {
+                'max_size': int(os.getenv("DB_POOL_MAX_SIZE", "10")),
+                'timeout': float(os.getenv("DB_POOL_TIMEOUT", "30")),
+                'max_lifetime': float(os.getenv("DB_POOL_MAX_LIFETIME", "3600")),
+                'max_idle': float(os.getenv("DB_POOL_MAX_IDLE", "600")),
+                'check_idle': float(os.getenv("DB_POOL_CHECK_IDLE", "30")),
+            },
+        },
+    })
+
+# Read replicas, as comma separated "host:port" pairs. Replicas use the credentials of the primary database.
+# Safe requests to `REPLICA_READ_PATHS` read from a replica, see `api.middleware.ReplicaRoutingMiddleware`.
+REPLICA_DATABASES = []
+for index, replica_host in enumerate(filter(None, os.getenv("DB_REPLICA_HOSTS", "").split(",")), start=1):
+    host, _, port = replica_host.strip().partition(":")
+    DATABASES[f'replica_{index}'] = {
+        **copy.deepcopy(DATABASES['default']),
+        'HOST': host,
+        'PORT': port or DATABASES['default']['PORT'],
+        # Tests run against the primary database only
+        'TEST': {'MIRROR': 'default'},
+    }
+    REPLICA_DATABASES.append(f'replica_{index}')
+
+DATABASE_ROUTERS = ["api.db_routers.ReplicaRouter"]
+
+# Path prefixes of the endpoints whose safe requests may read from a replica
+REPLICA_READ_PATHS = ["/api/v1/ema-records/", "/api/v1/currencies/"]
+
+# Replicas lagging behind the primary database by more seconds than this are not read from
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "5"))
+
+# Seconds between checks of the replication lag of each replica, per process
+REPLICA_LAG_CHECK_INTERVAL = float(os.getenv("REPLICA_LAG_CHECK_INTERVAL", "1"))
+
+# Seconds a client reads from the primary database after a write, so that it reads its own writes.
+# Should be longer than the usual replication lag.
+REPLICA_STICKY_SECONDS = int(os.getenv("REPLICA_STICKY_SECONDS", "10"))
+
+# Seconds the response to a request with an "Idempotency-Key" header is stored, to answer retries of the request
+IDEMPOTENCY_KEY_TTL = int(os.getenv("IDEMPOTENCY_KEY_TTL", str(24 * 60 * 60)))
+
+# How POST/PUT requests to /ema-records/ are applied. "sync" saves the record within the request,
+# "queue" only validates it and appends it to the ingest queue, which the `ingest_worker` command applies in batches.
+INGEST_MODE = os.getenv("INGEST_MODE", "sync").lower()
+
+# Queue of EMA records to apply in the "queue" ingest mode. A Redis URL for a Redis stream,
+# or "sqlite:///<path>" for a SQLite file, e.g. for local development without Redis.
+INGEST_QUEUE_URL = os.getenv("INGEST_QUEUE_URL") or f"redis://{os.getenv('REDIS_SERVICE_HOST')}:6379/2"
+INGEST_QUEUE_NAME = "ema-record-ingest"
+
+# Seconds after which queued EMA records claimed by a worker that did not apply them are applied by another worker
+INGEST_QUEUE_CLAIM_TIMEOUT = float(os.getenv("INGEST_QUEUE_CLAIM_TIMEOUT", "60"))
+
+# Number of times a queued EMA record is delivered to workers before it is moved to the dead letters of the queue
+INGEST_QUEUE_MAX_DELIVERIES = int(os.getenv("INGEST_QUEUE_MAX_DELIVERIES", "5"))
+
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -167,7 +274,7 @@ REST_FRAMEWORK = {
 
 API_KEY_CUSTOM_HEADER = "HTTP_X_API_KEY" # Request header should have "X-API-KEY" key
 
-CORS_ALLOW_HEADERS = (*default_headers, 'x-api-key')
+CORS_ALLOW_HEADERS = (*default_headers, 'x-api-key', 'x-profile')
 
 def _parse_validity_period(period: Union[str, int]) -> int:
     """
@@ -182,6 +289,67 @@ def _parse_validity_period(period: Union[str, int]) -> int:
 
 PASSWORD_RESET_TOKEN_VALIDITY_PERIOD = _parse_validity_period(os.getenv("PASSWORD_RESET_TOKEN_VALIDITY_PERIOD"))
 
+# Number of seconds after which the in-memory currency search index is rebuilt,
+# so that changes made by other processes are picked up
+CURRENCY_SEARCH_INDEX_TTL = int(os.getenv("CURRENCY_SEARCH_INDEX_TTL", 300))
+
+# Number of seconds the currency categories are kept in the shared cache. Bounds how long
+# stale categories are served if an invalidation is lost
+CURRENCY_CATEGORIES_CACHE_TTL = int(os.getenv("CURRENCY_CATEGORIES_CACHE_TTL", 3600))
+
+# Dotted path to the `helpers.tracing.SpanExporter` subclass that write traces are exported to,
+# and the keyword arguments it is instantiated with. Tracing is disabled if not set
+TRACING_EXPORTER = os.getenv("TRACING_EXPORTER") or None
+
+TRACING_EXPORTER_OPTIONS = {"path": os.getenv("TRACING_EXPORTER_FILE_PATH")} if os.getenv("TRACING_EXPORTER_FILE_PATH") else {}
+
+# Whether to add the time a message is sent (`server_ts`, milliseconds since the epoch)
+# and the trace id of the write (`trace_id`) to websocket messages, so that clients can measure lag
+WEBSOCKET_INCLUDE_SERVER_TIMESTAMP = os.getenv("WEBSOCKET_INCLUDE_SERVER_TIMESTAMP", "false").lower() == "true"
+
+# Source of the websocket events of EMA record changes. "signals" sends them from model signals of the
+# process making the change. "database" sends them from the `ema_change_feed` command, which listens for
+# changes committed to PostgreSQL, including bulk writes, raw SQL and writes by other services.
+WEBSOCKET_EVENT_SOURCE = os.getenv("WEBSOCKET_EVENT_SOURCE", "signals").lower()
+
+# Seconds between heartbeat comments sent on idle EMA record event streams (/api/v1/ema-records/events/),
+# so that proxies do not close them
+SSE_HEARTBEAT_INTERVAL = float(os.getenv("SSE_HEARTBEAT_INTERVAL", 15))
+
+# Number of recent EMA record events, and the seconds each is kept for, that event stream clients can resume
+# from with the "Last-Event-ID" header. Events are kept in the shared cache. Set to 0 to disable resuming.
+SSE_REPLAY_EVENTS = int(os.getenv("SSE_REPLAY_EVENTS", 1000))
+
+SSE_REPLAY_TTL = int(os.getenv("SSE_REPLAY_TTL", 300))
+
+# Seconds tombstones of deleted EMA records are kept for clients syncing changes (/api/v1/ema-records/changes/),
+# once pruned by the `prune_ema_record_tombstones` command. Clients that last synced before are asked to sync again.
+EMA_RECORD_TOMBSTONE_RETENTION = int(os.getenv("EMA_RECORD_TOMBSTONE_RETENTION", 7 * 24 * 60 * 60))
+
+# Directory profiles of views are written to. Profiling is disabled if not set
+PROFILING_DIR = os.getenv("PROFILING_DIR") or None
+
+# Fraction of requests that are profiled, in addition to those requested by staff users with the "X-Profile" header
+PROFILING_SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", 0))
+
+# The default profiling mode. "cprofile" or "sample"
+PROFILING_MODE = os.getenv("PROFILING_MODE", "cprofile")
+
+# Limits on the number and total size of files kept in `PROFILING_DIR`. The oldest files are deleted first
+PROFILING_MAX_FILES = int(os.getenv("PROFILING_MAX_FILES", 200))
+
+PROFILING_MAX_BYTES = int(os.getenv("PROFILING_MAX_BYTES", 100 * 1024 * 1024))
+
+# File that queries slower than `SLOW_QUERY_THRESHOLD_MS` milliseconds are logged to. 
+# Slow queries are not logged if not set. Use the `slow_queries` command to summarize the log
+SLOW_QUERY_LOG_PATH = os.getenv("SLOW_QUERY_LOG_PATH") or None
+
+SLOW_QUERY_THRESHOLD_MS = float(os.getenv("SLOW_QUERY_THRESHOLD_MS", 200))
+
+# Fraction of slow SELECT queries whose execution plan is captured with `EXPLAIN (ANALYZE, BUFFERS)`.
+# The query is executed again to capture the plan
+SLOW_QUERY_EXPLAIN_SAMPLE_RATE = float(os.getenv("SLOW_QUERY_EXPLAIN_SAMPLE_RATE", 0.1))
+
 CORS_ALLOW_ALL_ORIGINS = True
 
 CSRF_TRUSTED_ORIGINS = ["https://*.emascreener.bloombyte.dev", "http://*"]
@@ -0,0 +1,24 @@
+"""
+Settings for running the test suite.
+
+Tests use the benchmark settings: an in-memory SQLite database by default, created from the
+current models, the in-memory channel layer and local memory caches, so neither PostgreSQL nor
+Redis is required. Set `BENCHMARK_DATABASE` to "postgres" to run the tests against PostgreSQL.
+
+```bash
+python manage.py test --settings=ema_screener.test_settings
+```
+"""
+from benchmarks.settings import *
+
+
+EMAIL_BACKEND = "django.core.mail.backends.locmem.EmailBackend"
+
+PASSWORD_RESET_URL = "http://testserver/reset-password"
+
+# Second database, for testing routing of reads to replicas. Tests that use it
+# enable routing with `override_settings(REPLICA_DATABASES=["replica"])`.
+DATABASES["replica"] = {
+    "ENGINE": "django.db.backends.sqlite3",
+    "NAME": ":memory:",
+}
@@ -3,10 +3,13 @@ from django.conf import settings
 from django.conf.urls.static import static
 from django.urls import path, include
 
+from api.views import metrics_api_view
+
 
 urlpatterns = [
     path('admin/', admin.site.urls),
-    path('api/v1/', include("api.urls", namespace="api"))
+    path('api/v1/', include("api.urls", namespace="api")),
+    path('metrics', metrics_api_view, name="metrics"),
 ]
 
 urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
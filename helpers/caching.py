@@ -0,0 +1,88 @@
+from typing import Any, Callable, Optional
+from django.core.cache import caches
+
+from .logging import log_exception
+
+
+class TwoTierCache:
+    """
+    Caches a value in process local memory and in a shared cache (e.g. Redis).
+
+    Reads are served from local memory when possible, then from the shared cache, and the
+    value is only computed when both miss. Local entries expire after `local_timeout` seconds,
+    which bounds how long other processes may serve a value after it is invalidated. Shared entries
+    expire after `shared_timeout` seconds, which bounds how long a value survives a lost invalidation,
+    e.g. while the shared cache was unavailable.
+
+    If the shared cache is unavailable, the value is computed instead of failing.
+
+    Example:
+    ```python
+    categories_cache = TwoTierCache("currency:categories")
+    categories = categories_cache.get_or_set(compute_categories)
+    # Once a change is committed
+    transaction.on_commit(categories_cache.invalidate)
+    ```
+    """
+    def __init__(
+        self,
+        key: str,
+        local_timeout: Optional[int] = 30,
+        shared_timeout: Optional[int] = 3600,
+        local_alias: str = "local",
+        shared_alias: str = "default",
+    ) -> None:
+        """
+        Create a new two tier cache
+
+        :param key: The cache key of the value
+        :param local_timeout: Number of seconds the value is kept in local memory
+        :param shared_timeout: Number of seconds the value is kept in the shared cache. None means forever, which is
+        not recommended, as a value that failed to be invalidated would then be served until it is invalidated again.
+        :param local_alias: Alias of the local memory cache in `settings.CACHES`
+        :param shared_alias: Alias of the shared cache in `settings.CACHES`
+        """
+        self.key = key
+        self.local_timeout = local_timeout
+        self.shared_timeout = shared_timeout
+        self.local_alias = local_alias
+        self.shared_alias = shared_alias
+
+
+    def get_or_set(self, compute: Callable[[], Any]) -> Any:
+        """
+        Get the cached value, computing and caching it on a miss
+
+        :param compute: Function that computes the value
+        :return: The cached or computed value
+        """
+        local_cache = caches[self.local_alias]
+        value = local_cache.get(self.key)
+        if value is not None:
+            return value
+
+        try:
+            value = caches[self.shared_alias].get(self.key)
+        except Exception as exc:
+            log_exception(exc)
+            value = None
+
+        if value is None:
+            value = compute()
+            try:
+                caches[self.shared_alias].set(self.key, value, timeout=self.shared_timeout)
+            except Exception as exc:
+                log_exception(exc)
+
+        local_cache.set(self.key, value, timeout=self.local_timeout)
+        return value
+
+
+    def invalidate(self) -> None:
+        """Remove the value from both cache tiers"""
+        caches[self.local_alias].delete(self.key)
+        try:
+            caches[self.shared_alias].delete(self.key)
+        except Exception as exc:
+            log_exception(exc)
+        return None
@@ -0,0 +1,211 @@
+import collections
+import threading
+import time
+from typing import Any, Callable, Deque, Dict, Optional
+
+from .logging import log_exception
+from .metrics import db_pool_connections, db_pool_timeouts_total, db_pool_wait_seconds
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection of a pool becomes available in time"""
+
+
+
+class _PooledConnection:
+    """A connection of a pool, with the times it was created and last returned to the pool"""
+    __slots__ = ("connection", "created_at", "returned_at")
+
+    def __init__(self, connection: Any) -> None:
+        self.connection = connection
+        self.created_at = time.monotonic()
+        self.returned_at = self.created_at
+
+
+
+class ConnectionPool:
+    """
+    Bounded, thread safe pool of DB-API connections.
+
+    At most `max_size` connections are open at a time. When all of them are in use, `getconn` waits
+    up to `timeout` seconds for one to be returned. Connections are handed out last in, first out,
+    so that idle connections beyond what the load needs age out and are closed.
+
+    Connections are checked before they are handed out. Connections that are closed, older than
+    `max_lifetime` or idle for longer than `max_idle` seconds are discarded, and connections idle
+    for longer than `check_idle` seconds are pinged first.
+    """
+
+    def __init__(
+        self,
+        alias: str,
+        max_size: int = 10,
+        timeout: float = 30.0,
+        max_lifetime: float = 3600.0,
+        max_idle: float = 600.0,
+        check_idle: float = 30.0,
+    ) -> None:
+        """
+        :param alias: Name of the pool, used as metric label, e.g. the database alias
+        :param max_size: Maximum number of open connections
+        :param timeout: Seconds to wait for a connection before raising `PoolTimeout`
+        :param max_lifetime: Seconds after which connections are closed instead of reused
+        :param max_idle: Seconds after which idle connections are closed instead of reused
+        :param check_idle: Seconds after which idle connections are pinged before they are reused
+        """
+        self.alias = alias
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.max_idle = max_idle
+        self.check_idle = check_idle
+        self._condition = threading.Condition()
+        self._idle: Deque[_PooledConnection] = collections.deque()
+        self._in_use: Dict[int, _PooledConnection] = {}
+        # Number of open connections, including connections being opened
+        self._size = 0
+
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+
+    @property
+    def idle(self) -> int:
+        return len(self._idle)
+
+
+    def _reserve(self) -> Optional[_PooledConnection]:
+        """
+        Wait for an idle connection or for room to open a new one.
+
+        :return: An idle connection, or None if room for a new connection was reserved
+        """
+        start = time.monotonic()
+        deadline = start + self.timeout
+        with self._condition:
+            try:
+                while True:
+                    if self._idle:
+                        return self._idle.pop()
+                    if self._size < self.max_size:
+                        self._size += 1
+                        return None
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        db_pool_timeouts_total.labels(self.alias).inc()
+                        raise PoolTimeout(
+                            f"No connection of the '{self.alias}' pool became available within {self.timeout}s. "
+                            f"All {self.max_size} connections are in use."
+                        )
+                    self._condition.wait(remaining)
+            finally:
+                db_pool_wait_seconds.labels(self.alias).observe(time.monotonic() - start)
+
+
+    def _is_usable(self, pooled: _PooledConnection) -> bool:
+        """Whether an idle connection can be handed out"""
+        now = time.monotonic()
+        if getattr(pooled.connection, "closed", False):
+            return False
+        if now - pooled.created_at > self.max_lifetime or now - pooled.returned_at > self.max_idle:
+            return False
+        if now - pooled.returned_at > self.check_idle:
+            try:
+                with pooled.connection.cursor() as cursor:
+                    cursor.execute("SELECT 1")
+                # Do not leave the ping's transaction open
+                pooled.connection.rollback()
+            except Exception:
+                return False
+        return True
+
+
+    def getconn(self, connect: Callable[[], Any]) -> Any:
+        """
+        Returns a connection from the pool, opening a new one with `connect` if there is room.
+
+        :param connect: Callable that opens a new connection
+        :raises PoolTimeout: If no connection becomes available within `timeout` seconds
+        """
+        while True:
+            pooled = self._reserve()
+            if pooled is None:
+                try:
+                    pooled = _PooledConnection(connect())
+                except BaseException:
+                    self._release_slot()
+                    raise
+                break
+            if self._is_usable(pooled):
+                break
+            self._discard(pooled)
+
+        with self._condition:
+            self._in_use[id(pooled.connection)] = pooled
+            self._update_gauges()
+        return pooled.connection
+
+
+    def putconn(self, connection: Any, discard: bool = False) -> None:
+        """
+        Return a connection to the pool.
+
+        :param connection: A connection returned by `getconn`
+        :param discard: Close the connection instead of keeping it, e.g. if it is broken
+        """
+        with self._condition:
+            pooled = self._in_use.pop(id(connection), None)
+        if pooled is None:
+            # Not a connection of this pool
+            self._close(connection)
+            return
+
+        if discard or getattr(connection, "closed", False) or time.monotonic() - pooled.created_at > self.max_lifetime:
+            self._discard(pooled)
+            return
+
+        pooled.returned_at = time.monotonic()
+        with self._condition:
+            self._idle.append(pooled)
+            self._update_gauges()
+            self._condition.notify()
+        return None
+
+
+    def close(self) -> None:
+        """Close all idle connections. Connections in use are closed when they are returned."""
+        with self._condition:
+            idle, self._idle = self._idle, collections.deque()
+        for pooled in idle:
+            self._discard(pooled)
+        return None
+
+
+    def _close(self, connection: Any) -> None:
+        try:
+            connection.close()
+        except Exception as exc:
+            log_exception(exc)
+        return None
+
+
+    def _discard(self, pooled: _PooledConnection) -> None:
+        self._close(pooled.connection)
+        self._release_slot()
+        return None
+
+
+    def _release_slot(self) -> None:
+        with self._condition:
+            self._size -= 1
+            self._update_gauges()
+            self._condition.notify()
+        return None
+
+
+    def _update_gauges(self) -> None:
+        db_pool_connections.labels(self.alias, "idle").set(len(self._idle))
+        db_pool_connections.labels(self.alias, "in_use").set(len(self._in_use))
+        return None
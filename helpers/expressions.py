@@ -0,0 +1,209 @@
+import ast
+import re
+from typing import Callable, Collection, Mapping, Tuple
+from django.db import models
+from django.db.models import lookups
+from django.db.models.functions import NullIf
+
+
+class ExpressionError(ValueError):
+    """Error raised when an expression is invalid or not allowed"""
+    pass
+
+
+
+# Types of the operands of comparisons
+BOOLEAN = "boolean"
+NUMBER = "number"
+TEXT = "text"
+
+
+
+class ExpressionCompiler:
+    """
+    Compiles filter expressions into `django.db.models.Q` objects.
+
+    Expressions are parsed with Python's `ast` module, but only a whitelisted subset of the
+    grammar is accepted:
+    - Comparisons: `>`, `>=`, `<`, `<=`, `=` (or `==`) and `!=`, including chained comparisons
+    - Boolean operators: `and`, `or` and `not`
+    - Arithmetic operators: `+`, `-`, `*` and `/`
+    - Numbers, `true`/`false` and the names provided to the compiler
+
+    Everything else, like function calls and attribute access, is rejected. The compiled
+    filter is evaluated entirely by the database. Numbers are always floats, so that `1/2` is 0.5,
+    and divisions by zero evaluate to NULL, so that they match nothing instead of failing.
+    Boolean names and `true`/`false` can only be used as conditions and in comparisons, not in arithmetic.
+
+    Each operand of a comparison is a boolean, a number or a text, and only operands of the same type
+    can be compared, as PostgreSQL cannot compare e.g. a boolean with a number. Booleans can only be
+    compared with `=` and `!=`.
+
+    Example:
+    ```python
+    compiler = ExpressionCompiler({"close": lambda: models.F("close"), "ema50": lambda: models.F("ema50")})
+    q = compiler.compile("close > ema50 * 1.02")
+    ```
+    """
+    max_length = 500
+    """Maximum length of an expression"""
+    max_nodes = 100
+    """Maximum number of syntax tree nodes in an expression"""
+
+    comparison_lookups = {
+        ast.Gt: lookups.GreaterThan,
+        ast.GtE: lookups.GreaterThanOrEqual,
+        ast.Lt: lookups.LessThan,
+        ast.LtE: lookups.LessThanOrEqual,
+        ast.Eq: lookups.Exact,
+    }
+    arithmetic_operators = {
+        ast.Add: lambda lhs, rhs: lhs + rhs,
+        ast.Sub: lambda lhs, rhs: lhs - rhs,
+        ast.Mult: lambda lhs, rhs: lhs * rhs,
+        # Division by zero is an error in PostgreSQL
+        ast.Div: lambda lhs, rhs: lhs / NullIf(rhs, models.Value(0.0), output_field=models.FloatField()),
+    }
+
+    def __init__(
+        self,
+        names: Mapping[str, Callable[[], models.Expression]],
+        boolean_names: Collection[str] = (),
+        text_names: Collection[str] = ()
+    ) -> None:
+        """
+        Create a new expression compiler
+
+        :param names: Mapping of names allowed in expressions to functions
+        returning the database expression for the name.
+        :param boolean_names: Names whose values are booleans. Only these names can be used as conditions on their own.
+        :param text_names: Names whose values are texts. Other names are numbers.
+        """
+        self.names = names
+        self.boolean_names = frozenset(boolean_names)
+        self.text_names = frozenset(text_names)
+
+
+    def normalize(self, text: str) -> str:
+        """Converts the expression text to valid Python syntax"""
+        # Allow single "=" for equality
+        text = re.sub(r"(?<![<>!=])=(?!=)", "==", text)
+        # Allow boolean operators and constants in any case
+        return re.sub(
+            r"\b(and|or|not|true|false)\b",
+            lambda match: match.group(0).lower() if match.group(0).lower() in ("and", "or", "not") else match.group(0).capitalize(),
+            text,
+            flags=re.IGNORECASE
+        )
+
+
+    def compile(self, text: str) -> models.Q:
+        """
+        Compile an expression into a Q object
+
+        :param text: The expression text
+        :return: Q object representing the expression
+        :raises ExpressionError: If the expression is invalid or not allowed
+        """
+        text = text.strip()
+        if not text:
+            raise ExpressionError("Expression cannot be empty")
+        if len(text) > self.max_length:
+            raise ExpressionError(f"Expression cannot be longer than {self.max_length} characters")
+        try:
+            tree = ast.parse(self.normalize(text), mode="eval")
+        except SyntaxError:
+            raise ExpressionError(f"Invalid expression '{text}'")
+        if sum(1 for _ in ast.walk(tree)) > self.max_nodes:
+            raise ExpressionError("Expression is too complex")
+        return self.compile_condition(tree.body)
+
+
+    def compile_condition(self, node: ast.AST) -> models.Q:
+        """Compile a node that evaluates to a boolean into a Q object"""
+        if isinstance(node, ast.BoolOp):
+            connector = models.Q.AND if isinstance(node.op, ast.And) else models.Q.OR
+            q = models.Q()
+            for value in node.values:
+                q.add(self.compile_condition(value), connector)
+            return q
+
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+            # The operand is checked by `compile_condition`, e.g. `not close` is rejected
+            return ~self.compile_condition(node.operand)
+
+        if isinstance(node, ast.Compare):
+            q = models.Q()
+            lhs = node.left
+            for op, rhs in zip(node.ops, node.comparators):
+                if not isinstance(op, ast.NotEq) and type(op) not in self.comparison_lookups:
+                    raise ExpressionError("Unsupported comparison operator")
+                lhs_value, lhs_type = self.compile_operand(lhs)
+                rhs_value, rhs_type = self.compile_operand(rhs)
+                if lhs_type != rhs_type:
+                    raise ExpressionError(f"A {lhs_type} cannot be compared with a {rhs_type}")
+                if lhs_type == BOOLEAN and not isinstance(op, (ast.Eq, ast.NotEq)):
+                    raise ExpressionError("Booleans can only be compared with = and !=")
+
+                if isinstance(op, ast.NotEq):
+                    q.add(~models.Q(lookups.Exact(lhs_value, rhs_value)), models.Q.AND)
+                else:
+                    q.add(models.Q(self.comparison_lookups[type(op)](lhs_value, rhs_value)), models.Q.AND)
+                lhs = rhs
+            return q
+
+        if isinstance(node, ast.Name) and node.id in self.boolean_names:
+            # A boolean name on its own is considered true if the value is true
+            return models.Q(lookups.Exact(self.compile_value(node), True))
+        if isinstance(node, ast.Name) and node.id in self.names:
+            raise ExpressionError(f"'{node.id}' is not a condition, compare it to a value instead")
+        raise ExpressionError("Expression must be a comparison or a combination of comparisons")
+
+
+    def compile_operand(self, node: ast.AST) -> Tuple[models.Expression, str]:
+        """
+        Compile an operand of a comparison into a database expression
+
+        :return: The expression and the type of the operand: `BOOLEAN`, `NUMBER` or `TEXT`
+        """
+        if isinstance(node, ast.Name) and node.id in self.boolean_names:
+            return self.compile_value(node), BOOLEAN
+        if isinstance(node, ast.Name) and node.id in self.text_names:
+            return self.compile_value(node), TEXT
+        if isinstance(node, ast.Constant) and type(node.value) is bool:
+            return self.compile_value(node), BOOLEAN
+        return self.compile_number(node), NUMBER
+
+
+    def compile_value(self, node: ast.AST) -> models.Expression:
+        """Compile a node that evaluates to a value into a database expression"""
+        if isinstance(node, ast.Name):
+            if node.id not in self.names:
+                raise ExpressionError(f"Unknown name '{node.id}'")
+            return self.names[node.id]()
+
+        if isinstance(node, ast.Constant) and type(node.value) is bool:
+            return models.Value(node.value)
+        return self.compile_number(node)
+
+
+    def compile_number(self, node: ast.AST) -> models.Expression:
+        """Compile a node that evaluates to a number, e.g. an operand of an arithmetic operator, into a database expression"""
+        if isinstance(node, ast.Name):
+            if node.id in self.boolean_names or node.id in self.text_names:
+                raise ExpressionError(f"'{node.id}' is not a number")
+            return self.compile_value(node)
+
+        if isinstance(node, ast.Constant) and type(node.value) in (int, float):
+            # Integer constants would make the database use integer division
+            return models.Value(float(node.value))
+
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+            operand = self.compile_number(node.operand)
+            return operand if isinstance(node.op, ast.UAdd) else operand * models.Value(-1.0)
+
+        if isinstance(node, ast.BinOp) and type(node.op) in self.arithmetic_operators:
+            return self.arithmetic_operators[type(node.op)](self.compile_number(node.left), self.compile_number(node.right))
+        if isinstance(node, ast.Constant) and type(node.value) is bool:
+            raise ExpressionError("true and false cannot be used in arithmetic")
+        raise ExpressionError("Unsupported value in expression")
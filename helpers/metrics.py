@@ -0,0 +1,340 @@
+import contextlib
+import contextvars
+import dataclasses
+import logging
+import os
+import time
+from typing import Any, Callable, Iterator, Optional
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+)
+from channels.exceptions import ChannelFull
+from channels.layers import InMemoryChannelLayer
+from rest_framework import serializers
+
+
+# Metrics are aggregated across worker processes when the
+# `PROMETHEUS_MULTIPROC_DIR` environment variable is set to a shared directory.
+# The directory should be emptied before the workers are started.
+METRICS_CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200)
+QUEUE_DEPTH_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+http_requests_total = Counter(
+    "http_requests_total",
+    "Total number of HTTP requests",
+    ["view", "method", "status"]
+)
+http_request_duration_seconds = Histogram(
+    "http_request_duration_seconds",
+    "Total HTTP request latency",
+    ["view", "method"],
+    buckets=LATENCY_BUCKETS
+)
+http_request_db_queries = Histogram(
+    "http_request_db_queries",
+    "Number of database queries per HTTP request",
+    ["view", "method"],
+    buckets=QUERY_COUNT_BUCKETS
+)
+http_request_db_duration_seconds = Histogram(
+    "http_request_db_duration_seconds",
+    "Time spent executing database queries per HTTP request",
+    ["view", "method"],
+    buckets=LATENCY_BUCKETS
+)
+http_request_serializer_duration_seconds = Histogram(
+    "http_request_serializer_duration_seconds",
+    "Time spent in serializers (validation and representation) per HTTP request",
+    ["view", "method"],
+    buckets=LATENCY_BUCKETS
+)
+http_request_render_duration_seconds = Histogram(
+    "http_request_render_duration_seconds",
+    "Time spent rendering responses per HTTP request",
+    ["view", "method"],
+    buckets=LATENCY_BUCKETS
+)
+
+# Websocket metrics. Gauges are summed across the live worker processes of a node.
+websocket_connections = Gauge(
+    "websocket_connections",
+    "Number of connected websockets",
+    multiprocess_mode="livesum"
+)
+websocket_group_members = Gauge(
+    "websocket_group_members",
+    "Number of channels in a channel layer group",
+    ["group"],
+    multiprocess_mode="livesum"
+)
+websocket_group_send_duration_seconds = Histogram(
+    "websocket_group_send_duration_seconds",
+    "Latency of channel layer group sends",
+    ["group"],
+    buckets=LATENCY_BUCKETS
+)
+websocket_messages_sent_total = Counter(
+    "websocket_messages_sent_total",
+    "Total number of messages sent to websocket clients",
+)
+websocket_messages_dropped_total = Counter(
+    "websocket_messages_dropped_total",
+    "Total number of messages that could not be sent to websocket clients, by reason (channel_full, group_send_error or send_error)",
+    ["reason"]
+)
+websocket_send_queue_depth = Histogram(
+    "websocket_send_queue_depth",
+    "Number of messages waiting in a connection's channel queue, sampled on each send",
+    buckets=QUEUE_DEPTH_BUCKETS
+)
+
+# Event stream (SSE) metrics
+sse_streams = Gauge(
+    "sse_streams",
+    "Number of open EMA record event streams",
+    multiprocess_mode="livesum"
+)
+sse_events_sent_total = Counter(
+    "sse_events_sent_total",
+    "Total number of events sent on EMA record event streams, including replayed events",
+)
+
+# Database connection pool metrics
+db_pool_wait_seconds = Histogram(
+    "db_pool_wait_seconds",
+    "Time spent waiting for a connection of the database connection pool",
+    ["alias"],
+    buckets=LATENCY_BUCKETS
+)
+db_pool_connections = Gauge(
+    "db_pool_connections",
+    "Number of open connections of the database connection pool, by state (idle or in_use)",
+    ["alias", "state"],
+    multiprocess_mode="livesum"
+)
+db_pool_timeouts_total = Counter(
+    "db_pool_timeouts_total",
+    "Total number of times no connection of the database connection pool became available in time",
+    ["alias"]
+)
+
+# Read replica metrics
+db_replica_lag_seconds = Gauge(
+    "db_replica_lag_seconds",
+    "Replication lag of a read replica, as last checked by the replica router",
+    ["alias"],
+    multiprocess_mode="max"
+)
+db_reads_total = Counter(
+    "db_reads_total",
+    "Total number of requests eligible for read replicas, by the database their reads were routed to",
+    ["alias"]
+)
+
+# Ingest metrics
+ema_record_unchanged_writes_total = Counter(
+    "ema_record_unchanged_writes_total",
+    "Total number of EMA record writes skipped because the record would not have changed"
+)
+idempotent_replays_total = Counter(
+    "idempotent_replays_total",
+    "Total number of requests answered from the result of an earlier request with the same idempotency key",
+    ["view"]
+)
+ingest_entries_total = Counter(
+    "ingest_entries_total",
+    "Total number of queued EMA records applied by ingest workers, by outcome (created, updated, unchanged, superseded, stale, rejected or dead_lettered)",
+    ["outcome"]
+)
+ingest_batch_duration_seconds = Histogram(
+    "ingest_batch_duration_seconds",
+    "Time taken by an ingest worker to apply a batch of queued EMA records",
+    buckets=LATENCY_BUCKETS
+)
+ingest_queue_lag_seconds = Gauge(
+    "ingest_queue_lag_seconds",
+    "Age of the oldest queued EMA record not yet applied, as last measured by an ingest worker",
+    multiprocess_mode="livemax"
+)
+
+# Change feed metrics
+change_feed_delay_seconds = Histogram(
+    "change_feed_delay_seconds",
+    "Time from an EMA record change being written to the database to its websocket event being sent by the change feed",
+    buckets=LATENCY_BUCKETS
+)
+change_feed_events_total = Counter(
+    "change_feed_events_total",
+    "Total number of websocket events sent by the change feed, by code",
+    ["code"]
+)
+
+
+def get_channel_queue_depth(channel_layer: Any, channel_name: str) -> int:
+    """
+    Returns the number of messages waiting in the local receive queue of a channel.
+
+    Supports `channels.layers.InMemoryChannelLayer`, `channels_redis.core.RedisChannelLayer`
+    and `channels_redis.pubsub.RedisPubSubChannelLayer`. Returns 0 for other channel layers.
+    """
+    # In memory and Redis pub/sub channel layers
+    queue = getattr(channel_layer, "channels", {}).get(channel_name)
+    if queue is None:
+        # Redis channel layer
+        queue = getattr(channel_layer, "receive_buffer", {}).get(channel_name)
+    return queue.qsize() if queue is not None else 0
+
+
+# Logged by `channels_redis.core.RedisChannelLayer.group_send` with the number of channels of the group
+# that were at capacity, which do not receive the message. The drops are not otherwise reported to the sender.
+CHANNELS_REDIS_OVER_CAPACITY_MESSAGE = "%s of %s channels over capacity in group %s"
+
+
+class ChannelCapacityDropCounter(logging.Handler):
+    """
+    Log handler that counts the messages dropped by the Redis channel layer because the
+    receiving channels were at capacity, as "channel_full" drops of `websocket_messages_dropped_total`.
+    """
+    def emit(self, record: logging.LogRecord) -> None:
+        if record.msg != CHANNELS_REDIS_OVER_CAPACITY_MESSAGE or not record.args:
+            return
+        try:
+            dropped = int(float(record.args[0]))
+        except (TypeError, ValueError):
+            return
+        if dropped > 0:
+            websocket_messages_dropped_total.labels("channel_full").inc(dropped)
+
+
+def install_channel_capacity_drop_counter() -> None:
+    """Install `ChannelCapacityDropCounter` on the logger of the Redis channel layer"""
+    logger = logging.getLogger("channels_redis.core")
+    if any(isinstance(handler, ChannelCapacityDropCounter) for handler in logger.handlers):
+        return None
+    logger.addHandler(ChannelCapacityDropCounter())
+    # The drops are logged at the INFO level
+    if logger.getEffectiveLevel() > logging.INFO:
+        logger.setLevel(logging.INFO)
+    return None
+
+
+
+class MeteredInMemoryChannelLayer(InMemoryChannelLayer):
+    """
+    In-memory channel layer that counts the messages of group sends dropped because the
+    receiving channels were at capacity, as "channel_full" drops of `websocket_messages_dropped_total`.
+    """
+    async def group_send(self, group: str, message: dict) -> None:
+        assert isinstance(message, dict), "Message is not a dict"
+        assert self.valid_group_name(group), "Invalid group name"
+        self._clean_expired()
+        for channel in self.groups.get(group, set()):
+            try:
+                await self.send(channel, message)
+            except ChannelFull:
+                websocket_messages_dropped_total.labels("channel_full").inc()
+
+
+
+@dataclasses.dataclass
+class RequestMetrics:
+    """Accumulates timings of the current request"""
+    db_queries: int = 0
+    db_duration: float = 0.0
+    serializer_duration: float = 0.0
+    render_duration: float = 0.0
+
+
+current_request_metrics: contextvars.ContextVar[Optional[RequestMetrics]] = contextvars.ContextVar(
+    "current_request_metrics", default=None
+)
+
+
+def track_query(execute: Callable, sql: str, params: Any, many: bool, context: dict) -> Any:
+    """
+    Database execute wrapper that records the number and duration of
+    queries executed during the current request, if any.
+    """
+    metrics = current_request_metrics.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.db_duration += time.perf_counter() - start
+        metrics.db_queries += 1
+
+
+def install_query_tracker(sender: Any, connection: Any, **kwargs: Any) -> None:
+    """
+    `connection_created` signal receiver that installs `track_query` on new database connections
+
+    The wrapper is installed on every connection, including those used by async ORM
+    calls, and only records queries made while a request is being tracked.
+    """
+    if track_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(track_query)
+    return None
+
+
+@contextlib.contextmanager
+def track_serialization() -> Iterator[None]:
+    """Context manager that adds the time spent in the block to the current request's serializer time"""
+    metrics = current_request_metrics.get()
+    if metrics is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.serializer_duration += time.perf_counter() - start
+
+
+
+class InstrumentedSerializerMixin:
+    """
+    Serializer mixin that records the time spent validating and representing data
+    as serializer time of the current request.
+
+    Only top level serializers, and the items of top level list serializers, are timed,
+    so that time spent in nested serializers is not counted twice.
+    """
+    def _is_top_level(self) -> bool:
+        parent = self.parent
+        return parent is None or (isinstance(parent, serializers.ListSerializer) and parent.parent is None)
+
+
+    def to_representation(self, instance: Any) -> Any:
+        if not self._is_top_level():
+            return super().to_representation(instance)
+        with track_serialization():
+            return super().to_representation(instance)
+
+
+    def run_validation(self, data: Any = serializers.empty) -> Any:
+        if not self._is_top_level():
+            return super().run_validation(data)
+        with track_serialization():
+            return super().run_validation(data)
+
+
+
+def get_metrics_registry() -> CollectorRegistry:
+    """Returns the registry to collect metrics from, aggregating all worker processes if enabled"""
+    if not os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def render_metrics() -> bytes:
+    """Render all metrics in Prometheus text format"""
+    return generate_latest(get_metrics_registry())
@@ -0,0 +1,103 @@
+"""
+PostgreSQL database backend with an in-process connection pool.
+
+Use "helpers.postgresql_pool" as the `ENGINE` of a database and configure the pool with the
+"pool" key of its `OPTIONS`, a dict of `helpers.db_pool.ConnectionPool` arguments:
+
+```python
+DATABASES = {
+    "default": {
+        "ENGINE": "helpers.postgresql_pool",
+        ...
+        "CONN_MAX_AGE": 0,
+        "OPTIONS": {
+            "pool": {"max_size": 10, "timeout": 30},
+        },
+    }
+}
+```
+
+Django closes the connection of a thread at the end of each request (with `CONN_MAX_AGE = 0`),
+which returns it to the pool instead. The pool is shared by all threads of the process, so sync
+views and the threads async ORM calls run in reuse the same bounded set of connections.
+"""
+import threading
+from typing import Any, Dict, Tuple
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.postgresql.base import DatabaseWrapper as PostgreSQLDatabaseWrapper
+from django.utils.asyncio import async_unsafe
+
+from helpers.db_pool import ConnectionPool
+
+
+# Transaction status values of psycopg2 and psycopg connections
+TRANSACTION_STATUS_IDLE = 0
+TRANSACTION_STATUS_UNKNOWN = 4
+
+# Pools by database alias and connection parameters, e.g. so that the
+# test database does not reuse connections to the main database
+_pools: Dict[Tuple[str, str], ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+
+class DatabaseWrapper(PostgreSQLDatabaseWrapper):
+    """PostgreSQL database wrapper that takes connections from a pool shared by all threads"""
+
+    def __init__(self, settings_dict: Dict[str, Any], alias: str = "default") -> None:
+        super().__init__(settings_dict, alias)
+        if settings_dict.get("CONN_MAX_AGE"):
+            raise ImproperlyConfigured(
+                "Persistent connections (CONN_MAX_AGE) cannot be used with pooled connections. "
+                "Set CONN_MAX_AGE to 0 so that connections are returned to the pool after each request."
+            )
+
+
+    def get_connection_params(self) -> Dict[str, Any]:
+        conn_params = super().get_connection_params()
+        conn_params.pop("pool", None)
+        return conn_params
+
+
+    def get_pool(self, conn_params: Dict[str, Any]) -> ConnectionPool:
+        """Returns the pool of connections with the given parameters, creating it if necessary"""
+        key = (self.alias, repr(sorted(conn_params.items())))
+        pool = _pools.get(key)
+        if pool is not None:
+            return pool
+        with _pools_lock:
+            if key not in _pools:
+                options = self.settings_dict["OPTIONS"].get("pool") or {}
+                _pools[key] = ConnectionPool(self.alias, **options)
+            return _pools[key]
+
+
+    @async_unsafe
+    def get_new_connection(self, conn_params: Dict[str, Any]) -> Any:
+        self.pool = self.get_pool(conn_params)
+        return self.pool.getconn(lambda: super(DatabaseWrapper, self).get_new_connection(conn_params))
+
+
+    def _close(self) -> None:
+        connection = self.connection
+        if connection is None:
+            return
+        
+        # Connections closed inside an atomic block, e.g. by a failed health check, are discarded.
+        # Django still considers the transaction open, and the connection should not be reused by another thread.
+        if self.in_atomic_block:
+            self.pool.putconn(connection, discard=True)
+            return None
+
+        # Return connections to the pool outside of a transaction
+        discard = False
+        try:
+            status = connection.info.transaction_status
+            if status == TRANSACTION_STATUS_UNKNOWN:
+                discard = True
+            elif status != TRANSACTION_STATUS_IDLE:
+                connection.rollback()
+        except Exception:
+            discard = True
+        self.pool.putconn(connection, discard=discard)
+        return None
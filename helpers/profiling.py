@@ -0,0 +1,139 @@
+import cProfile
+import collections
+import datetime
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+PROFILING_MODES = ("cprofile", "sample")
+
+
+class StackSampler:
+    """
+    Samples the call stack of a thread at a fixed interval.
+
+    Samples are aggregated as collapsed stacks ("frame;frame;frame count" lines),
+    the input format of flame graph tools.
+    """
+    def __init__(self, thread_id: Optional[int] = None, interval: float = 0.005) -> None:
+        """
+        :param thread_id: The id of the thread to sample. Defaults to the current thread.
+        :param interval: Number of seconds between samples.
+        """
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.stacks: Dict[str, int] = collections.Counter()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+
+    def _sample(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_filename}:{code.co_name}:{frame.f_lineno}")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._sample, name="stack-sampler", daemon=True)
+        self._thread.start()
+        return None
+
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return None
+
+
+    def dump(self, path: str) -> None:
+        """Write the collapsed stacks to a file"""
+        with open(path, "w", encoding="utf-8") as file:
+            for stack, count in self.stacks.items():
+                file.write(f"{stack} {count}\n")
+        return None
+
+
+
+def run_profiled(mode: str, path: str, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Tuple[Any, str]:
+    """
+    Call a function under a profiler and write the profile to a file.
+
+    :param mode: "cprofile" to write `pstats` data, or "sample" to write collapsed stacks.
+    :param path: The path of the profile file, without an extension.
+    :return: The return value of the function and the path of the written profile file.
+    """
+    if mode not in PROFILING_MODES:
+        raise ValueError(f"Unsupported profiling mode '{mode}'. Supported modes are: {', '.join(PROFILING_MODES)}")
+
+    if mode == "cprofile":
+        profiler = cProfile.Profile()
+        try:
+            result = profiler.runcall(func, *args, **kwargs)
+        finally:
+            path = f"{path}.prof"
+            profiler.dump_stats(path)
+        return result, path
+
+    sampler = StackSampler()
+    sampler.start()
+    try:
+        result = func(*args, **kwargs)
+    finally:
+        sampler.stop()
+        path = f"{path}.folded"
+        sampler.dump(path)
+    return result, path
+
+
+def get_profile_name(view_name: str, query_string: str) -> str:
+    """
+    Returns a unique file name for a profile, tagged with the view name
+    and a hash of the query string, so that profiles of the same query can be grouped.
+    """
+    timestamp = datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+    view = re.sub(r"[^A-Za-z0-9_-]+", "_", view_name)
+    query_hash = hashlib.sha1(query_string.encode()).hexdigest()[:8]
+    return f"{timestamp}-{view}-{query_hash}"
+
+
+def write_profile_metadata(profile_path: str, metadata: Dict[str, Any]) -> None:
+    """Write the metadata of a profile, like the view name and query params, next to the profile file"""
+    with open(f"{os.path.splitext(profile_path)[0]}.json", "w", encoding="utf-8") as file:
+        json.dump(metadata, file, indent=2, default=str)
+    return None
+
+
+def prune_profiles(directory: str, max_files: int, max_bytes: int) -> None:
+    """
+    Delete the oldest files in the profiles directory, until there are
+    at most `max_files` files, taking up at most `max_bytes` bytes.
+    """
+    files: List[Tuple[float, int, str]] = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_file():
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+
+    files.sort()
+    total_bytes = sum(size for _, size, _ in files)
+    while files and (len(files) > max_files or total_bytes > max_bytes):
+        _, size, path = files.pop(0)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total_bytes -= size
+    return None
@@ -89,6 +89,41 @@ class QueryDictQuerySetFilterer:
         return aggregate
             
 
+    @classmethod
+    def get_signature(cls, querydict: Union[request.QueryDict, Mapping[str, Any]]) -> str:
+        """
+        Returns a normalized signature of the filters in the querydict. 
+        
+        Querydicts that only differ in filter values have the same signature, 
+        so the signature can be used to group requests that generate similar queries.
+        Query parameters that are not filters, e.g. pagination, are left out.
+        """
+        parts = sorted(
+            cls.get_signature_part(key, value) for key, value in querydict.items() if value and cls.is_filter(key)
+        )
+        return "&".join(parts)
+    
+
+    @classmethod
+    def is_filter(cls, key: str) -> bool:
+        """
+        Returns whether a query parameter is a filter, that is, whether it has a `parse_<key>` method.
+
+        Override if `parse_<key>` methods are provided dynamically.
+        """
+        return callable(getattr(cls, f"parse_{key}", None))
+    
+
+    @classmethod
+    def get_signature_part(cls, key: str, value: str) -> str:
+        """
+        Returns the part of the filter signature for a query parameter. Defaults to the key.
+        
+        Override to include (a normalized) value for parameters whose value changes the shape of the query.
+        """
+        return key
+            
+
     def apply_filters(self, qs: BaseManager[M], raise_errors: bool = True) -> BaseManager[M]:
         """
         Apply query filters to queryset
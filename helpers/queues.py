@@ -0,0 +1,384 @@
+import json
+import sqlite3
+import time
+from typing import Any, Dict, List, NamedTuple, Optional
+from urllib.parse import urlparse
+from django.core.serializers.json import DjangoJSONEncoder
+
+
+class QueueEntry(NamedTuple):
+    """An entry read from a durable queue"""
+    id: str
+    data: Dict[str, Any]
+    # Time the entry was appended, in seconds since the epoch
+    enqueued_at: float
+    # Number of times the entry was delivered to a consumer, including this delivery
+    deliveries: int = 1
+
+
+
+class DurableQueue:
+    """
+    Durable queue of JSON serializable entries, consumed with at-least-once semantics.
+
+    Entries read by a consumer are claimed until they are acknowledged. Entries that are not
+    acknowledged within `claim_timeout` seconds, e.g. because the consumer died, are delivered again.
+    Entries that keep failing can be moved to the dead letters of the queue, to be inspected.
+    """
+
+    def append(self, items: List[Dict[str, Any]]) -> List[str]:
+        """
+        Append entries to the queue.
+
+        :return: The ids of the appended entries
+        """
+        raise NotImplementedError
+
+
+    def read(self, consumer: str, count: int, block: float = 0) -> List[QueueEntry]:
+        """
+        Claim up to `count` entries for a consumer, oldest first.
+
+        :param consumer: Name of the consumer, unique per consumer process
+        :param count: Maximum number of entries to return
+        :param block: Seconds to wait for entries if there are none
+        """
+        raise NotImplementedError
+
+
+    def ack(self, ids: List[str]) -> None:
+        """Acknowledge entries, removing them from the queue"""
+        raise NotImplementedError
+
+
+    def dead_letter(self, entries: List[QueueEntry]) -> None:
+        """Move entries to the dead letters of the queue, removing them from the queue"""
+        raise NotImplementedError
+
+
+    def dead_letters(self, count: int = 100) -> List[QueueEntry]:
+        """Returns up to `count` dead letters, oldest first"""
+        raise NotImplementedError
+
+
+    def lag(self) -> float:
+        """Returns the age in seconds of the oldest entry not yet acknowledged, or 0 if there is none"""
+        raise NotImplementedError
+
+
+    def close(self) -> None:
+        return None
+
+
+
+class RedisStreamQueue(DurableQueue):
+    """
+    Durable queue backed by a Redis stream, consumed by a consumer group.
+
+    Acknowledged entries are deleted from the stream, so that the stream only
+    holds entries that are not yet acknowledged. Dead letters are kept in the "<name>:dead" stream.
+    """
+
+    def __init__(self, url: str, name: str, group: str = "workers", claim_timeout: float = 60.0) -> None:
+        """
+        :param url: Redis URL, e.g. "redis://localhost:6379/0"
+        :param name: Key of the stream
+        :param group: Name of the consumer group
+        :param claim_timeout: Seconds after which unacknowledged entries are delivered again
+        """
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.name = name
+        self.dead_letter_name = f"{name}:dead"
+        self.group = group
+        self.claim_timeout = claim_timeout
+        self._group_created = False
+
+
+    def _ensure_group(self) -> None:
+        import redis
+
+        if self._group_created:
+            return
+        try:
+            self.client.xgroup_create(self.name, self.group, id="0", mkstream=True)
+        except redis.ResponseError as exc:
+            if "BUSYGROUP" not in str(exc):
+                raise
+        self._group_created = True
+        return None
+
+
+    @staticmethod
+    def _decode(entry_id: Any, fields: Dict, deliveries: int = 1) -> QueueEntry:
+        entry_id = entry_id.decode() if isinstance(entry_id, bytes) else entry_id
+        # Stream ids start with the time the entry was added in milliseconds
+        enqueued_at = int(entry_id.split("-")[0]) / 1000
+        return QueueEntry(entry_id, json.loads(fields[b"data"]), enqueued_at, deliveries)
+
+
+    def _get_deliveries(self, ids: List[str]) -> List[int]:
+        """Returns the number of times pending entries were delivered, as counted by the consumer group"""
+        pipeline = self.client.pipeline(transaction=False)
+        for entry_id in ids:
+            pipeline.xpending_range(self.name, self.group, min=entry_id, max=entry_id, count=1)
+        return [pending[0]["times_delivered"] if pending else 1 for pending in pipeline.execute()]
+
+
+    def append(self, items: List[Dict[str, Any]]) -> List[str]:
+        pipeline = self.client.pipeline(transaction=False)
+        for item in items:
+            pipeline.xadd(self.name, {"data": json.dumps(item, cls=DjangoJSONEncoder)})
+        return [entry_id.decode() for entry_id in pipeline.execute()]
+
+
+    def read(self, consumer: str, count: int, block: float = 0) -> List[QueueEntry]:
+        self._ensure_group()
+        # Entries claimed by consumers that did not acknowledge them in time
+        _, claimed, *_ = self.client.xautoclaim(
+            self.name, self.group, consumer, min_idle_time=int(self.claim_timeout * 1000), count=count
+        )
+        claimed = [(entry_id, fields) for entry_id, fields in claimed if fields]
+        deliveries = self._get_deliveries([entry_id for entry_id, _ in claimed]) if claimed else []
+        entries = [
+            self._decode(entry_id, fields, times_delivered)
+            for (entry_id, fields), times_delivered in zip(claimed, deliveries)
+        ]
+        if len(entries) < count:
+            response = self.client.xreadgroup(
+                self.group,
+                consumer,
+                {self.name: ">"},
+                count=count - len(entries),
+                block=int(block * 1000) if block > 0 and not entries else None
+            )
+            for _, stream_entries in response or []:
+                entries.extend(self._decode(entry_id, fields) for entry_id, fields in stream_entries)
+        return entries
+
+
+    def ack(self, ids: List[str]) -> None:
+        if not ids:
+            return None
+        pipeline = self.client.pipeline()
+        pipeline.xack(self.name, self.group, *ids)
+        pipeline.xdel(self.name, *ids)
+        pipeline.execute()
+        return None
+
+
+    def dead_letter(self, entries: List[QueueEntry]) -> None:
+        if not entries:
+            return None
+        pipeline = self.client.pipeline()
+        for entry in entries:
+            pipeline.xadd(self.dead_letter_name, {
+                "data": json.dumps(entry.data, cls=DjangoJSONEncoder),
+                "entry_id": entry.id,
+                "deliveries": entry.deliveries,
+            })
+        pipeline.xack(self.name, self.group, *[entry.id for entry in entries])
+        pipeline.xdel(self.name, *[entry.id for entry in entries])
+        pipeline.execute()
+        return None
+
+
+    def dead_letters(self, count: int = 100) -> List[QueueEntry]:
+        return [
+            self._decode(fields[b"entry_id"], fields, int(fields[b"deliveries"]))
+            for _, fields in self.client.xrange(self.dead_letter_name, count=count)
+        ]
+
+
+    def lag(self) -> float:
+        oldest = self.client.xrange(self.name, count=1)
+        if not oldest:
+            return 0.0
+        entry_id, fields = oldest[0]
+        return max(time.time() - self._decode(entry_id, fields).enqueued_at, 0.0)
+
+
+    def close(self) -> None:
+        self.client.close()
+        return None
+
+
+
+class SQLiteQueue(DurableQueue):
+    """
+    Durable queue backed by a SQLite database file.
+
+    A stand-in for `RedisStreamQueue` for tests and local development, without a Redis server.
+    Can be shared by processes on the same machine. Dead letters are kept in the `dead_letters` table.
+    """
+
+    def __init__(self, path: str, claim_timeout: float = 60.0, poll_interval: float = 0.05) -> None:
+        """
+        :param path: Path of the database file, created if it does not exist
+        :param claim_timeout: Seconds after which unacknowledged entries are delivered again
+        :param poll_interval: Seconds between checks for new entries while blocking
+        """
+        self.path = path
+        self.claim_timeout = claim_timeout
+        self.poll_interval = poll_interval
+        connection = self._connect()
+        try:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS queue_entries ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "data TEXT NOT NULL, "
+                "enqueued_at REAL NOT NULL, "
+                "consumer TEXT, "
+                "claimed_at REAL, "
+                "deliveries INTEGER NOT NULL DEFAULT 0)"
+            )
+            columns = {row[1] for row in connection.execute("PRAGMA table_info(queue_entries)")}
+            if "deliveries" not in columns:
+                # Files created before entries counted their deliveries
+                connection.execute("ALTER TABLE queue_entries ADD COLUMN deliveries INTEGER NOT NULL DEFAULT 0")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS dead_letters ("
+                "id INTEGER PRIMARY KEY, "
+                "data TEXT NOT NULL, "
+                "enqueued_at REAL NOT NULL, "
+                "deliveries INTEGER NOT NULL, "
+                "dead_at REAL NOT NULL)"
+            )
+        finally:
+            connection.close()
+
+
+    def _connect(self) -> sqlite3.Connection:
+        # Connections are not shared, so that the queue can be used from any thread
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+
+    def append(self, items: List[Dict[str, Any]]) -> List[str]:
+        now = time.time()
+        connection = self._connect()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            ids = [
+                str(connection.execute(
+                    "INSERT INTO queue_entries (data, enqueued_at) VALUES (?, ?)",
+                    (json.dumps(item, cls=DjangoJSONEncoder), now)
+                ).lastrowid)
+                for item in items
+            ]
+            connection.execute("COMMIT")
+        finally:
+            connection.close()
+        return ids
+
+
+    def _claim(self, consumer: str, count: int) -> List[QueueEntry]:
+        now = time.time()
+        connection = self._connect()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            rows = connection.execute(
+                "SELECT id, data, enqueued_at, deliveries + 1 FROM queue_entries "
+                "WHERE claimed_at IS NULL OR claimed_at < ? ORDER BY id LIMIT ?",
+                (now - self.claim_timeout, count)
+            ).fetchall()
+            connection.executemany(
+                "UPDATE queue_entries SET consumer = ?, claimed_at = ?, deliveries = deliveries + 1 WHERE id = ?",
+                [(consumer, now, row[0]) for row in rows]
+            )
+            connection.execute("COMMIT")
+        finally:
+            connection.close()
+        return [
+            QueueEntry(str(entry_id), json.loads(data), enqueued_at, deliveries)
+            for entry_id, data, enqueued_at, deliveries in rows
+        ]
+
+
+    def read(self, consumer: str, count: int, block: float = 0) -> List[QueueEntry]:
+        deadline = time.monotonic() + block
+        while True:
+            entries = self._claim(consumer, count)
+            remaining = deadline - time.monotonic()
+            if entries or remaining <= 0:
+                return entries
+            time.sleep(min(self.poll_interval, remaining))
+
+
+    def ack(self, ids: List[str]) -> None:
+        if not ids:
+            return None
+        connection = self._connect()
+        try:
+            connection.executemany("DELETE FROM queue_entries WHERE id = ?", [(int(entry_id),) for entry_id in ids])
+        finally:
+            connection.close()
+        return None
+
+
+    def dead_letter(self, entries: List[QueueEntry]) -> None:
+        if not entries:
+            return None
+        now = time.time()
+        connection = self._connect()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.executemany(
+                "INSERT OR REPLACE INTO dead_letters (id, data, enqueued_at, deliveries, dead_at) VALUES (?, ?, ?, ?, ?)",
+                [
+                    (int(entry.id), json.dumps(entry.data, cls=DjangoJSONEncoder), entry.enqueued_at, entry.deliveries, now)
+                    for entry in entries
+                ]
+            )
+            connection.executemany("DELETE FROM queue_entries WHERE id = ?", [(int(entry.id),) for entry in entries])
+            connection.execute("COMMIT")
+        finally:
+            connection.close()
+        return None
+
+
+    def dead_letters(self, count: int = 100) -> List[QueueEntry]:
+        connection = self._connect()
+        try:
+            rows = connection.execute(
+                "SELECT id, data, enqueued_at, deliveries FROM dead_letters ORDER BY id LIMIT ?", (count,)
+            ).fetchall()
+        finally:
+            connection.close()
+        return [
+            QueueEntry(str(entry_id), json.loads(data), enqueued_at, deliveries)
+            for entry_id, data, enqueued_at, deliveries in rows
+        ]
+
+
+    def lag(self) -> float:
+        connection = self._connect()
+        try:
+            (oldest,) = connection.execute("SELECT MIN(enqueued_at) FROM queue_entries").fetchone()
+        finally:
+            connection.close()
+        if oldest is None:
+            return 0.0
+        return max(time.time() - oldest, 0.0)
+
+
+
+def get_queue(url: str, name: str, claim_timeout: float = 60.0) -> DurableQueue:
+    """
+    Returns the durable queue at a URL.
+
+    :param url: "redis://..." or "rediss://..." for a `RedisStreamQueue`,
+    or "sqlite:///<path>" for a `SQLiteQueue`
+    :param name: Name of the queue, the key of the stream for Redis
+    :param claim_timeout: Seconds after which unacknowledged entries are delivered again
+    """
+    scheme = urlparse(url).scheme
+    if scheme in ("redis", "rediss", "unix"):
+        return RedisStreamQueue(url, name, claim_timeout=claim_timeout)
+    if scheme == "sqlite":
+        path: Optional[str] = url[len("sqlite:///"):] if url.startswith("sqlite:///") else None
+        if not path:
+            raise ValueError(f"Invalid SQLite queue URL '{url}', expected 'sqlite:///<path>'")
+        return SQLiteQueue(path, claim_timeout=claim_timeout)
+    raise ValueError(f"Unsupported queue URL '{url}'")
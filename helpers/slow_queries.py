@@ -0,0 +1,155 @@
+import contextlib
+import contextvars
+import datetime
+import json
+import random
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional
+from django.conf import settings
+from django.db import transaction
+
+from .logging import log_exception
+
+
+# Tag of the queries being executed, e.g. the filter signature of a screener request,
+# so that slow queries can be grouped by the request parameters that caused them
+current_query_tag: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("current_query_tag", default=None)
+
+# Set while a query is being explained, so that EXPLAIN queries are not logged themselves
+_explaining: contextvars.ContextVar[bool] = contextvars.ContextVar("_explaining", default=False)
+
+_log_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def tag_queries(tag: str) -> Iterator[None]:
+    """Context manager that tags all queries executed in the block, in slow query log entries"""
+    token = current_query_tag.set(tag)
+    try:
+        yield
+    finally:
+        current_query_tag.reset(token)
+
+
+def normalize_sql(sql: str) -> str:
+    """Normalize SQL so that queries differing only in the number of parameters of IN clauses are grouped"""
+    sql = re.sub(r"\(\s*%s(?:\s*,\s*%s)+\s*\)", "(%s, ...)", sql)
+    return " ".join(sql.split())
+
+
+def get_query_shape(sql: str) -> str:
+    """Replace literals in SQL with placeholders, so that queries differing only in their parameters are grouped"""
+    sql = re.sub(r"'(?:[^']|'')*'", "?", sql)
+    sql = re.sub(r"(?<![\w.\"])-?\d+(?:\.\d+)?(?:e[-+]?\d+)?", "?", sql)
+    sql = re.sub(r"\(\s*\?(?:\s*,\s*\?)+\s*\)", "(?, ...)", sql)
+    return " ".join(sql.split())
+
+
+def redact_plan(plan: str) -> str:
+    """
+    Replace the string literals of an execution plan, e.g. the values of parameters in
+    filter conditions, with placeholders. Numbers are kept, as costs and row counts are numbers.
+    """
+    return re.sub(r"'(?:[^']|'')*'", "'?'", plan)
+
+
+def explain_query(connection: Any, sql: str, params: Any) -> Optional[str]:
+    """
+    Returns the execution plan of a query.
+
+    On PostgreSQL, the query is executed again with `EXPLAIN (ANALYZE, BUFFERS)`,
+    in a savepoint so that a failure does not break the current transaction.
+    Other databases return the plan without executing the query.
+    """
+    if connection.vendor == "postgresql":
+        prefix = "EXPLAIN (ANALYZE, BUFFERS)"
+    elif connection.vendor == "sqlite":
+        prefix = "EXPLAIN QUERY PLAN"
+    else:
+        prefix = "EXPLAIN"
+
+    token = _explaining.set(True)
+    try:
+        with transaction.atomic(using=connection.alias):
+            with connection.cursor() as cursor:
+                cursor.execute(f"{prefix} {sql}", params)
+                rows = cursor.fetchall()
+    except Exception as exc:
+        log_exception(exc)
+        return None
+    finally:
+        _explaining.reset(token)
+    return "\n".join(" ".join(str(column) for column in row) for row in rows)
+
+
+def write_slow_query_log_entry(entry: Dict[str, Any]) -> None:
+    """Append an entry to the slow query log file"""
+    line = json.dumps(entry, default=str)
+    with _log_lock, open(settings.SLOW_QUERY_LOG_PATH, "a", encoding="utf-8") as file:
+        file.write(line + "\n")
+    return None
+
+
+def log_slow_query(execute: Callable, sql: str, params: Any, many: bool, context: dict) -> Any:
+    """
+    Database execute wrapper that logs queries slower than `settings.SLOW_QUERY_THRESHOLD_MS`
+    to `settings.SLOW_QUERY_LOG_PATH`, one JSON object per line.
+
+    Parameters are not logged, and literals are removed from the logged SQL and plans,
+    as they may contain user data or secrets.
+
+    The execution plan of a sample of slow SELECT queries, set by
+    `settings.SLOW_QUERY_EXPLAIN_SAMPLE_RATE`, is captured with the entry.
+    """
+    if _explaining.get():
+        return execute(sql, params, many, context)
+
+    start = time.perf_counter()
+    result = execute(sql, params, many, context)
+    duration_ms = (time.perf_counter() - start) * 1000
+    if duration_ms < settings.SLOW_QUERY_THRESHOLD_MS:
+        return result
+
+    try:
+        connection = context["connection"]
+        plan = None
+        if (
+            not many
+            and sql.lstrip().upper().startswith("SELECT")
+            and random.random() < settings.SLOW_QUERY_EXPLAIN_SAMPLE_RATE
+        ):
+            plan = explain_query(connection, sql, params)
+            plan = redact_plan(plan) if plan is not None else None
+        write_slow_query_log_entry({
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "database": connection.alias,
+            "duration_ms": duration_ms,
+            "tag": current_query_tag.get(),
+            "sql": get_query_shape(normalize_sql(sql)),
+            "plan": plan,
+        })
+    except Exception as exc:
+        # Logging slow queries should never break the query
+        log_exception(exc)
+    return result
+
+
+def install_slow_query_logger(sender: Any, connection: Any, **kwargs: Any) -> None:
+    """`connection_created` signal receiver that installs `log_slow_query` on new database connections"""
+    if log_slow_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(log_slow_query)
+    return None
+
+
+def read_slow_query_log(path: str) -> List[Dict[str, Any]]:
+    """Read the entries of a slow query log file, skipping invalid lines"""
+    entries = []
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            try:
+                entries.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return entries
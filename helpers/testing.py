@@ -0,0 +1,172 @@
+import contextlib
+import contextvars
+import os
+import time
+import warnings
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.test import TestCase
+from rest_framework_api_key.models import APIKey
+
+from tokens.models import AuthToken
+from .slow_queries import get_query_shape
+
+
+# Latency budgets are multiplied by this factor, to allow for slower machines, e.g. CI runners.
+# Wall-clock time depends on the machine and its load, so latency budgets are only enforced if
+# the factor is set. Otherwise, a warning is issued when a latency budget is exceeded.
+LATENCY_BUDGET_SCALE = float(os.getenv("TEST_LATENCY_BUDGET_SCALE")) if os.getenv("TEST_LATENCY_BUDGET_SCALE") else None
+
+# Number of currencies to seed, for tests that check budgets at several dataset sizes
+DATASET_SIZES = (10, 100, 500)
+
+
+# Queries executed in the current context, while capturing queries
+_captured_queries: contextvars.ContextVar[Optional[List[Dict]]] = contextvars.ContextVar("_captured_queries", default=None)
+
+
+def capture_query(execute: Callable, sql: str, params: Any, many: bool, context: dict) -> Any:
+    """Database execute wrapper that records queries executed while capturing queries"""
+    queries = _captured_queries.get()
+    if queries is None:
+        return execute(sql, params, many, context)
+
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        duration = time.perf_counter() - start
+        try:
+            sql = context["connection"].ops.last_executed_query(context["cursor"], sql, params)
+        except Exception:
+            pass
+        queries.append({"sql": sql, "time": duration})
+
+
+def install_query_capture(sender: Any, connection: Any, **kwargs: Any) -> None:
+    """`connection_created` signal receiver that installs `capture_query` on new database connections"""
+    if capture_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(capture_query)
+    return None
+
+
+connection_created.connect(install_query_capture, dispatch_uid="install_query_capture")
+
+
+@contextlib.contextmanager
+def capture_queries() -> Iterator[List[Dict]]:
+    """
+    Context manager that captures the queries executed in the block.
+
+    Unlike `CaptureQueriesContext`, queries are captured on all connections, including
+    those of the threads that async ORM calls and sync views run in under ASGI.
+    """
+    for connection in connections.all(initialized_only=True):
+        install_query_capture(None, connection)
+    queries: List[Dict] = []
+    token = _captured_queries.set(queries)
+    try:
+        yield queries
+    finally:
+        _captured_queries.reset(token)
+
+
+def format_queries(queries: List[Dict]) -> str:
+    """
+    Format captured queries for a budget failure message.
+
+    Queries executed more than once with different parameters are listed first,
+    as they usually point at a query executed per object (N+1 queries).
+    """
+    shapes: Dict[str, List[Dict]] = {}
+    for query in queries:
+        shapes.setdefault(get_query_shape(query["sql"]), []).append(query)
+
+    lines = []
+    repeated = {shape: group for shape, group in shapes.items() if len(group) > 1}
+    if repeated:
+        lines.append("Repeated queries:")
+        for shape, group in sorted(repeated.items(), key=lambda item: -len(item[1])):
+            total_ms = sum(float(query["time"]) for query in group) * 1000
+            lines.append(f"  {len(group)}x ({total_ms:.1f}ms) {shape}")
+    lines.append("Queries:")
+    for index, query in enumerate(queries, start=1):
+        lines.append(f"  {index}. ({float(query['time']) * 1000:.1f}ms) {query['sql']}")
+    return "\n".join(lines)
+
+
+
+class BudgetTestCase(TestCase):
+    """
+    Test case for checking that API endpoints stay within a query and latency budget.
+
+    Requests are made with a valid API key. Use `authenticate` to also make them as an authenticated user.
+    """
+
+    @classmethod
+    def setUpTestData(cls) -> None:
+        super().setUpTestData()
+        _, cls.api_key = APIKey.objects.create_key(name="tests")
+
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.client.defaults["HTTP_X_API_KEY"] = self.api_key
+
+
+    def authenticate(self, user) -> AuthToken:
+        """Make subsequent requests of the test client as the given user"""
+        token, _ = AuthToken.objects.get_or_create(user=user)
+        self.client.defaults["HTTP_AUTHORIZATION"] = f"AuthToken {token.key}"
+        return token
+
+
+    @contextlib.contextmanager
+    def assertWithinBudget(self, max_queries: int, max_ms: float, label: str = "") -> Iterator[List[Dict]]:
+        """
+        Context manager that fails the test if the block executes more than `max_queries` queries
+        or takes longer than `max_ms` milliseconds (scaled by `TEST_LATENCY_BUDGET_SCALE`).
+        If `TEST_LATENCY_BUDGET_SCALE` is not set, exceeding `max_ms` only issues a warning.
+
+        The failure message lists the executed queries, with repeated queries first.
+
+        :param max_queries: Maximum number of queries
+        :param max_ms: Maximum duration of the block in milliseconds
+        :param label: Label of the checked operation, e.g. the endpoint and dataset size
+        """
+        with capture_queries() as queries:
+            start = time.perf_counter()
+            yield queries
+            elapsed_ms = (time.perf_counter() - start) * 1000
+        self.check_budget(queries, elapsed_ms, max_queries, max_ms, label)
+        return None
+
+
+    @contextlib.asynccontextmanager
+    async def aassertWithinBudget(self, max_queries: int, max_ms: float, label: str = "") -> AsyncIterator[List[Dict]]:
+        """Async version of `assertWithinBudget`, for async tests"""
+        with capture_queries() as queries:
+            start = time.perf_counter()
+            yield queries
+            elapsed_ms = (time.perf_counter() - start) * 1000
+        self.check_budget(queries, elapsed_ms, max_queries, max_ms, label)
+        return
+
+
+    def check_budget(self, queries: List[Dict], elapsed_ms: float, max_queries: int, max_ms: float, label: str) -> None:
+        problems = []
+        if len(queries) > max_queries:
+            problems.append(f"{len(queries)} queries executed, budget is {max_queries}")
+        if LATENCY_BUDGET_SCALE is None:
+            if elapsed_ms > max_ms:
+                warnings.warn(
+                    f"{label or 'Block'} took {elapsed_ms:.1f}ms, latency budget is {max_ms:.1f}ms. "
+                    "Set TEST_LATENCY_BUDGET_SCALE to enforce latency budgets.",
+                    stacklevel=2
+                )
+        elif elapsed_ms > max_ms * LATENCY_BUDGET_SCALE:
+            problems.append(f"took {elapsed_ms:.1f}ms, budget is {max_ms * LATENCY_BUDGET_SCALE:.1f}ms")
+        if problems:
+            self.fail(f"{label or 'Block'} exceeded its budget: {'; '.join(problems)}.\n{format_queries(queries)}")
+        return None
@@ -0,0 +1,213 @@
+import atexit
+import contextvars
+import dataclasses
+import json
+import queue
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .logging import log_exception
+
+
+# Timestamps are nanoseconds since the epoch (`time.time_ns()`), so that spans
+# recorded by different processes, e.g. the web and websocket workers, can be compared.
+
+
+@dataclasses.dataclass
+class Span:
+    """A timed hop of a trace"""
+    trace_id: str
+    name: str
+    start_ns: int
+    end_ns: int
+    attributes: Dict[str, Any] = dataclasses.field(default_factory=dict)
+
+    @property
+    def duration_ms(self) -> float:
+        return (self.end_ns - self.start_ns) / 1_000_000
+
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "start_ns": self.start_ns,
+            "end_ns": self.end_ns,
+            "duration_ms": self.duration_ms,
+            "attributes": self.attributes,
+        }
+
+
+
+@dataclasses.dataclass
+class Trace:
+    """The trace of a write, from the time it was received"""
+    trace_id: str = dataclasses.field(default_factory=lambda: uuid.uuid4().hex)
+    received_ns: int = dataclasses.field(default_factory=time.time_ns)
+
+
+current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("current_trace", default=None)
+
+
+
+class SpanExporter:
+    """Base class for span exporters. Subclasses should override `export`"""
+
+    def export(self, span: Span) -> None:
+        raise NotImplementedError
+
+
+
+class NullSpanExporter(SpanExporter):
+    """Discards all spans. Used when tracing is disabled"""
+
+    def export(self, span: Span) -> None:
+        return None
+
+
+
+class InMemorySpanExporter(SpanExporter):
+    """Keeps exported spans in memory. Useful in tests"""
+
+    def __init__(self) -> None:
+        self.spans: List[Span] = []
+
+
+    def export(self, span: Span) -> None:
+        self.spans.append(span)
+        return None
+
+
+    def clear(self) -> None:
+        self.spans.clear()
+        return None
+
+
+
+class FileSpanExporter(SpanExporter):
+    """
+    Appends exported spans to a file, one JSON object per line.
+
+    Spans are queued and written in batches by a background thread, so that exporting a span
+    never blocks on file I/O, e.g. in the event loop of a websocket consumer. If the queue is full,
+    e.g. because the disk is slow, spans are dropped and counted in `dropped`.
+    Queued spans are written when the process exits.
+    """
+
+    def __init__(self, path: str, max_queue_size: int = 10_000) -> None:
+        """
+        :param path: The file spans are appended to
+        :param max_queue_size: Maximum number of spans waiting to be written
+        """
+        self.path = path
+        self.dropped = 0
+        self._queue: queue.Queue[Span] = queue.Queue(maxsize=max_queue_size)
+        self._writer: Optional[threading.Thread] = None
+        self._writer_lock = threading.Lock()
+
+
+    def export(self, span: Span) -> None:
+        self._start_writer()
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+        return None
+
+
+    def flush(self) -> None:
+        """Wait until all queued spans are written"""
+        if self._writer is not None:
+            self._queue.join()
+        return None
+
+
+    def _start_writer(self) -> None:
+        if self._writer is not None:
+            return None
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_spans, name="span-exporter", daemon=True)
+                self._writer.start()
+                atexit.register(self.flush)
+        return None
+
+
+    def _write_spans(self) -> None:
+        while True:
+            # Write the spans queued so far at once
+            spans = [self._queue.get()]
+            while True:
+                try:
+                    spans.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with open(self.path, "a", encoding="utf-8") as file:
+                    file.writelines(json.dumps(span.to_dict()) + "\n" for span in spans)
+            except Exception as exc:
+                log_exception(exc)
+            finally:
+                for _ in spans:
+                    self._queue.task_done()
+
+
+
+_span_exporter: Optional[SpanExporter] = None
+
+
+def get_span_exporter() -> SpanExporter:
+    """
+    Returns the span exporter configured by `settings.TRACING_EXPORTER`,
+    a dotted path to a `SpanExporter` subclass, instantiated with `settings.TRACING_EXPORTER_OPTIONS`.
+    """
+    global _span_exporter
+    if _span_exporter is None:
+        exporter_path = getattr(settings, "TRACING_EXPORTER", None)
+        if not exporter_path:
+            _span_exporter = NullSpanExporter()
+        else:
+            exporter_class = import_string(exporter_path)
+            _span_exporter = exporter_class(**getattr(settings, "TRACING_EXPORTER_OPTIONS", {}))
+    return _span_exporter
+
+
+def set_span_exporter(exporter: Optional[SpanExporter]) -> None:
+    """Replace the span exporter. If None, the exporter is reloaded from settings on next use"""
+    global _span_exporter
+    _span_exporter = exporter
+    return None
+
+
+def tracing_enabled() -> bool:
+    return not isinstance(get_span_exporter(), NullSpanExporter)
+
+
+def get_or_start_trace() -> Trace:
+    """Returns the current trace, or a new trace if there is none, e.g. for writes made outside requests"""
+    return current_trace.get() or Trace()
+
+
+def record_span(trace_id: str, name: str, start_ns: int, end_ns: Optional[int] = None, **attributes: Any) -> None:
+    """
+    Export a span of a trace. Errors raised by the exporter are logged and ignored.
+
+    :param trace_id: The id of the trace the span belongs to
+    :param name: The name of the span, e.g. "websocket_send"
+    :param start_ns: Start time of the span in nanoseconds since the epoch
+    :param end_ns: End time of the span in nanoseconds since the epoch. Defaults to now.
+    :param attributes: Additional attributes of the span
+    """
+    exporter = get_span_exporter()
+    if isinstance(exporter, NullSpanExporter):
+        return None
+    span = Span(trace_id, name, start_ns, end_ns or time.time_ns(), attributes)
+    try:
+        exporter.export(span)
+    except Exception as exc:
+        log_exception(exc)
+    return None
@@ -0,0 +1,94 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core import mail
+
+from helpers.testing import BudgetTestCase, DATASET_SIZES
+from tokens.models import AuthToken, PasswordResetToken
+from users.password_reset import create_password_reset_token
+
+
+ACCOUNTS_URL = "/api/v1/accounts/"
+
+UserModel = get_user_model()
+
+
+
+class AccountEndpointBudgetTests(BudgetTestCase):
+    """Query and latency budgets of the `/api/v1/accounts/` endpoints, at several numbers of user accounts"""
+
+    password = "password"
+
+    def seed(self, users: int) -> UserModel:
+        """Create `users` user accounts and return the last one"""
+        UserModel.objects.all().delete()
+        password = make_password(self.password)
+        accounts = UserModel.objects.bulk_create([
+            UserModel(email=f"user{index:05d}@example.com", password=password)
+            for index in range(users)
+        ])
+        return accounts[-1]
+
+
+    def test_authentication(self) -> None:
+        url = f"{ACCOUNTS_URL}auth/"
+        for size in DATASET_SIZES:
+            user = self.seed(size)
+            with self.subTest(users=size, token="new"):
+                with self.assertWithinBudget(5, 300, f"POST {url} (new token, {size} users)"):
+                    response = self.client.post(url, {"username": user.email, "password": self.password})
+                self.assertEqual(response.status_code, 200)
+
+            with self.subTest(users=size, token="existing"):
+                with self.assertWithinBudget(2, 300, f"POST {url} (existing token, {size} users)"):
+                    response = self.client.post(url, {"username": user.email, "password": self.password})
+                self.assertEqual(response.status_code, 200)
+
+
+    def test_logout(self) -> None:
+        url = f"{ACCOUNTS_URL}logout/"
+        for size in DATASET_SIZES:
+            user = self.seed(size)
+            self.authenticate(user)
+            with self.subTest(users=size):
+                with self.assertWithinBudget(3, 300, f"GET {url} ({size} users)"):
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertFalse(AuthToken.objects.filter(user=user).exists())
+            self.client.defaults.pop("HTTP_AUTHORIZATION")
+
+
+    def test_password_reset_request(self) -> None:
+        url = f"{ACCOUNTS_URL}request-password-reset/"
+        for size in DATASET_SIZES:
+            user = self.seed(size)
+            with self.subTest(users=size):
+                with self.assertWithinBudget(5, 300, f"POST {url} ({size} users)"):
+                    response = self.client.post(url, {"email": user.email})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(mail.outbox[-1].to, [user.email])
+
+
+    def test_password_reset_token_validation(self) -> None:
+        url = f"{ACCOUNTS_URL}validate-reset-token/"
+        for size in DATASET_SIZES:
+            user = self.seed(size)
+            token = create_password_reset_token(user, validity_period_in_hours=1)
+            with self.subTest(users=size):
+                with self.assertWithinBudget(2, 300, f"POST {url} ({size} users)"):
+                    response = self.client.post(url, {"token": token})
+                self.assertEqual(response.status_code, 200)
+                self.assertIs(response.json()["data"]["valid"], True)
+
+
+    def test_password_reset(self) -> None:
+        url = f"{ACCOUNTS_URL}reset-password/"
+        for size in DATASET_SIZES:
+            user = self.seed(size)
+            self.authenticate(user)
+            token = create_password_reset_token(user, validity_period_in_hours=1)
+            with self.subTest(users=size):
+                with self.assertWithinBudget(7, 300, f"POST {url} ({size} users)"):
+                    response = self.client.post(url, {"token": token, "new_password": "new-password"})
+                self.assertEqual(response.status_code, 200)
+                self.assertFalse(PasswordResetToken.objects.filter(user=user).exists())
+            self.client.defaults.pop("HTTP_AUTHORIZATION")